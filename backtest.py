@@ -0,0 +1,217 @@
+"""Backtest offline cho chiến lược mua của bot.
+
+Phát lại nến đã lưu qua đúng các hàm của main.py: get_short_term_trend
+(_trend_score), bộ lọc 1h của run_bot (_one_hour_filter), bộ lọc + stop/tp
+của pre_buy_screen (evaluate_entry) và luật thoát của auto_sell_once
+(_exit_reason). Không gọi mạng, không đặt lệnh.
+
+Dữ liệu: thư mục chứa file <SYMBOL>_<tf>.json (list [ts, o, h, l, c, v] của
+ccxt) hoặc .csv cùng cột, ví dụ ETH-USDT_15m.json, ETH-USDT_1h.json,
+ETH-USDT_4h.json, ETH-USDT_1d.json và BTC-USDT_15m.json (khung thiếu file sẽ
+được dựng từ 15m bằng main.resample_ohlcv); hoặc trỏ thẳng tới
+file SQLite của CandleStore (candles.db) mà bot tích luỹ khi chạy.
+
+    python backtest.py --data-dir candles --workers 4
+    python backtest.py --data-dir candles.db
+"""
+import argparse
+import csv
+import json
+import os
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+
+import main as bot
+
+BASE_TF = "15m"
+BTC_SYMBOL = "BTC-USDT"
+
+
+@lru_cache(maxsize=None)
+def _candle_store(path):
+    return bot.CandleStore(path)
+
+
+def load_candles(data_dir, symbol, timeframe):
+    if Path(data_dir).is_file():
+        return _candle_store(str(data_dir)).get(symbol.replace("-", "/"), timeframe)
+    base = Path(data_dir) / f"{symbol}_{timeframe}"
+    json_path, csv_path = base.with_suffix(".json"), base.with_suffix(".csv")
+    if json_path.exists():
+        with open(json_path, encoding="utf-8") as f:
+            rows = json.load(f)
+    elif csv_path.exists():
+        with open(csv_path, encoding="utf-8", newline="") as f:
+            rows = [r for r in csv.reader(f) if r and r[0].strip().lstrip("-").isdigit()]
+    else:
+        return []
+    candles = [[int(float(r[0]))] + [float(x) for x in r[1:6]] for r in rows]
+    candles.sort(key=lambda c: c[0])
+    return candles
+
+
+def load_timeframe(data_dir, symbol, timeframe):
+    """Như load_candles nhưng dựng khung lớn từ nến 15m nếu thiếu file khung đó."""
+    candles = load_candles(data_dir, symbol, timeframe)
+    if candles or timeframe == BASE_TF:
+        return candles
+    base = load_candles(data_dir, symbol, BASE_TF)
+    return bot.resample_ohlcv(base, BASE_TF, timeframe) or [] if base else []
+
+
+def list_symbols(data_dir):
+    if Path(data_dir).is_file():
+        store = _candle_store(str(data_dir))
+        with store._lock:
+            rows = store._conn.execute("SELECT DISTINCT symbol FROM candles WHERE timeframe = ?", (BASE_TF,)).fetchall()
+        return sorted(r[0].replace("/", "-") for r in rows)
+    suffix = f"_{BASE_TF}"
+    symbols = set()
+    for path in Path(data_dir).iterdir():
+        if path.suffix in (".json", ".csv") and path.stem.endswith(suffix):
+            symbols.add(path.stem[: -len(suffix)])
+    return sorted(symbols)
+
+
+def _closed_window(candles, open_times, period_ms, now_ms, limit):
+    # Chỉ lấy nến đã đóng tại thời điểm now_ms để tránh nhìn trước tương lai.
+    end = bisect_right(open_times, now_ms - period_ms)
+    return candles[max(0, end - limit):end]
+
+
+def _simulate_exit(position, bar):
+    """Kiểm tra thoát trong một nến 15m; ưu tiên SL khi cả SL và TP cùng nằm trong nến."""
+    entry_data = {"price": position["entry"], "stop": position["stop"], "tp": position["tp"]}
+    _, o, h, l, _, _ = bar
+    if bot._exit_reason(entry_data, l) == "sl":
+        return "sl", min(o, position["stop"])
+    reason = bot._exit_reason(entry_data, h)
+    if reason == "tp":
+        return "tp", max(o, position["tp"])
+    if reason == "gain":
+        return "gain", max(o, position["entry"] * 1.3)
+    return None, None
+
+
+def backtest_symbol(symbol, data_dir, params=None, step=1, fee=0.001, candles=None):
+    """Chạy backtest cho một symbol; trả về list giao dịch (dict)."""
+    params = dict(bot.UPGRADE if params is None else params)
+    load = candles.get if candles is not None else (lambda key: load_timeframe(data_dir, *key))
+    o15 = load((symbol, BASE_TF)) or []
+    btc15 = load((BTC_SYMBOL, BASE_TF)) or []
+    higher = {tf: load((symbol, tf)) or [] for tf in set(bot.TREND_TIMEFRAMES) | {"1h"}}
+    if len(o15) < 40:
+        return []
+
+    base_ms = bot._tf_seconds(BASE_TF) * 1000
+    btc_times = [c[0] for c in btc15]
+    higher_times = {tf: [c[0] for c in rows] for tf, rows in higher.items()}
+
+    trades = []
+    position = None
+    warmup = max(40, bot.SCREEN_15M_LIMIT)
+    for t in range(warmup - 1, len(o15)):
+        bar = o15[t]
+        if position is not None:
+            reason, price = _simulate_exit(position, bar)
+            if reason:
+                ret = price / position["entry"] * (1 - fee) / (1 + fee) - 1
+                trades.append({
+                    "symbol": symbol,
+                    "entry_time": position["time"],
+                    "exit_time": bar[0] + base_ms,
+                    "entry": position["entry"],
+                    "exit": price,
+                    "reason": reason,
+                    "return": ret,
+                })
+                position = None
+            continue
+        if (t - warmup + 1) % step:
+            continue
+
+        now_ms = bar[0] + base_ms
+        windows = {
+            tf: _closed_window(higher[tf], higher_times[tf], bot._tf_seconds(tf) * 1000, now_ms, 50)
+            for tf in bot.TREND_TIMEFRAMES
+        }
+        trend = bot._trend_label(sum(bot._trend_score(windows[tf]) for tf in bot.TREND_TIMEFRAMES))
+        if trend not in ("TĂNG", "SIDEWAY"):
+            continue
+
+        h1 = _closed_window(higher["1h"], higher_times["1h"], 3600 * 1000, now_ms, 30)
+        if len(h1) < 20:
+            continue
+        reason, _ = bot._one_hour_filter(trend, h1)
+        if reason:
+            continue
+
+        window15 = o15[max(0, t + 1 - bot.SCREEN_15M_LIMIT):t + 1]
+        btc_end = bisect_right(btc_times, bar[0])
+        entry = bar[4]
+        passed, stop, tp, _ = bot.evaluate_entry(window15, btc15[max(0, btc_end - 80):btc_end], entry, params)
+        if passed:
+            position = {"time": now_ms, "entry": entry, "stop": stop, "tp": tp}
+    return trades
+
+
+def _run_one(args):
+    symbol, data_dir, params, step, fee = args
+    return backtest_symbol(symbol, data_dir, params=params, step=step, fee=fee)
+
+
+def summarize(trades, notional=20.0):
+    trades = sorted(trades, key=lambda tr: tr["exit_time"])
+    equity = peak = max_dd = 0.0
+    for tr in trades:
+        equity += tr["return"] * notional
+        peak = max(peak, equity)
+        max_dd = max(max_dd, peak - equity)
+    wins = sum(1 for tr in trades if tr["return"] > 0)
+    by_reason = {}
+    for tr in trades:
+        by_reason[tr["reason"]] = by_reason.get(tr["reason"], 0) + 1
+    return {
+        "trades": len(trades),
+        "hit_rate": wins / len(trades) if trades else 0.0,
+        "pnl_usdt": equity,
+        "avg_return": sum(tr["return"] for tr in trades) / len(trades) if trades else 0.0,
+        "max_drawdown_usdt": max_dd,
+        "exits": by_reason,
+    }
+
+
+def run_backtest(data_dir, symbols=None, params=None, step=1, fee=0.001, workers=None):
+    symbols = symbols or [s for s in list_symbols(data_dir) if s != BTC_SYMBOL]
+    jobs = [(symbol, data_dir, params, step, fee) for symbol in symbols]
+    trades = []
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        for result in pool.map(_run_one, jobs):
+            trades.extend(result)
+    return trades
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backtest offline bộ lọc UPGRADE")
+    parser.add_argument("--data-dir", required=True, help="thư mục chứa file nến <SYMBOL>_<tf>.json/.csv hoặc file candles.db")
+    parser.add_argument("--symbols", nargs="*", help="mặc định: mọi symbol có file 15m")
+    parser.add_argument("--step", type=int, default=1, help="số nến 15m giữa hai lần quét (mô phỏng chu kỳ cron)")
+    parser.add_argument("--fee", type=float, default=0.001, help="phí mỗi chiều")
+    parser.add_argument("--notional", type=float, default=20.0, help="USDT mỗi lệnh khi tính PnL")
+    parser.add_argument("--workers", type=int, help="số process")
+    parser.add_argument("--trades-csv", help="ghi chi tiết giao dịch ra CSV")
+    args = parser.parse_args(argv)
+
+    trades = run_backtest(args.data_dir, args.symbols, step=args.step, fee=args.fee, workers=args.workers)
+    if args.trades_csv:
+        with open(args.trades_csv, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=["symbol", "entry_time", "exit_time", "entry", "exit", "reason", "return"])
+            writer.writeheader()
+            writer.writerows(trades)
+    print(json.dumps(summarize(trades, args.notional), indent=2))
+
+
+if __name__ == "__main__":
+    main()
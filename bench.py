@@ -0,0 +1,149 @@
+"""Benchmark toàn bộ một lần chạy (run_bot + auto_sell_once) trên SimExchange.
+
+Mỗi kịch bản dựng watchlist N dòng "MUA MẠNH", chạy bot với sàn/Sheet giả
+lập (độ trễ, rate limit cấu hình được) và ghi lại thời gian chạy, số lời gọi
+API, số lệnh và chi phí quét mỗi symbol (từ instrumentation). Không cần mạng
+hay credentials.
+
+    python bench.py --rows 10 100 1000 --latency 0.05 --rate-limit 20
+    python bench.py --fixtures fixtures --rows 50 --repeat 2
+"""
+import argparse
+import json
+import logging
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import instrumentation
+import main as bot
+from simulator import SimExchange, SimWorksheet
+
+
+def signal_rows(symbols, freq_minutes=60):
+    """Watchlist dạng Sheet tín hiệu: header + một dòng MUA MẠNH cho mỗi symbol."""
+    now_vn = datetime.now(timezone(timedelta(hours=7))).strftime("%Y-%m-%d %H:%M:%S")
+    rows = [["Coin", "Tín hiệu", "Giá", "Ngày", "Tần suất", "Trạng thái"]]
+    rows += [[s.replace("/", "-"), "MUA MẠNH", "1", now_vn, str(freq_minutes), ""] for s in symbols]
+    return rows
+
+
+def _make_exchange(args, rows):
+    kwargs = {
+        "latency": args.latency,
+        "jitter": args.jitter,
+        "rate_limit": args.rate_limit,
+        "seed": args.seed,
+        "balance": {"USDT": args.usdt},
+    }
+    if args.fixtures:
+        ex = SimExchange.from_fixtures(args.fixtures, **kwargs)
+        symbols = ex.symbols()
+        if len(symbols) < rows:
+            print(f"⚠️ Fixture chỉ có {len(symbols)} symbol, chạy với {len(symbols)} dòng")
+        return ex, symbols[:rows]
+    ex = SimExchange.synthetic(rows, history=args.history, **kwargs)
+    return ex, ex.symbols()
+
+
+def run_scenario(rows, args):
+    """Chạy một kịch bản N dòng; trả về list kết quả, mỗi lần lặp một dict."""
+    ex, symbols = _make_exchange(args, rows)
+    sheet = SimWorksheet(latency=args.sheet_latency, rate_limit=args.sheet_rate_limit, seed=args.seed)
+    workdir = Path(tempfile.mkdtemp(prefix="bench_"))
+    bot.set_exchange(ex)
+    bot.set_storage_sheet(sheet)
+    bot.set_entry_store(bot.EntryStore(str(workdir / "entries.db")))
+    if args.candle_store:
+        bot.set_candle_store(bot.CandleStore(str(workdir / "candles.db")))
+    else:
+        bot.CANDLE_STORE_PATH = ""
+    bot.set_trend_memo(bot.TrendMemo(str(workdir / "trend_memo.db")))
+    signals = signal_rows(symbols)
+    bot.fetch_sheet = lambda validators=None: (iter(signals), {})
+    bot.set_signal_ingestor(bot.SignalIngestor(str(workdir / "signals.db")))
+
+    results = []
+    for run in range(args.repeat):
+        ex.reset_counters()
+        sheet.reset_counters()
+        instrumentation.REGISTRY.reset()
+        bot.market_cache.reset()
+        orders_before = len(ex.orders)
+
+        started = time.perf_counter()
+        bot.run_bot()
+        bot.auto_sell_once()
+        bot.get_sheet_syncer().flush()
+        wall = time.perf_counter() - started
+
+        report = instrumentation.REGISTRY.report()
+        screen = report["stages"].get("screen.candidate", {})
+        results.append({
+            "rows": len(symbols),
+            "run": run + 1,
+            "wall_s": round(wall, 3),
+            "exchange_calls": dict(sorted(ex.calls.items())),
+            "sheet_calls": dict(sorted(sheet.calls.items())),
+            "rate_limit_wait_s": round(ex.throttle.waited + sheet.throttle.waited, 3),
+            "scheduler_wait_s": {
+                name.split(".", 1)[1]: w["total_s"]
+                for name, w in report["rate_limit_waits"].items() if name.startswith("exchange.")
+            },
+            "queue_depth_max": {
+                name.rsplit(".", 1)[1]: g["max"]
+                for name, g in report["gauges"].items() if name.startswith("exchange.queue.")
+            },
+            "orders": len(ex.orders) - orders_before,
+            "screen_per_symbol": {
+                "count": screen.get("count", 0),
+                "p50_s": screen.get("p50_s"),
+                "p95_s": screen.get("p95_s"),
+                "p99_s": screen.get("p99_s"),
+            },
+            "market_cache": bot.market_cache.stats(),
+            "top_stages": [
+                {"stage": stage, "total_s": round(total, 4), "count": count}
+                for stage, total, count in instrumentation.REGISTRY.top_stages(8)
+            ],
+        })
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark bot trên sàn giả lập")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10, 100, 1000], help="số dòng watchlist mỗi kịch bản")
+    parser.add_argument("--fixtures", help="thư mục fixture (simulator.py record) thay cho dữ liệu sinh ngẫu nhiên")
+    parser.add_argument("--latency", type=float, default=0.05, help="độ trễ mỗi lời gọi sàn (giây)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="độ trễ ngẫu nhiên cộng thêm tối đa (giây)")
+    parser.add_argument("--rate-limit", type=float, default=20.0, help="request/giây của sàn; 0 = không giới hạn")
+    parser.add_argument("--sheet-latency", type=float, default=0.2, help="độ trễ mỗi lời gọi Google Sheet (giây)")
+    parser.add_argument("--sheet-rate-limit", type=float, default=1.0, help="request/giây của Google Sheet")
+    parser.add_argument("--history", type=int, default=500, help="số nến sinh cho mỗi khung")
+    parser.add_argument("--usdt", type=float, default=1000.0, help="số dư USDT ban đầu")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=1, help="số lần chạy mỗi kịch bản (lần sau dùng lại kho nến, trend memo)")
+    parser.add_argument("--candle-store", action="store_true", help="dùng CandleStore tạm cho mỗi kịch bản")
+    parser.add_argument("--out", help="ghi kết quả JSON ra file")
+    parser.add_argument("--verbose", action="store_true", help="giữ log INFO của bot")
+    args = parser.parse_args(argv)
+
+    if not args.verbose:
+        bot.logger.setLevel(logging.WARNING)
+    results = []
+    for rows in args.rows:
+        for result in run_scenario(rows, args):
+            results.append(result)
+            print(f"rows={result['rows']} run={result['run']} wall={result['wall_s']}s "
+                  f"orders={result['orders']} exchange={sum(result['exchange_calls'].values())} "
+                  f"screen_p50={result['screen_per_symbol']['p50_s']}s")
+    text = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.out:
+        Path(args.out).write_text(text, encoding="utf-8")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+"""Bộ chỉ báo vector hoá (NumPy) cho screener.
+
+Mọi hàm nhận mảng theo cột với trục thời gian là trục cuối, nên cùng một hàm
+chạy được cho một symbol (shape (n,)) hoặc nhiều symbol xếp chồng (shape (s, n)).
+Các hàm *_last cho kết quả giống hệt helper cũ trong main.py (_ema, _adx14,
+_atr_pct, _bb_width, _percentile, compute_rsi).
+"""
+from bisect import bisect_left, insort
+from collections import deque
+
+import numpy as np
+
+TS, OPEN, HIGH, LOW, CLOSE, VOLUME = range(6)
+
+
+def to_columns(ohlcv):
+    """list OHLCV của ccxt -> mảng (6, n): ts, open, high, low, close, volume."""
+    arr = np.asarray(ohlcv, dtype=float)
+    if arr.ndim != 2 or arr.shape[0] == 0:
+        return np.empty((6, 0))
+    return arr[:, :6].T
+
+
+def stack_ohlcv(ohlcv_list, length=None):
+    """Xếp nhiều symbol thành mảng (6, s, n), cắt theo nến mới nhất về cùng độ dài."""
+    cols = [to_columns(o) for o in ohlcv_list]
+    n = min(c.shape[1] for c in cols) if length is None else length
+    return np.stack([c[:, c.shape[1] - n:] for c in cols], axis=1)
+
+
+# ---------- EMA / RSI ----------
+
+def ema_series(x, n):
+    """EMA seed bằng SMA n nến đầu; các vị trí trước nến thứ n là NaN."""
+    x = np.asarray(x, dtype=float)
+    out = np.full(x.shape, np.nan)
+    if x.shape[-1] < n:
+        return out
+    k = 2 / (n + 1)
+    s = x[..., :n].sum(axis=-1) / n
+    out[..., n - 1] = s
+    for i in range(n, x.shape[-1]):
+        s = x[..., i] * k + s * (1 - k)
+        out[..., i] = s
+    return out
+
+
+def ema_last(x, n):
+    x = np.asarray(x, dtype=float)
+    if x.shape[-1] < n:
+        return np.full(x.shape[:-1], np.nan)
+    return ema_series(x, n)[..., -1]
+
+
+def rsi_first_window(closes, period=14):
+    """Tương đương compute_rsi: trung bình gain/loss của `period` delta đầu tiên."""
+    closes = np.asarray(closes, dtype=float)
+    deltas = np.diff(closes, axis=-1)[..., :period]
+    avg_gain = np.where(deltas > 0, deltas, 0.0).sum(axis=-1) / period
+    avg_loss = np.where(deltas < 0, -deltas, 0.0).sum(axis=-1) / period
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rsi = 100 - 100 / (1 + avg_gain / avg_loss)
+    return np.where(avg_loss == 0, 100.0, rsi)
+
+
+def rsi_wilder(closes, period=14):
+    """RSI Wilder đầy đủ theo từng nến; các vị trí chưa đủ dữ liệu là NaN."""
+    closes = np.asarray(closes, dtype=float)
+    out = np.full(closes.shape, np.nan)
+    deltas = np.diff(closes, axis=-1)
+    if deltas.shape[-1] < period:
+        return out
+    gains = np.where(deltas > 0, deltas, 0.0)
+    losses = np.where(deltas < 0, -deltas, 0.0)
+    avg_gain = gains[..., :period].mean(axis=-1)
+    avg_loss = losses[..., :period].mean(axis=-1)
+
+    def _rsi(g, l):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(l == 0, 100.0, 100 - 100 / (1 + g / l))
+
+    out[..., period] = _rsi(avg_gain, avg_loss)
+    for i in range(period, deltas.shape[-1]):
+        avg_gain = (avg_gain * (period - 1) + gains[..., i]) / period
+        avg_loss = (avg_loss * (period - 1) + losses[..., i]) / period
+        out[..., i + 1] = _rsi(avg_gain, avg_loss)
+    return out
+
+
+# ---------- ATR / ADX ----------
+
+def true_range(high, low, close):
+    """TR từ nến thứ 2 trở đi (dùng close nến trước), shape (..., n - 1)."""
+    high, low, close = (np.asarray(a, dtype=float) for a in (high, low, close))
+    pc = close[..., :-1]
+    h, l = high[..., 1:], low[..., 1:]
+    return np.maximum.reduce([h - l, np.abs(h - pc), np.abs(l - pc)])
+
+
+def atr_pct_last(high, low, close, n=14):
+    """Tương đương _atr_pct: ATR (trung bình đơn) n nến cuối / close cuối."""
+    close = np.asarray(close, dtype=float)
+    if close.shape[-1] < n + 2:
+        return np.zeros(close.shape[:-1])
+    atr = true_range(high, low, close)[..., -n:].mean(axis=-1)
+    last = close[..., -1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(last != 0, atr / last, 0.0)
+
+
+def _wilder_smooth(x, n):
+    """SMMA Wilder theo từng vị trí: seed bằng trung bình n giá trị đầu."""
+    out = np.full(x.shape, np.nan)
+    if x.shape[-1] < n:
+        return out
+    prev = x[..., :n].sum(axis=-1) / n
+    out[..., n - 1] = prev
+    for i in range(n, x.shape[-1]):
+        prev = (prev * (n - 1) + x[..., i]) / n
+        out[..., i] = prev
+    return out
+
+
+def directional_index(high, low, close, n=14):
+    """Trả về (+DI, -DI, DX) theo từng nến, shape (..., n_bars - 1)."""
+    high, low, close = (np.asarray(a, dtype=float) for a in (high, low, close))
+    up = high[..., 1:] - high[..., :-1]
+    dn = low[..., :-1] - low[..., 1:]
+    plus_dm = np.where((up > dn) & (up > 0), up, 0.0)
+    minus_dm = np.where((dn > up) & (dn > 0), dn, 0.0)
+    tr_n = _wilder_smooth(true_range(high, low, close), n)
+    plus_n = _wilder_smooth(plus_dm, n)
+    minus_n = _wilder_smooth(minus_dm, n)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dip = np.where(tr_n == 0, np.nan, 100 * plus_n / tr_n)
+        dim = np.where(tr_n == 0, np.nan, 100 * minus_n / tr_n)
+        dx = np.where(dip + dim == 0, np.nan, 100 * np.abs(dip - dim) / (dip + dim))
+    return dip, dim, dx
+
+
+def dx_last(high, low, close, n=14):
+    """Tương đương _adx14 (DX của nến cuối); NaN khi helper cũ trả None."""
+    close = np.asarray(close, dtype=float)
+    if close.shape[-1] < 20:
+        return np.full(close.shape[:-1], np.nan)
+    return directional_index(high, low, close, n)[2][..., -1]
+
+
+def adx(high, low, close, n=14):
+    """ADX đầy đủ: DX được làm mượt Wilder thêm n kỳ."""
+    dx = directional_index(high, low, close, n)[2]
+    out = np.full(dx.shape, np.nan)
+    start = n - 1
+    if dx.shape[-1] - start < n:
+        return out
+    out[..., start:] = _wilder_smooth(dx[..., start:], n)
+    return out
+
+
+# ---------- Bollinger / percentile ----------
+
+def bb_width_series(closes, n=20, k=2.0):
+    """Độ rộng Bollinger của cửa sổ kết thúc tại từng nến; trước nến thứ n là NaN."""
+    closes = np.asarray(closes, dtype=float)
+    out = np.full(closes.shape, np.nan)
+    if closes.shape[-1] < n:
+        return out
+    win = np.lib.stride_tricks.sliding_window_view(closes, n, axis=-1)
+    ma = win.mean(axis=-1)
+    std = np.sqrt(((win - ma[..., None]) ** 2).mean(axis=-1))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out[..., n - 1:] = np.where(ma != 0, 2 * k * std / ma, 0.0)
+    return out
+
+
+def bb_width_last(closes, n=20, k=2.0):
+    closes = np.asarray(closes, dtype=float)
+    if closes.shape[-1] < n:
+        return np.zeros(closes.shape[:-1])
+    return bb_width_series(closes[..., -n:], n, k)[..., -1]
+
+
+def percentile(vals, q):
+    """Tương đương _percentile (nearest-rank, bỏ NaN) trên trục cuối."""
+    vals = np.sort(np.asarray(vals, dtype=float), axis=-1)
+    count = np.sum(~np.isnan(vals), axis=-1)
+    idx = np.clip(np.round(q * (count - 1)).astype(int), 0, None)
+    picked = np.take_along_axis(vals, np.expand_dims(np.minimum(idx, vals.shape[-1] - 1), -1), axis=-1)[..., 0]
+    return np.where(count > 0, picked, np.nan)
+
+
+def rolling_percentile(x, window, q):
+    """Percentile của cửa sổ `window` giá trị kết thúc tại từng vị trí."""
+    x = np.asarray(x, dtype=float)
+    out = np.full(x.shape, np.nan)
+    if x.shape[-1] < window:
+        return out
+    win = np.lib.stride_tricks.sliding_window_view(x, window, axis=-1)
+    out[..., window - 1:] = percentile(win, q)
+    return out
+
+
+class RollingBollinger:
+    """Thống kê Bollinger cuộn, cập nhật O(1) mỗi nến.
+
+    `width` là độ rộng của cửa sổ mới nhất; các độ rộng trước đó được giữ trong
+    một list đã sắp xếp (tối đa `history` giá trị nếu đặt) để `percentile()`
+    tra theo chỉ số, chèn/xoá bằng bisect. Với `extend()` liên tục, kết quả
+    trùng với `_bb_width(closes)` và `_percentile([_bb_width(closes[:i]) ...])`.
+    """
+
+    def __init__(self, n=20, k=2.0, history=None):
+        self.n = n
+        self.k = k
+        self.history = history
+        self._window = deque()
+        self._shift = 0.0
+        self._sum = 0.0
+        self._sumsq = 0.0
+        self._since_resync = 0
+        self._sorted = []
+        self._order = deque()
+        self.width = None
+
+    def __len__(self):
+        return len(self._sorted)
+
+    def _resync(self):
+        # Neo lại tổng quanh trung bình hiện tại để tránh sai số tích luỹ
+        # của sum/sumsq (chi phí O(n) mỗi n nến -> vẫn O(1) khấu hao).
+        self._shift = sum(self._window) / len(self._window)
+        self._sum = sum(x - self._shift for x in self._window)
+        self._sumsq = sum((x - self._shift) ** 2 for x in self._window)
+        self._since_resync = 0
+
+    def _push_width(self, w):
+        if self.width is not None:
+            insort(self._sorted, self.width)
+            self._order.append(self.width)
+            if self.history is not None and len(self._order) > self.history:
+                old = self._order.popleft()
+                del self._sorted[bisect_left(self._sorted, old)]
+        self.width = w
+
+    def _current_width(self):
+        n = self.n
+        ma = self._shift + self._sum / n
+        var = max(self._sumsq / n - (self._sum / n) ** 2, 0.0)
+        return 2 * self.k * var ** 0.5 / ma if ma else 0.0
+
+    def append(self, close):
+        close = float(close)
+        self._window.append(close)
+        if len(self._window) > self.n:
+            old = self._window.popleft()
+            self._sum -= old - self._shift
+            self._sumsq -= (old - self._shift) ** 2
+        self._sum += close - self._shift
+        self._sumsq += (close - self._shift) ** 2
+        self._since_resync += 1
+        if len(self._window) < self.n:
+            return None
+        if self._since_resync >= self.n:
+            self._resync()
+        self._push_width(self._current_width())
+        return self.width
+
+    def extend(self, closes):
+        closes = [float(x) for x in closes]
+        if self._window or len(closes) < self.n:
+            for x in closes:
+                self.append(x)
+            return self.width
+
+        # Backfill theo batch: tính cả chuỗi bằng NumPy rồi sắp xếp một lần.
+        widths = bb_width_series(closes, self.n, self.k)[self.n - 1:].tolist()
+        past = widths[:-1]
+        if self.history is not None:
+            past = past[len(past) - self.history:] if self.history else []
+        self._order = deque(past)
+        self._sorted = sorted(past)
+        self.width = widths[-1]
+        self._window = deque(closes[-self.n:])
+        self._resync()
+        return self.width
+
+    def percentile(self, q):
+        """Nearest-rank percentile của các độ rộng trước nến mới nhất."""
+        if not self._sorted:
+            return None
+        k = max(0, min(len(self._sorted) - 1, int(round(q * (len(self._sorted) - 1)))))
+        return self._sorted[k]
@@ -0,0 +1,313 @@
+"""Đo thời gian / đếm lời gọi theo stage và symbol cho một lần chạy bot.
+
+Mỗi stage (ví dụ "exchange.fetch_ohlcv", "screen.pre_buy") có một histogram
+độ trễ với bucket chia theo cấp số nhân nên bộ nhớ cố định dù chạy bao lâu;
+p50/p95/p99 được nội suy trong bucket. Symbol được lấy từ symbol_scope() của
+thread hiện tại, nên các lời gọi lồng nhau (exchange, chỉ báo) tự được gán cho
+coin đang được quét. Báo cáo ghi ra JSON hoặc Prometheus textfile (.prom).
+"""
+import functools
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+QUANTILES = (0.5, 0.95, 0.99)
+# 10µs .. ~2 phút, mỗi bucket rộng hơn bucket trước 20%.
+BUCKET_BOUNDS = [1e-5 * 1.2 ** i for i in range(90)]
+
+
+class Histogram:
+    __slots__ = ("counts", "count", "total", "min", "max", "errors")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.errors = {}
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lower = BUCKET_BOUNDS[i - 1] if i > 0 else 0.0
+                upper = BUCKET_BOUNDS[i] if i < len(BUCKET_BOUNDS) else self.max
+                value = lower + (upper - lower) * (rank - seen) / n
+                return min(max(value, self.min), self.max)
+            seen += n
+        return self.max
+
+    def state(self):
+        return {"counts": list(self.counts), "count": self.count, "total": self.total,
+                "min": self.min, "max": self.max, "errors": dict(self.errors)}
+
+    def merge(self, state):
+        for i, n in enumerate(state["counts"]):
+            self.counts[i] += n
+        self.count += state["count"]
+        self.total += state["total"]
+        if state["min"] is not None:
+            self.min = state["min"] if self.min is None else min(self.min, state["min"])
+            self.max = state["max"] if self.max is None else max(self.max, state["max"])
+        for error, n in state["errors"].items():
+            self.errors[error] = self.errors.get(error, 0) + n
+
+    def summary(self):
+        out = {
+            "count": self.count,
+            "errors": sum(self.errors.values()),
+            "total_s": round(self.total, 6),
+            "max_s": round(self.max, 6) if self.max is not None else None,
+        }
+        for q in QUANTILES:
+            value = self.quantile(q)
+            out[f"p{int(q * 100)}_s"] = round(value, 6) if value is not None else None
+        if self.errors:
+            out["error_types"] = dict(self.errors)
+        return out
+
+
+class Registry:
+    """Histogram theo stage và theo (symbol, stage), cộng dồn thời gian chờ rate limit."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self._stages = {}
+            self._symbols = {}
+            self._waits = {}
+            self._gauges = {}
+
+    def current_symbol(self):
+        return getattr(self._local, "symbol", None)
+
+    @contextmanager
+    def symbol_scope(self, symbol):
+        previous = self.current_symbol()
+        self._local.symbol = symbol
+        try:
+            yield
+        finally:
+            self._local.symbol = previous
+
+    def _histograms(self, stage, symbol):
+        hists = [self._stages.setdefault(stage, Histogram())]
+        if symbol is not None:
+            hists.append(self._symbols.setdefault(symbol, {}).setdefault(stage, Histogram()))
+        return hists
+
+    def observe(self, stage, seconds, error=None):
+        symbol = self.current_symbol()
+        with self._lock:
+            for hist in self._histograms(stage, symbol):
+                hist.observe(seconds)
+                if error:
+                    hist.errors[error] = hist.errors.get(error, 0) + 1
+
+    def count_error(self, stage, error):
+        symbol = self.current_symbol()
+        with self._lock:
+            for hist in self._histograms(stage, symbol):
+                hist.errors[error] = hist.errors.get(error, 0) + 1
+
+    def add_wait(self, name, seconds):
+        with self._lock:
+            count, total = self._waits.get(name, (0, 0.0))
+            self._waits[name] = (count + 1, total + seconds)
+
+    def gauge(self, name, value):
+        """Giá trị tức thời (ví dụ độ sâu hàng đợi); báo cáo giữ giá trị cuối và max."""
+        with self._lock:
+            _, peak = self._gauges.get(name, (value, value))
+            self._gauges[name] = (value, max(peak, value))
+
+    @contextmanager
+    def timer(self, stage):
+        started = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - started, error)
+
+    def timed(self, stage, symbol_arg=False):
+        """Decorator đo hàm theo stage; symbol_arg=True lấy tham số đầu làm symbol scope."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if symbol_arg and args:
+                    with self.symbol_scope(args[0]), self.timer(stage):
+                        return func(*args, **kwargs)
+                with self.timer(stage):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def snapshot(self):
+        """Trạng thái thô (bucket, không phải quantile) để gộp từ process khác bằng merge()."""
+        with self._lock:
+            return {
+                "started": self.started,
+                "stages": {stage: hist.state() for stage, hist in self._stages.items()},
+                "symbols": {
+                    symbol: {stage: hist.state() for stage, hist in hists.items()}
+                    for symbol, hists in self._symbols.items()
+                },
+                "waits": dict(self._waits),
+                "gauges": dict(self._gauges),
+            }
+
+    def merge(self, snapshot, symbol_prefix=""):
+        """Cộng snapshot() của process khác; symbol được gắn thêm `symbol_prefix`."""
+        with self._lock:
+            self.started = min(self.started, snapshot["started"])
+            for stage, state in snapshot["stages"].items():
+                self._stages.setdefault(stage, Histogram()).merge(state)
+            for symbol, stages in snapshot["symbols"].items():
+                hists = self._symbols.setdefault(f"{symbol_prefix}{symbol}", {})
+                for stage, state in stages.items():
+                    hists.setdefault(stage, Histogram()).merge(state)
+            for name, (count, total) in snapshot["waits"].items():
+                c, t = self._waits.get(name, (0, 0.0))
+                self._waits[name] = (c + count, t + total)
+            for name, (value, peak) in snapshot["gauges"].items():
+                v, m = self._gauges.get(name, (0, 0))
+                self._gauges[name] = (v + value, max(m, peak))
+
+    def report(self):
+        with self._lock:
+            stages = {stage: hist.summary() for stage, hist in sorted(self._stages.items())}
+            symbols = {
+                symbol: {stage: hist.summary() for stage, hist in sorted(hists.items())}
+                for symbol, hists in sorted(self._symbols.items())
+            }
+            waits = {name: {"count": c, "total_s": round(t, 6)} for name, (c, t) in sorted(self._waits.items())}
+            gauges = {name: {"value": v, "max": m} for name, (v, m) in sorted(self._gauges.items())}
+        return {
+            "generated_at": datetime.now(timezone.utc).isoformat(),
+            "run_seconds": round(time.time() - self.started, 3),
+            "stages": stages,
+            "rate_limit_waits": waits,
+            "gauges": gauges,
+            "symbols": symbols,
+        }
+
+    def top_stages(self, n=5):
+        """Các stage tốn nhiều thời gian nhất: list (stage, tổng giây, số lần gọi)."""
+        with self._lock:
+            items = [(stage, hist.total, hist.count) for stage, hist in self._stages.items()]
+        return sorted(items, key=lambda item: item[1], reverse=True)[:n]
+
+    def to_prometheus(self, prefix="spot_bot"):
+        report = self.report()
+        lines = [
+            f"# HELP {prefix}_stage_duration_seconds Độ trễ mỗi lời gọi theo stage.",
+            f"# TYPE {prefix}_stage_duration_seconds summary",
+        ]
+        for stage, s in report["stages"].items():
+            for q in QUANTILES:
+                value = s[f"p{int(q * 100)}_s"]
+                if value is not None:
+                    lines.append(f'{prefix}_stage_duration_seconds{{stage="{stage}",quantile="{q}"}} {value}')
+            lines.append(f'{prefix}_stage_duration_seconds_sum{{stage="{stage}"}} {s["total_s"]}')
+            lines.append(f'{prefix}_stage_duration_seconds_count{{stage="{stage}"}} {s["count"]}')
+        lines += [f"# HELP {prefix}_stage_errors_total Số lỗi theo stage.", f"# TYPE {prefix}_stage_errors_total counter"]
+        for stage, s in report["stages"].items():
+            lines.append(f'{prefix}_stage_errors_total{{stage="{stage}"}} {s["errors"]}')
+        lines += [
+            f"# HELP {prefix}_rate_limit_wait_seconds_total Thời gian chờ rate limit.",
+            f"# TYPE {prefix}_rate_limit_wait_seconds_total counter",
+        ]
+        for name, w in report["rate_limit_waits"].items():
+            lines.append(f'{prefix}_rate_limit_wait_seconds_total{{client="{name}"}} {w["total_s"]}')
+        lines += [f"# HELP {prefix}_gauge Giá trị tức thời (độ sâu hàng đợi...).", f"# TYPE {prefix}_gauge gauge"]
+        for name, g in report["gauges"].items():
+            lines.append(f'{prefix}_gauge{{name="{name}"}} {g["value"]}')
+            lines.append(f'{prefix}_gauge_max{{name="{name}"}} {g["max"]}')
+        lines += [
+            f"# HELP {prefix}_symbol_duration_seconds Thời gian theo symbol và stage.",
+            f"# TYPE {prefix}_symbol_duration_seconds summary",
+        ]
+        for symbol, stages in report["symbols"].items():
+            for stage, s in stages.items():
+                labels = f'symbol="{symbol}",stage="{stage}"'
+                lines.append(f"{prefix}_symbol_duration_seconds_sum{{{labels}}} {s['total_s']}")
+                lines.append(f"{prefix}_symbol_duration_seconds_count{{{labels}}} {s['count']}")
+        lines += [f"# TYPE {prefix}_run_duration_seconds gauge", f"{prefix}_run_duration_seconds {report['run_seconds']}"]
+        return "\n".join(lines) + "\n"
+
+    def write_report(self, path):
+        # Ghi file tạm rồi os.replace để textfile collector không đọc file dở.
+        text = self.to_prometheus() if str(path).endswith(".prom") else json.dumps(self.report(), indent=2, ensure_ascii=False)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, path)
+        return path
+
+
+class InstrumentedClient:
+    """Proxy bọc các method public của client, đo theo stage "<prefix>.<method>".
+
+    Thuộc tính không gọi được trả về nguyên bản; thuộc tính có tên trong
+    `nested` (ví dụ worksheet.spreadsheet) được bọc tiếp với cùng prefix.
+    """
+
+    def __init__(self, client, prefix, registry, nested=()):
+        self.__dict__.update(_client=client, _prefix=prefix, _registry=registry, _nested=set(nested), _wrapped={})
+
+    def __getattr__(self, name):
+        wrapped = self._wrapped.get(name)
+        if wrapped is not None:
+            return wrapped
+        attr = getattr(self._client, name)
+        if name in self._nested:
+            wrapped = InstrumentedClient(attr, self._prefix, self._registry)
+        elif callable(attr) and not name.startswith("_"):
+            wrapped = self._registry.timed(f"{self._prefix}.{name}")(attr)
+        else:
+            return attr
+        self._wrapped[name] = wrapped
+        return wrapped
+
+    def __setattr__(self, name, value):
+        self._wrapped.pop(name, None)
+        setattr(self._client, name, value)
+
+    def unwrap(self):
+        return self._client
+
+
+REGISTRY = Registry()
+symbol_scope = REGISTRY.symbol_scope
+timer = REGISTRY.timer
+timed = REGISTRY.timed
+
+
+def instrument(client, prefix, nested=()):
+    if client is None or isinstance(client, InstrumentedClient):
+        return client
+    return InstrumentedClient(client, prefix, REGISTRY, nested)
@@ -1,14 +1,36 @@
+import time
+
+_IMPORT_STARTED = time.perf_counter()
+
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from contextlib import contextmanager
 import os
 import csv
+import codecs
+import hashlib
 import requests
 import logging
-import ccxt
-import time
+from logging.handlers import QueueHandler, QueueListener
+import threading
+import queue
+import asyncio
+import abc
+import argparse
+import atexit
+import functools
+import heapq
 import json
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
+import signal
+import sqlite3
+import zlib
+
+import numpy as np
+
+import indicators
+import instrumentation
 
 # ===================== UPGRADE CONFIG & HELPERS =====================
 UPGRADE = {
@@ -23,6 +45,7 @@ UPGRADE = {
     "max_spread": float(os.getenv("MAX_SPREAD", 0.002)),
     "use_stop_for_spot": os.getenv("USE_STOP_FOR_SPOT", "true").lower() == "true",
 }
+SCREEN_15M_LIMIT = int(os.getenv("SCREEN_15M_LIMIT", 120))
 
 
 def _now_iso():
@@ -33,92 +56,31 @@ def _percentile(vals, q):
     vals = [float(x) for x in vals if x is not None]
     if not vals:
         return None
-    vals.sort()
-    k = max(0, min(len(vals) - 1, int(round(q * (len(vals) - 1)))))
-    return vals[k]
-
-
-def _ema(series, n):
-    if len(series) < n:
-        return None
-    k = 2 / (n + 1)
-    s = sum(series[:n]) / n
-    for x in series[n:]:
-        s = x * k + s * (1 - k)
-    return s
+    return float(indicators.percentile(vals, q))
 
 
 def _adx14(ohlcv):
     if len(ohlcv) < 20:
         return None
-
-    def tr(h, l, pc):
-        return max(h - l, abs(h - pc), abs(l - pc))
-
-    plus_dm, minus_dm, trs = [], [], []
-    for i in range(1, len(ohlcv)):
-        h1, l1 = ohlcv[i][2], ohlcv[i][3]
-        h0, l0 = ohlcv[i - 1][2], ohlcv[i - 1][3]
-        up = h1 - h0
-        dn = l0 - l1
-        plus_dm.append(up if (up > dn and up > 0) else 0.0)
-        minus_dm.append(dn if (dn > up and dn > 0) else 0.0)
-        trs.append(tr(h1, l1, ohlcv[i - 1][4]))
-
-    n = 14
-
-    def smma(vals):
-        s = sum(vals[:n])
-        prev = s / n
-        out = [prev]
-        for x in vals[n:]:
-            prev = (prev * (n - 1) + x) / n
-            out.append(prev)
-        return out[-1]
-
-    tr_n = smma(trs)
-    plus_n = smma(plus_dm)
-    minus_n = smma(minus_dm)
-    if tr_n == 0:
-        return None
-    dip = 100 * (plus_n / tr_n)
-    dim = 100 * (minus_n / tr_n)
-    if (dip + dim) == 0:
-        return None
-    dx = 100 * abs(dip - dim) / (dip + dim)
-    return dx
+    cols = indicators.to_columns(ohlcv)
+    dx = float(indicators.dx_last(cols[indicators.HIGH], cols[indicators.LOW], cols[indicators.CLOSE]))
+    return None if dx != dx else dx
 
 
 def _atr_pct(ohlcv, n=14):
     if len(ohlcv) < n + 2:
         return 0.0
-
-    def tr(h, l, pc):
-        return max(h - l, abs(h - pc), abs(l - pc))
-
-    trs = []
-    pc = ohlcv[-(n + 1)][4]
-    for i in range(len(ohlcv) - n, len(ohlcv)):
-        h, l, c = ohlcv[i][2], ohlcv[i][3], ohlcv[i][4]
-        trs.append(tr(h, l, pc))
-        pc = c
-    atr = sum(trs) / len(trs)
-    close = ohlcv[-1][4] or 0.0
-    return atr / close if close else 0.0
+    cols = indicators.to_columns(ohlcv)
+    return float(indicators.atr_pct_last(cols[indicators.HIGH], cols[indicators.LOW], cols[indicators.CLOSE], n))
 
 
 def _bb_width(closes, n=20, k=2.0):
     if len(closes) < n:
         return 0.0
-    w = closes[-n:]
-    ma = sum(w) / n
-    std = (sum((x - ma) ** 2 for x in w) / n) ** 0.5
-    upper = ma + k * std
-    lower = ma - k * std
-    return (upper - lower) / ma if ma else 0.0
+    return float(indicators.bb_width_last(closes, n, k))
 
 
-def _pass_liquidity_and_spread(tkr):
+def _quote_volume(tkr):
     qv = 0.0
     if isinstance(tkr.get("info"), dict):
         try:
@@ -127,25 +89,131 @@ def _pass_liquidity_and_spread(tkr):
             qv = 0.0
     if qv == 0.0:
         qv = float(tkr.get("quoteVolume") or tkr.get("quoteVolume24h") or 0.0)
-    if qv < UPGRADE["min_quote_volume_24h"]:
-        return False
+    return qv
+
+
+def _spread(tkr):
     bid = tkr.get("bid")
     ask = tkr.get("ask")
     if bid and ask and bid > 0:
-        spr = (ask - bid) / bid
-        if spr > UPGRADE["max_spread"]:
-            return False
+        return (ask - bid) / bid
+    return None
+
+
+def _pass_liquidity_and_spread(tkr):
+    if _quote_volume(tkr) < UPGRADE["min_quote_volume_24h"]:
+        return False
+    spr = _spread(tkr)
+    if spr is not None and spr > UPGRADE["max_spread"]:
+        return False
     return True
 
 
+# ===================== LOGGING =====================
+# Logger AUTO_SELL chỉ đẩy record vào hàng đợi (QueueHandler); format và ghi
+# ra stream do QueueListener làm trên thread nền, nên log không cộng vào độ
+# trễ đặt lệnh. Call site nóng dùng format lười ("%s", args) và
+# extra={"stage", "reason", "latency_ms"}; symbol lấy từ symbol_scope của
+# instrumentation. LOG_FORMAT=json: mỗi dòng một JSON event.
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+# WARNING cùng mẫu chỉ in một lần mỗi LOG_REPEAT_WINDOW giây (0 = tắt).
+LOG_REPEAT_WINDOW = float(os.getenv("LOG_REPEAT_WINDOW", 300))
+LOG_FIELDS = ("account", "symbol", "stage", "reason", "latency_ms", "suppressed")
+
+
+class _ContextFilter(logging.Filter):
+    # Chạy trên thread gọi log nên đọc được symbol_scope hiện tại.
+    def filter(self, record):
+        if getattr(record, "symbol", None) is None:
+            record.symbol = instrumentation.REGISTRY.current_symbol()
+        return True
+
+
+class _RepeatFilter(logging.Filter):
+    """Chặn WARNING lặp lại trong `window` giây; lần in kế tiếp kèm số lần đã ẩn.
+
+    Key là mẫu chưa điền (record.msg) + symbol của record + các tham số không
+    phải exception, nên cảnh báo lặp lại mỗi chu kỳ cho cùng một coin chỉ in
+    một lần, còn coin khác (kể cả khi symbol không phải tham số đầu) vẫn được
+    in. Exception bị bỏ khỏi key vì nội dung lỗi thường đổi theo từng lần gọi.
+    Cần chạy sau _ContextFilter.
+    """
+
+    MAX_KEYS = 1000
+
+    def __init__(self, window):
+        super().__init__()
+        self.window = window
+        self._lock = threading.Lock()
+        self._seen = {}
+
+    def filter(self, record):
+        if record.levelno != logging.WARNING or not self.window:
+            return True
+        args = record.args if isinstance(record.args, tuple) else (record.args,)
+        key = (
+            str(record.msg),
+            getattr(record, "symbol", None),
+            tuple(str(arg) for arg in args if not isinstance(arg, BaseException)),
+        )
+        now = time.monotonic()
+        with self._lock:
+            emitted, suppressed = self._seen.get(key, (None, 0))
+            if emitted is not None and now - emitted < self.window:
+                self._seen[key] = (emitted, suppressed + 1)
+                return False
+            if len(self._seen) >= self.MAX_KEYS:
+                self._seen = {k: v for k, v in self._seen.items() if now - v[0] < self.window}
+            self._seen[key] = (now, 0)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class _TextFormatter(logging.Formatter):
+    def format(self, record):
+        text = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        return f"{text} (+{suppressed} lần tương tự đã ẩn)" if suppressed else text
+
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record):
+        event = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for field in LOG_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                event[field] = value
+        if record.exc_info:
+            event["exc"] = self.formatException(record.exc_info)
+        return json.dumps(event, ensure_ascii=False, default=str)
+
+
+class _QueueHandler(QueueHandler):
+    def prepare(self, record):
+        # QueueHandler mặc định format ngay trên thread gọi; để listener làm.
+        return record
+
+
 logger = logging.getLogger("AUTO_SELL")
 logger.setLevel(logging.INFO)
 handler = logging.StreamHandler()
 handler.setLevel(logging.INFO)
-formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+formatter = _JsonFormatter() if LOG_FORMAT == "json" else _TextFormatter("%(asctime)s - %(levelname)s - %(message)s")
 handler.setFormatter(formatter)
+log_listener = QueueListener(queue.SimpleQueue(), handler, respect_handler_level=True)
 if not logger.handlers:
-    logger.addHandler(handler)
+    _queue_handler = _QueueHandler(log_listener.queue)
+    _queue_handler.addFilter(_ContextFilter())
+    _queue_handler.addFilter(_RepeatFilter(LOG_REPEAT_WINDOW))
+    logger.addHandler(_queue_handler)
+    log_listener.start()
+    atexit.register(log_listener.stop)
 
 # Đọc biến môi trường
 SPREADSHEET_URL = os.environ.get("SPREADSHEET_URL")
@@ -155,16 +223,715 @@ OKX_API_PASSPHRASE = os.environ.get("OKX_API_PASSPHRASE")
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
 
-exchange = ccxt.okx({
-    "apiKey": OKX_API_KEY,
-    "secret": OKX_API_SECRET,
-    "password": OKX_API_PASSPHRASE,
-    "enableRateLimit": True,
-    "options": {"defaultType": "spot"},
-})
+SCAN_WORKERS = int(os.getenv("SCAN_WORKERS", 8))
+# shard.py chạy nhiều process cho cùng một tài khoản: process SHARD_INDEX chỉ
+# quét/mua/bán các symbol có crc32 % SHARD_COUNT == SHARD_INDEX.
+SHARD_INDEX = int(os.getenv("SHARD_INDEX", 0))
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", 1))
+
+
+def _in_shard(symbol):
+    if SHARD_COUNT <= 1:
+        return True
+    return zlib.crc32(symbol.replace("/", "-").upper().encode("utf-8")) % SHARD_COUNT == SHARD_INDEX
+
+
+def _shard_entries(entries):
+    if SHARD_COUNT <= 1:
+        return entries
+    return {symbol: entry for symbol, entry in entries.items() if _in_shard(symbol)}
+
+
+# ===================== EXCHANGE SCHEDULER =====================
+# Mọi lời gọi OKX đi qua một scheduler chung: mỗi endpoint có token bucket
+# riêng theo hạn mức của OKX, thêm một bucket tổng; khi nhiều lời gọi cùng chờ,
+# token được cấp theo độ ưu tiên (thoát lệnh > vào lệnh > số dư > dữ liệu thị
+# trường) nên lệnh bán không phải xếp sau traffic quét coin.
+PRIORITY_EXIT, PRIORITY_ENTRY, PRIORITY_BALANCE, PRIORITY_MARKET = range(4)
+PRIORITY_NAMES = {PRIORITY_EXIT: "exit", PRIORITY_ENTRY: "entry", PRIORITY_BALANCE: "balance", PRIORITY_MARKET: "market"}
+
+# Hạn mức OKX (request / cửa sổ giây) theo endpoint, xem docs "Rate Limit".
+OKX_RATE_LIMITS = {
+    "market/candles": (40, 2),
+    "market/ticker": (20, 2),
+    "market/tickers": (20, 2),
+    "market/books": (40, 2),
+    "public/instruments": (20, 2),
+    "account/balance": (10, 2),
+    "trade/order": (60, 2),
+    "trade/order-algo": (20, 2),
+    "trade/cancel-algos": (20, 2),
+    "default": (10, 2),
+}
+# method ccxt -> (endpoint, độ ưu tiên). create_order/fetch_order/cancel_order
+# chỉ dùng cho lệnh OCO (EXCHANGE_EXITS) nên thuộc nhóm thoát lệnh.
+EXCHANGE_ENDPOINTS = {
+    "fetch_ohlcv": ("market/candles", PRIORITY_MARKET),
+    "fetch_ticker": ("market/ticker", PRIORITY_MARKET),
+    "fetch_tickers": ("market/tickers", PRIORITY_MARKET),
+    "fetch_order_book": ("market/books", PRIORITY_MARKET),
+    "load_markets": ("public/instruments", PRIORITY_MARKET),
+    "fetch_balance": ("account/balance", PRIORITY_BALANCE),
+    "create_market_buy_order": ("trade/order", PRIORITY_ENTRY),
+    "create_market_sell_order": ("trade/order", PRIORITY_EXIT),
+    "create_order": ("trade/order-algo", PRIORITY_EXIT),
+    "fetch_order": ("trade/order-algo", PRIORITY_EXIT),
+    "cancel_order": ("trade/cancel-algos", PRIORITY_EXIT),
+}
+_NETWORK_PREFIXES = ("fetch_", "create_", "cancel_", "edit_", "load_markets")
+EXCHANGE_RATE_HEADROOM = float(os.getenv("EXCHANGE_RATE_HEADROOM", 0.8))
+EXCHANGE_MAX_RPS = float(os.getenv("EXCHANGE_MAX_RPS", 20))
+# Backpressure: lời gọi dữ liệu thị trường bị từ chối (ExchangeBusy) khi hàng
+# đợi quá sâu hoặc chờ quá lâu; lời gọi thoát/vào lệnh và số dư luôn được chờ.
+EXCHANGE_MAX_QUEUE = int(os.getenv("EXCHANGE_MAX_QUEUE", 64))
+EXCHANGE_QUEUE_TIMEOUT = float(os.getenv("EXCHANGE_QUEUE_TIMEOUT", 30))
+
+
+class ExchangeBusy(Exception):
+    pass
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.updated = now
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self):
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+class RequestScheduler:
+    """Cấp token theo endpoint + bucket tổng, ưu tiên theo PRIORITY_*.
+
+    Người chờ được xét theo (độ ưu tiên, thứ tự đến); người đầu tiên có token
+    endpoint sẵn sẽ lấy token tổng, nên endpoint đang cạn không chặn endpoint
+    khác nhưng token tổng luôn đến tay nhóm ưu tiên cao hơn trước.
+    """
+
+    def __init__(self, limits, max_rps=0, headroom=1.0, max_queue=0, queue_timeout=0, clock=time.monotonic):
+        self._clock = clock
+        now = clock()
+        self._buckets = {name: TokenBucket(n * headroom / window, n * headroom, now) for name, (n, window) in limits.items()}
+        self._global = TokenBucket(max_rps, max_rps, now) if max_rps > 0 else None
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._seq = 0
+        self._local = threading.local()
+        self.depth = dict.fromkeys(PRIORITY_NAMES, 0)
+        self.rejected = 0
+
+    @contextmanager
+    def priority(self, priority):
+        """Nâng độ ưu tiên mọi lời gọi sàn trong khối (ví dụ cả luồng bán)."""
+        previous = getattr(self._local, "priority", None)
+        self._local.priority = priority if previous is None else min(previous, priority)
+        try:
+            yield
+        finally:
+            self._local.priority = previous
+
+    def _next_grant(self, now):
+        # Trả về (ticket được cấp, thời gian chờ tối thiểu nếu không ai được cấp).
+        if self._global is not None:
+            self._global.refill(now)
+        wait = None
+        for ticket in sorted(self._waiting):
+            bucket = self._buckets[ticket[2]]
+            bucket.refill(now)
+            if bucket.tokens < 1:
+                wait = bucket.wait_time() if wait is None else min(wait, bucket.wait_time())
+                continue
+            if self._global is not None and self._global.tokens < 1:
+                return None, self._global.wait_time()
+            return ticket, 0.0
+        return None, wait
+
+    def acquire(self, endpoint, priority):
+        if endpoint not in self._buckets:
+            endpoint = "default"
+        scoped = getattr(self._local, "priority", None)
+        if scoped is not None:
+            priority = min(priority, scoped)
+        shed = priority == PRIORITY_MARKET
+        name = PRIORITY_NAMES[priority]
+        started = self._clock()
+        with self._cond:
+            if shed and self.max_queue and self.depth[priority] >= self.max_queue:
+                self.rejected += 1
+                raise ExchangeBusy(f"hàng đợi {name} đầy ({self.depth[priority]})")
+            self._seq += 1
+            ticket = (priority, self._seq, endpoint)
+            self._waiting.append(ticket)
+            self.depth[priority] += 1
+            instrumentation.REGISTRY.gauge(f"exchange.queue.{name}", self.depth[priority])
+            try:
+                while True:
+                    now = self._clock()
+                    granted, wait = self._next_grant(now)
+                    if granted == ticket:
+                        self._buckets[endpoint].tokens -= 1
+                        if self._global is not None:
+                            self._global.tokens -= 1
+                        break
+                    if shed and self.queue_timeout and now - started > self.queue_timeout:
+                        self.rejected += 1
+                        raise ExchangeBusy(f"chờ {endpoint} quá {self.queue_timeout}s")
+                    # Người khác được cấp: đánh thức họ rồi chờ lượt sau.
+                    if granted is not None:
+                        self._cond.notify_all()
+                    self._cond.wait(min(wait or 0.05, 1.0))
+            finally:
+                self._waiting.remove(ticket)
+                self.depth[priority] -= 1
+                instrumentation.REGISTRY.gauge(f"exchange.queue.{name}", self.depth[priority])
+                self._cond.notify_all()
+        instrumentation.REGISTRY.add_wait(f"exchange.{name}", self._clock() - started)
+
+    def stats(self):
+        with self._cond:
+            return {"depth": {PRIORITY_NAMES[p]: n for p, n in self.depth.items()}, "rejected": self.rejected}
+
+
+class ScheduledClient:
+    """Proxy exchange: mọi method gọi mạng (fetch_*/create_*/...) xin token trước khi gọi."""
+
+    def __init__(self, client, scheduler):
+        self.__dict__.update(_client=client, _scheduler=scheduler, _wrapped={})
+
+    def __getattr__(self, name):
+        wrapped = self._wrapped.get(name)
+        if wrapped is not None:
+            return wrapped
+        attr = getattr(self._client, name)
+        if not callable(attr) or not name.startswith(_NETWORK_PREFIXES):
+            return attr
+        endpoint, priority = EXCHANGE_ENDPOINTS.get(name, ("default", PRIORITY_MARKET))
+        scheduler = self._scheduler
+
+        @functools.wraps(attr)
+        def wrapped(*args, **kwargs):
+            scheduler.acquire(endpoint, priority)
+            return attr(*args, **kwargs)
+
+        self._wrapped[name] = wrapped
+        return wrapped
+
+    def __setattr__(self, name, value):
+        self._wrapped.pop(name, None)
+        setattr(self._client, name, value)
+
+    def unwrap(self):
+        return self._client
+
+
+# Khi nhiều process dùng chung hạn mức (shard.py), mỗi process chỉ lấy một
+# phần: endpoint public (market/, public/) tính theo IP, còn lại theo API key.
+EXCHANGE_PUBLIC_SHARE = float(os.getenv("EXCHANGE_PUBLIC_SHARE", 1))
+EXCHANGE_ACCOUNT_SHARE = float(os.getenv("EXCHANGE_ACCOUNT_SHARE", 1))
+
+
+def _shared_limits(limits, public_share, account_share):
+    return {
+        name: (n * (public_share if name.startswith(("market/", "public/")) else account_share), window)
+        for name, (n, window) in limits.items()
+    }
+
+
+exchange_scheduler = RequestScheduler(
+    _shared_limits(OKX_RATE_LIMITS, EXCHANGE_PUBLIC_SHARE, EXCHANGE_ACCOUNT_SHARE),
+    max_rps=EXCHANGE_MAX_RPS,
+    headroom=EXCHANGE_RATE_HEADROOM,
+    max_queue=EXCHANGE_MAX_QUEUE,
+    queue_timeout=EXCHANGE_QUEUE_TIMEOUT,
+)
+
+
+def _scheduled(client):
+    if client is None or isinstance(client, (ScheduledClient, instrumentation.InstrumentedClient)):
+        return client
+    return ScheduledClient(client, exchange_scheduler)
+
+
+# ===================== LAZY CLIENTS =====================
+# Exchange, Google Sheet, entry store và HTTP session cho Telegram chỉ được tạo
+# ở lần dùng đầu tiên; set_*() cho phép thay bằng client giả (test, tooling).
+STARTUP_TIMINGS = {}
+_clients = {}
+_clients_lock = threading.RLock()
+
+
+def _lazy_client(name, factory):
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                started = time.perf_counter()
+                client = factory()
+                STARTUP_TIMINGS[f"init_{name}"] = time.perf_counter() - started
+                _clients[name] = client
+    return client
+
+
+def _create_exchange():
+    # ccxt import mất ~1s nên chỉ import khi thật sự cần exchange.
+    import ccxt
+
+    client = ccxt.okx({
+        "apiKey": OKX_API_KEY,
+        "secret": OKX_API_SECRET,
+        "password": OKX_API_PASSPHRASE,
+        # Rate limit do exchange_scheduler đảm nhận (theo endpoint + ưu tiên).
+        "enableRateLimit": False,
+        "options": {"defaultType": "spot"},
+    })
+    return instrumentation.instrument(_scheduled(client), "exchange")
+
+
+def get_exchange():
+    return _lazy_client("exchange", _create_exchange)
+
+
+def set_exchange(client):
+    _clients["exchange"] = instrumentation.instrument(_scheduled(client), "exchange")
+
+
+def get_candle_store():
+    # CANDLE_STORE_PATH rỗng = tắt kho nến, fetch trực tiếp như cũ.
+    if not CANDLE_STORE_PATH:
+        return None
+    return _lazy_client("candle_store", lambda: CandleStore(CANDLE_STORE_PATH))
+
+
+def set_candle_store(store):
+    _clients["candle_store"] = store
+
+
+def get_trend_memo():
+    if not TREND_MEMO_PATH:
+        return None
+    return _lazy_client("trend_memo", lambda: TrendMemo(TREND_MEMO_PATH))
+
+
+def set_trend_memo(memo):
+    _clients["trend_memo"] = memo
+
+
+def get_telegram_session():
+    return _lazy_client("telegram", requests.Session)
+
+
+def set_telegram_session(session):
+    _clients["telegram"] = session
+
+
+# ===================== MARKET DATA CACHE =====================
+TICKER_TTL = float(os.getenv("TICKER_TTL", 10))
+CANDLE_STORE_PATH = os.getenv("CANDLE_STORE_PATH", "candles.db")
+CANDLE_RETENTION_BARS = int(os.getenv("CANDLE_RETENTION_BARS", 5000))
+# compact() chỉ VACUUM khi tỉ lệ trang trống trong file vượt ngưỡng này.
+CANDLE_VACUUM_FREE_RATIO = float(os.getenv("CANDLE_VACUUM_FREE_RATIO", 0.25))
+_TF_UNITS = {"m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+def _tf_seconds(tf):
+    return int(tf[:-1]) * _TF_UNITS[tf[-1].lower()]
+
+
+def _next_candle_close(tf, now=None):
+    now = time.time() if now is None else now
+    period = _tf_seconds(tf)
+    return (int(now) // period + 1) * period
+
+
+def _last_closed_open(tf, now=None):
+    """Open-time (ms) của nến tf đã đóng gần nhất."""
+    return (_next_candle_close(tf, now) - 2 * _tf_seconds(tf)) * 1000
+
+
+# Khung lớn được dựng lại từ khung nhỏ hơn (nến UTC, khớp với nến native của
+# ccxt/OKX vì ccxt dùng "1Dutc"/"6Hutc" cho khung >= 6h).
+RESAMPLE_FROM = {"1h": "15m", "4h": "1h", "1d": "1h"}
+RESAMPLE_MAX_BASE_BARS = int(os.getenv("RESAMPLE_MAX_BASE_BARS", 300))
+
+
+def resample_ohlcv(candles, base_tf, target_tf):
+    """Gộp nến base_tf thành target_tf theo bucket UTC.
+
+    Bucket đầu thiếu nến (lịch sử bắt đầu giữa bucket) bị bỏ; bucket cuối là
+    nến đang chạy nên chỉ cần liên tục từ đầu bucket. Trả về None nếu có
+    bucket giữa chừng bị thiếu nến (cần fetch native).
+    """
+    base_ms = _tf_seconds(base_tf) * 1000
+    target_ms = _tf_seconds(target_tf) * 1000
+    if target_ms % base_ms:
+        raise ValueError(f"{target_tf} không chia hết cho {base_tf}")
+    ratio = target_ms // base_ms
+
+    buckets = []
+    for c in candles:
+        start = c[0] // target_ms * target_ms
+        if buckets and buckets[-1][0] == start:
+            b = buckets[-1]
+            b[2] = max(b[2], c[2])
+            b[3] = min(b[3], c[3])
+            b[4] = c[4]
+            b[5] += c[5]
+            b[6] += 1
+            b[7] = c[0]
+        else:
+            buckets.append([start, c[1], c[2], c[3], c[4], c[5], 1, c[0]])
+
+    out = []
+    for i, b in enumerate(buckets):
+        start, count, last_open = b[0], b[6], b[7]
+        contiguous = count == (last_open - start) // base_ms + 1
+        if i == 0 and (count < ratio or not contiguous):
+            continue
+        if i == len(buckets) - 1:
+            if not contiguous:
+                return None
+        elif count < ratio:
+            return None
+        out.append(b[:6])
+    return out
+
+
+class CandleStore:
+    """Kho nến OHLCV trên đĩa (SQLite), key (symbol, timeframe, ts).
+
+    sync() chỉ tải các nến mới hơn nến cuối đã lưu (dùng `since`), tự vá
+    khoảng trống trong cửa sổ được yêu cầu và compact() giữ tối đa
+    `retention` nến cho mỗi (symbol, timeframe); file chỉ được VACUUM khi
+    phần trang trống vượt CANDLE_VACUUM_FREE_RATIO.
+    """
+
+    PAGE_LIMIT = 300
+
+    def __init__(self, path, retention=CANDLE_RETENTION_BARS):
+        self.path = str(path)
+        self.retention = retention
+        self.requests = 0
+        self.fetched_rows = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS candles ("
+            "symbol TEXT NOT NULL, timeframe TEXT NOT NULL, ts INTEGER NOT NULL, "
+            "open REAL, high REAL, low REAL, close REAL, volume REAL, "
+            "PRIMARY KEY (symbol, timeframe, ts)) WITHOUT ROWID"
+        )
+
+    def get(self, symbol, timeframe, limit=None):
+        sql = "SELECT ts, open, high, low, close, volume FROM candles WHERE symbol = ? AND timeframe = ? ORDER BY ts DESC"
+        params = (symbol, timeframe)
+        if limit is not None:
+            sql += " LIMIT ?"
+            params += (limit,)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [list(r) for r in reversed(rows)]
+
+    def upsert(self, symbol, timeframe, candles):
+        if not candles:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO candles (symbol, timeframe, ts, open, high, low, close, volume) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(symbol, timeframe, int(c[0]), *c[1:6]) for c in candles],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _fetch(self, client, symbol, timeframe, since=None, limit=None):
+        self.requests += 1
+        if since is None:
+            data = client.fetch_ohlcv(symbol, timeframe=timeframe, limit=limit)
+        else:
+            data = client.fetch_ohlcv(symbol, timeframe=timeframe, since=since, limit=limit)
+        self.fetched_rows += len(data)
+        return data
+
+    def _fetch_since(self, client, symbol, timeframe, since, until_ms):
+        period_ms = _tf_seconds(timeframe) * 1000
+        out = []
+        while since <= until_ms:
+            need = min(self.PAGE_LIMIT, (until_ms - since) // period_ms + 1)
+            batch = self._fetch(client, symbol, timeframe, since=since, limit=need)
+            batch = [c for c in batch if c[0] >= since]
+            out.extend(batch)
+            if len(batch) < need:
+                break
+            since = batch[-1][0] + period_ms
+        return out
+
+    @staticmethod
+    def _gaps(rows, period_ms):
+        gaps = []
+        for prev, cur in zip(rows, rows[1:]):
+            missing = (cur[0] - prev[0]) // period_ms - 1
+            if missing > 0:
+                gaps.append((prev[0] + period_ms, cur[0] - period_ms))
+        return gaps
+
+    @staticmethod
+    def _window(timeframe, limit):
+        period_ms = _tf_seconds(timeframe) * 1000
+        current_open = int(time.time() * 1000) // period_ms * period_ms
+        return period_ms, current_open, current_open - (limit - 1) * period_ms
+
+    def covers(self, symbol, timeframe, limit):
+        """Store đã có lịch sử đủ xa cho `limit` nến (chỉ còn thiếu phần mới nhất)."""
+        _, _, window_start = self._window(timeframe, limit)
+        rows = self.get(symbol, timeframe, limit)
+        return bool(rows) and rows[0][0] <= window_start <= rows[-1][0]
+
+    def sync(self, client, symbol, timeframe, limit):
+        period_ms, current_open, window_start = self._window(timeframe, limit)
+        rows = self.get(symbol, timeframe, limit)
+
+        if not rows or rows[0][0] > window_start or rows[-1][0] < window_start:
+            self.upsert(symbol, timeframe, self._fetch(client, symbol, timeframe, limit=limit))
+        else:
+            # Lấy lại cả nến cuối đã lưu vì lúc lưu nó có thể chưa đóng.
+            self.upsert(symbol, timeframe, self._fetch_since(client, symbol, timeframe, rows[-1][0], current_open))
+        rows = self.get(symbol, timeframe, limit)
+
+        gaps = self._gaps(rows, period_ms)
+        for start, end in gaps:
+            self.upsert(symbol, timeframe, self._fetch_since(client, symbol, timeframe, start, end))
+        if gaps:
+            rows = self.get(symbol, timeframe, limit)
+        return rows
+
+    def compact(self):
+        with self._lock:
+            keys = self._conn.execute("SELECT DISTINCT symbol, timeframe FROM candles").fetchall()
+            deleted = 0
+            for symbol, timeframe in keys:
+                cur = self._conn.execute(
+                    "DELETE FROM candles WHERE symbol = ? AND timeframe = ? AND ts < ("
+                    "SELECT ts FROM candles WHERE symbol = ? AND timeframe = ? "
+                    "ORDER BY ts DESC LIMIT 1 OFFSET ?)",
+                    (symbol, timeframe, symbol, timeframe, self.retention - 1),
+                )
+                deleted += cur.rowcount
+            if deleted:
+                free = self._conn.execute("PRAGMA freelist_count").fetchone()[0]
+                pages = self._conn.execute("PRAGMA page_count").fetchone()[0]
+                if pages and free / pages >= CANDLE_VACUUM_FREE_RATIO:
+                    self._conn.execute("VACUUM")
+        return deleted
+
+    def stats(self):
+        return {"requests": self.requests, "fetched_rows": self.fetched_rows}
+
+
+class MarketDataCache:
+    """Cache dữ liệu thị trường trong một lần chạy.
+
+    - OHLCV: key (symbol, timeframe, limit), hết hạn khi nến hiện tại đóng.
+      Một entry có limit lớn hơn phục vụ luôn các request limit nhỏ hơn.
+      Daemon gọi invalidate_ohlcv() đầu mỗi chu kỳ mua vì nến đang chạy đổi liên tục.
+    - Ticker: TTL ngắn (TICKER_TTL giây), dùng chung snapshot của fetch_tickers();
+      fetch_tickers(symbols) chỉ gọi sàn cho các symbol chưa có giá còn hạn.
+    - Balance: giữ đến khi invalidate_balance() (gọi sau mỗi lệnh).
+    - Khung trong RESAMPLE_FROM được dựng từ khung nhỏ hơn khi đủ lịch sử.
+    """
+
+    def __init__(self, client=None):
+        self._client = client
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self.reset()
+
+    @property
+    def client(self):
+        return self._client if self._client is not None else get_exchange()
+
+    def _key_lock(self, key):
+        # Cùng một key chỉ fetch một lần khi nhiều worker screening chạy song song.
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _count(self, kind, hit):
+        with self._lock:
+            (self.hits if hit else self.misses)[kind] += 1
+
+    def reset(self):
+        self._ohlcv = {}
+        self._tickers = {}
+        self._tickers_all = None
+        self._balance = None
+        self.hits = {"ohlcv": 0, "resampled": 0, "ticker": 0, "tickers": 0, "balance": 0}
+        self.misses = {"ohlcv": 0, "resampled": 0, "ticker": 0, "tickers": 0, "balance": 0}
+
+    def fetch_ohlcv(self, symbol, timeframe="1m", limit=100):
+        with self._key_lock(("ohlcv", symbol, timeframe)):
+            now = time.time()
+            cached = self._ohlcv.get((symbol, timeframe, limit))
+            if cached is None:
+                for (sym, tf, lim), entry in list(self._ohlcv.items()):
+                    if sym == symbol and tf == timeframe and lim > limit and entry[0] > now:
+                        cached = entry
+                        break
+            if cached is not None and cached[0] > now:
+                self._count("ohlcv", True)
+                return cached[1][-limit:]
+
+            self._count("ohlcv", False)
+            data = self._resampled(symbol, timeframe, limit)
+            if data is None:
+                candle_store = get_candle_store()
+                if candle_store is not None:
+                    data = candle_store.sync(self.client, symbol, timeframe, limit)
+                else:
+                    data = self.client.fetch_ohlcv(symbol, timeframe=timeframe, limit=limit)
+            self._ohlcv[(symbol, timeframe, limit)] = (_next_candle_close(timeframe, now), data)
+            return data
+
+    def _resampled(self, symbol, timeframe, limit):
+        base = RESAMPLE_FROM.get(timeframe)
+        if base is None:
+            return None
+        base_limit = limit * (_tf_seconds(timeframe) // _tf_seconds(base))
+        data = None
+        candle_store = get_candle_store()
+        if base_limit <= RESAMPLE_MAX_BASE_BARS or (
+            candle_store is not None and candle_store.covers(symbol, base, base_limit)
+        ):
+            try:
+                data = resample_ohlcv(self.fetch_ohlcv(symbol, base, base_limit), base, timeframe)
+            except Exception as e:
+                logger.warning("⚠️ Không thể dựng nến %s từ %s cho %s: %s", timeframe, base, symbol, e, extra={"stage": "resample"})
+        if data is None or len(data) < limit:
+            # Lịch sử khung nhỏ chưa đủ -> fetch native.
+            self._count("resampled", False)
+            return None
+        self._count("resampled", True)
+        return data[-limit:]
+
+    def fetch_ticker(self, symbol):
+        with self._key_lock(("ticker", symbol)):
+            now = time.time()
+            cached = self._tickers.get(symbol)
+            snapshot = self._tickers_all
+            if (cached is None or cached[0] <= now) and snapshot is not None and snapshot[0] > now:
+                tkr = snapshot[1].get(symbol)
+                if tkr is not None:
+                    cached = (snapshot[0], tkr)
+            if cached is not None and cached[0] > now:
+                self._count("ticker", True)
+                return cached[1]
+
+            self._count("ticker", False)
+            tkr = self.client.fetch_ticker(symbol)
+            self._tickers[symbol] = (now + TICKER_TTL, tkr)
+            return tkr
+
+    def fetch_tickers(self, symbols=None):
+        if symbols is not None:
+            return self._fetch_ticker_subset(list(dict.fromkeys(symbols)))
+        with self._key_lock(("tickers",)):
+            now = time.time()
+            if self._tickers_all is not None and self._tickers_all[0] > now:
+                self._count("tickers", True)
+                return self._tickers_all[1]
+
+            self._count("tickers", False)
+            tickers = self.client.fetch_tickers()
+            self._tickers_all = (now + TICKER_TTL, tickers)
+            return tickers
+
+    def _fetch_ticker_subset(self, symbols):
+        if not symbols:
+            return {}
+        with self._key_lock(("tickers",)):
+            now = time.time()
+            snapshot = self._tickers_all
+            if snapshot is not None and snapshot[0] > now:
+                self._count("tickers", True)
+                return {s: snapshot[1][s] for s in symbols if s in snapshot[1]}
+            out = {}
+            for symbol in symbols:
+                cached = self._tickers.get(symbol)
+                if cached is not None and cached[0] > now:
+                    out[symbol] = cached[1]
+            missing = [s for s in symbols if s not in out]
+            self._count("tickers", not missing)
+            if missing:
+                for symbol, tkr in self.client.fetch_tickers(missing).items():
+                    self._tickers[symbol] = (now + TICKER_TTL, tkr)
+                    out[symbol] = tkr
+            return out
+
+    def fetch_balance(self):
+        with self._key_lock(("balance",)):
+            if self._balance is not None:
+                self._count("balance", True)
+                return self._balance
+
+            self._count("balance", False)
+            self._balance = self.client.fetch_balance()
+            return self._balance
+
+    def invalidate_balance(self):
+        with self._key_lock(("balance",)):
+            self._balance = None
+
+    def invalidate_ohlcv(self):
+        """Bỏ toàn bộ OHLCV để chu kỳ sau đọc lại nến đang chạy.
+
+        Nến đã đóng vẫn nằm trong CandleStore nên lần fetch lại chỉ kéo phần đuôi.
+        """
+        with self._lock:
+            self._ohlcv = {}
+
+    def prune(self):
+        """Bỏ OHLCV/ticker đã hết hạn; daemon gọi sau mỗi chu kỳ để cache không phình."""
+        now = time.time()
+        expired = [key for key, (expires, _) in list(self._ohlcv.items()) if expires <= now]
+        expired_tickers = [key for key, (expires, _) in list(self._tickers.items()) if expires <= now]
+        for key in expired:
+            self._ohlcv.pop(key, None)
+        for key in expired_tickers:
+            self._tickers.pop(key, None)
+        return len(expired) + len(expired_tickers)
+
+    def stats(self):
+        return {
+            kind: {"hits": self.hits[kind], "misses": self.misses[kind]}
+            for kind in self.hits
+        }
+
+
+market_cache = MarketDataCache()
+
+
+STORAGE_SHEET_KEY = os.getenv("STORAGE_SHEET_KEY", "1AmnD1ekwTZeZrp8kGRCymMDwCySJkec0WdulNX9LyOY")
+STORAGE_WORKSHEET = os.getenv("STORAGE_WORKSHEET", "spot_entry_storage")
 
 
 def init_storage_sheet():
+    import gspread
+    from oauth2client.service_account import ServiceAccountCredentials
+
     scope = [
         "https://spreadsheets.google.com/feeds",
         "https://www.googleapis.com/auth/drive"
@@ -177,342 +944,1297 @@ def init_storage_sheet():
     )
 
     client = gspread.authorize(creds)
-    sheet = client.open_by_key("1AmnD1ekwTZeZrp8kGRCymMDwCySJkec0WdulNX9LyOY").worksheet("spot_entry_storage")
+    sheet = client.open_by_key(STORAGE_SHEET_KEY).worksheet(STORAGE_WORKSHEET)
 
-    return sheet
+    return instrumentation.instrument(sheet, "sheet", nested=("spreadsheet",))
 
 
-storage_sheet = init_storage_sheet()
+def get_storage_sheet():
+    return _lazy_client("storage_sheet", init_storage_sheet)
 
-def load_entry_prices():
+
+def set_storage_sheet(sheet):
+    _clients["storage_sheet"] = instrumentation.instrument(sheet, "sheet", nested=("spreadsheet",))
+
+
+# ===================== ENTRY STORE (LOCAL + WRITE-BEHIND SHEET) =====================
+ENTRY_DB_PATH = os.getenv("ENTRY_DB_PATH", "spot_entries.db")
+SHEET_SYNC_INTERVAL = float(os.getenv("SHEET_SYNC_INTERVAL", 5))
+SHEET_COLUMNS = ["Symbol", "Entry Price", "Stop", "TP", "Timestamp"]
+
+
+class EntryStore:
+    """Nguồn dữ liệu chính cho entry: SQLite cục bộ, index theo symbol.
+
+    Mỗi thay đổi được ghi kèm một dòng vào bảng outbox trong cùng transaction;
+    SheetSyncer đọc outbox để đẩy lên worksheet spot_entry_storage.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "symbol TEXT PRIMARY KEY, price REAL NOT NULL, stop, tp, timestamp TEXT, algo_id TEXT)"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(entries)")}
+        if "algo_id" not in columns:
+            self._conn.execute("ALTER TABLE entries ADD COLUMN algo_id TEXT")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, symbol TEXT NOT NULL, op TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def _write(self, sql, params, symbol, op):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(sql, params)
+                self._conn.execute("INSERT INTO outbox (symbol, op) VALUES (?, ?)", (symbol, op))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def all(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT symbol, price, stop, tp, timestamp, algo_id FROM entries").fetchall()
+        return {
+            symbol: {"price": price, "stop": stop, "tp": tp, "timestamp": ts, "algo_id": algo_id}
+            for symbol, price, stop, tp, ts, algo_id in rows
+        }
+
+    def get(self, symbol):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT price, stop, tp, timestamp, algo_id FROM entries WHERE symbol = ?", (symbol,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"price": row[0], "stop": row[1], "tp": row[2], "timestamp": row[3], "algo_id": row[4]}
+
+    def needs_bootstrap(self):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM meta WHERE key = 'bootstrapped'").fetchone() is None
+
+    def upsert(self, symbol, price, stop, tp, timestamp, algo_id=None):
+        self._write(
+            "INSERT INTO entries (symbol, price, stop, tp, timestamp, algo_id) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(symbol) DO UPDATE SET price = excluded.price, stop = excluded.stop, "
+            "tp = excluded.tp, timestamp = excluded.timestamp, algo_id = excluded.algo_id",
+            (symbol, price, stop, tp, timestamp, algo_id), symbol, "upsert",
+        )
+
+    def set_algo_id(self, symbol, algo_id):
+        # Sheet không có cột algo_id nên không cần ghi outbox.
+        with self._lock:
+            self._conn.execute("UPDATE entries SET algo_id = ? WHERE symbol = ?", (algo_id, symbol))
+
+    def delete(self, symbol):
+        self._write("DELETE FROM entries WHERE symbol = ?", (symbol,), symbol, "delete")
+
+    def replace_all(self, data):
+        # Nạp lại toàn bộ từ sheet (bootstrap), không tạo outbox. Symbol còn
+        # thay đổi chưa sync (outbox) giữ bản cục bộ, không bị sheet ghi đè.
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                pending = {r[0] for r in self._conn.execute("SELECT DISTINCT symbol FROM outbox")}
+                self._conn.execute("DELETE FROM entries WHERE symbol NOT IN (SELECT symbol FROM outbox)")
+                self._conn.executemany(
+                    "INSERT INTO entries (symbol, price, stop, tp, timestamp) VALUES (?, ?, ?, ?, ?)",
+                    [(k, v["price"], v.get("stop"), v.get("tp"), v.get("timestamp")) for k, v in data.items() if k not in pending],
+                )
+                self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('bootstrapped', ?)", (_now_iso(),))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def pending(self, limit=500):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT id, symbol, op FROM outbox ORDER BY id LIMIT ?", (limit,)
+            ).fetchall()
+
+    def ack(self, max_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM outbox WHERE id <= ?", (max_id,))
+
+
+def _sheet_cell(value):
+    if value is None or value == "":
+        return {}
+    if isinstance(value, bool):
+        return {"userEnteredValue": {"boolValue": value}}
+    if isinstance(value, (int, float)):
+        return {"userEnteredValue": {"numberValue": value}}
+    return {"userEnteredValue": {"stringValue": str(value)}}
+
+
+class SheetMutationBatcher:
+    """Gom upsert/delete theo symbol rồi áp dụng bằng một spreadsheet.batch_update.
+
+    Chỉ số dòng được lấy một lần từ cột Symbol. Thứ tự request trong batch:
+    updateCells (theo chỉ số gốc) -> deleteDimension từ dưới lên -> appendCells,
+    nên việc xoá dòng không làm lệch các dòng còn lại.
+    """
+
+    def __init__(self):
+        self.upserts = {}
+        self.deletes = set()
+
+    def __len__(self):
+        return len(self.upserts) + len(self.deletes)
+
+    def upsert(self, symbol, values):
+        self.deletes.discard(symbol)
+        self.upserts[symbol] = list(values)
+
+    def delete(self, symbol):
+        self.upserts.pop(symbol, None)
+        self.deletes.add(symbol)
+
+    def build_requests(self, sheet_id, symbol_col):
+        rows = {}
+        for i, symbol in enumerate(symbol_col[1:], start=2):
+            if symbol:
+                rows.setdefault(symbol, []).append(i)
+
+        updates, delete_rows, appends = [], [], []
+        for symbol, values in self.upserts.items():
+            if symbol in rows:
+                first, *dupes = rows[symbol]
+                delete_rows.extend(dupes)
+                updates.append({"updateCells": {
+                    "range": {
+                        "sheetId": sheet_id,
+                        "startRowIndex": first - 1, "endRowIndex": first,
+                        "startColumnIndex": 1, "endColumnIndex": 1 + len(values),
+                    },
+                    "rows": [{"values": [_sheet_cell(v) for v in values]}],
+                    "fields": "userEnteredValue",
+                }})
+            else:
+                appends.append({"values": [_sheet_cell(v) for v in [symbol] + values]})
+        for symbol in self.deletes:
+            delete_rows.extend(rows.get(symbol, []))
+
+        requests_ = updates
+        for row_idx in sorted(set(delete_rows), reverse=True):
+            requests_.append({"deleteDimension": {"range": {
+                "sheetId": sheet_id, "dimension": "ROWS",
+                "startIndex": row_idx - 1, "endIndex": row_idx,
+            }}})
+        if appends:
+            requests_.append({"appendCells": {"sheetId": sheet_id, "rows": appends, "fields": "userEnteredValue"}})
+        return requests_
+
+    def apply(self, sheet):
+        if not self:
+            return 0
+        requests_ = self.build_requests(sheet.id, sheet.col_values(1))
+        if requests_:
+            sheet.spreadsheet.batch_update({"requests": requests_})
+        applied = len(self)
+        self.upserts.clear()
+        self.deletes.clear()
+        return applied
+
+
+class SheetSyncer:
+    """Write-behind: định kỳ gom outbox của EntryStore và đẩy lên Google Sheet."""
+
+    def __init__(self, store, interval=SHEET_SYNC_INTERVAL):
+        self.store = store
+        self.interval = interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._sync_lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sheet-syncer", daemon=True)
+            self._thread.start()
+
+    def notify(self):
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.sync_once()
+
+    def sync_once(self):
+        with self._sync_lock:
+            ops = self.store.pending()
+            if not ops:
+                return 0
+            # Mỗi symbol chỉ cần trạng thái cuối cùng trong store.
+            symbols = list(dict.fromkeys(symbol for _, symbol, _ in ops))
+            try:
+                self._push(symbols)
+            except Exception as e:
+                logger.warning("⚠️ Sync Google Sheet lỗi, sẽ thử lại: %s", e, extra={"stage": "sheet"})
+                return 0
+            self.store.ack(ops[-1][0])
+            logger.info("☁️ Đã sync %s entry lên Google Sheet", len(symbols), extra={"stage": "sheet"})
+            return len(symbols)
+
+    def _push(self, symbols):
+        batch = SheetMutationBatcher()
+        for symbol in symbols:
+            entry = self.store.get(symbol)
+            if entry is None:
+                batch.delete(symbol)
+            else:
+                batch.upsert(symbol, [entry["price"], entry["stop"], entry["tp"], entry["timestamp"]])
+        batch.apply(get_storage_sheet())
+
+    def flush(self, timeout=30):
+        deadline = time.time() + timeout
+        while self.store.pending(limit=1) and time.time() < deadline:
+            if not self.sync_once():
+                time.sleep(1)
+
+    def stop(self, timeout=30):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush(timeout)
+
+
+def get_entry_store():
+    return _lazy_client("entry_store", lambda: EntryStore(ENTRY_DB_PATH))
+
+
+def set_entry_store(store):
+    _clients["entry_store"] = store
+    _clients.pop("sheet_syncer", None)
+
+
+def get_sheet_syncer():
+    return _lazy_client("sheet_syncer", lambda: SheetSyncer(get_entry_store()))
+
+
+def _load_entries_from_sheet():
     data = {}
-    try:
-        records = storage_sheet.get_all_records()
+    records = get_storage_sheet().get_all_records()
+
+    for row in records:
+        symbol = row.get("Symbol")
+        price = row.get("Entry Price")
+
+        if symbol and price:
+            data[symbol] = {
+                "price": float(price),
+                "stop": row.get("Stop"),
+                "tp": row.get("TP"),
+                "timestamp": row.get("Timestamp")
+            }
+    return data
 
-        for row in records:
-            symbol = row.get("Symbol")
-            price = row.get("Entry Price")
 
-            if symbol and price:
-                data[symbol] = {
-                    "price": float(price),
-                    "stop": row.get("Stop"),
-                    "tp": row.get("TP"),
-                    "timestamp": row.get("Timestamp")
-                }
+def load_entry_prices():
+    try:
+        if get_entry_store().needs_bootstrap():
+            get_entry_store().replace_all(_load_entries_from_sheet())
+            logger.info("📥 Đã nạp entry từ Google Sheet vào store cục bộ")
 
-        logger.info(f"📂 Loaded {len(data)} entries từ Google Sheet")
+        data = get_entry_store().all()
+        logger.info("📂 Loaded %s entries từ store cục bộ", len(data), extra={"stage": "sell"})
         return data
 
     except Exception as e:
-        logger.error(f"❌ Lỗi load Google Sheet: {e}")
+        logger.error("❌ Lỗi load entry: %s", e, extra={"stage": "sell"})
         return {}
 
 
-def send_to_telegram(message):
-    token = TELEGRAM_TOKEN
-    chat_id = TELEGRAM_CHAT_ID
-    if not token or not chat_id:
-        logger.warning("⚠️ Thiếu TELEGRAM_BOT_TOKEN hoặc TELEGRAM_CHAT_ID")
-        return False
+# ===================== TELEGRAM NOTIFIER =====================
+# Tin Telegram đi qua hàng đợi và một thread nền: lệnh mua/bán không bao giờ
+# phải chờ Telegram API. Các tin đến trong TELEGRAM_COALESCE_SECONDS được gom
+# thành một message; khi thoát, stop() cố gửi nốt trong TELEGRAM_FLUSH_TIMEOUT.
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
+TELEGRAM_COALESCE_SECONDS = float(os.getenv("TELEGRAM_COALESCE_SECONDS", 2))
+TELEGRAM_FLUSH_TIMEOUT = float(os.getenv("TELEGRAM_FLUSH_TIMEOUT", 10))
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", 5))
+TELEGRAM_MAX_CHARS = 4096
+
 
-    url = f"https://api.telegram.org/bot{token}/sendMessage"
+def _post_telegram(text):
+    """Gửi một message; trả về (ok, retry_after) với retry_after=None nếu không nên thử lại."""
+    url = f"{TELEGRAM_API_URL}/bot{TELEGRAM_TOKEN}/sendMessage"
     data = {
-        "chat_id": chat_id,
-        "text": message,
+        "chat_id": TELEGRAM_CHAT_ID,
+        "text": text,
         "parse_mode": "Markdown",
     }
     try:
-        res = requests.post(url, data=data, timeout=15)
-        if not res.ok:
-            logger.warning(f"⚠️ Telegram API lỗi: {res.status_code} - {res.text}")
-            return False
-        return True
+        with instrumentation.timer("telegram.send_message"):
+            res = get_telegram_session().post(url, data=data, timeout=15)
     except Exception as e:
-        logger.warning(f"⚠️ Không thể gửi Telegram: {e}")
+        logger.warning("⚠️ Không thể gửi Telegram: %s", e, extra={"stage": "telegram"})
+        return False, 0
+    if res.ok:
+        return True, None
+    instrumentation.REGISTRY.count_error("telegram.send_message", f"http_{res.status_code}")
+    logger.warning(
+        "⚠️ Telegram API lỗi: %s - %s", res.status_code, res.text,
+        extra={"stage": "telegram", "reason": res.status_code},
+    )
+    if res.status_code == 429:
+        try:
+            return False, float(res.json()["parameters"]["retry_after"])
+        except Exception:
+            return False, float(res.headers.get("Retry-After") or 1)
+    if res.status_code >= 500:
+        return False, 0
+    return False, None
+
+
+def _chunk_messages(messages, limit=TELEGRAM_MAX_CHARS):
+    # Ghép nguyên từng tin, không cắt giữa tin để giữ nguyên Markdown.
+    chunks, current = [], ""
+    for message in messages:
+        if current and len(current) + 2 + len(message) > limit:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n\n{message}" if current else message
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class TelegramNotifier:
+    """Hàng đợi Telegram không chặn: gom tin, retry theo retry_after khi 429."""
+
+    def __init__(self, window=TELEGRAM_COALESCE_SECONDS, max_retries=TELEGRAM_MAX_RETRIES):
+        self.window = window
+        self.max_retries = max_retries
+        self.sent = 0
+        self.dropped = 0
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        self._deadline = None
+        self._start_lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._deadline = None
+                self._thread = threading.Thread(target=self._run, name="telegram-notifier", daemon=True)
+                self._thread.start()
+
+    def send(self, message):
+        self._queue.put(message)
+        self.start()
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            if self._deadline is not None and time.monotonic() >= self._deadline:
+                self._drop(batch + self._drain())
+                return
+            for chunk in _chunk_messages(batch):
+                if not self._deliver(chunk):
+                    self._drop([chunk])
+
+    def _next_batch(self):
+        # None = đã stop và hết tin; [] = chưa có gì, chờ tiếp.
+        try:
+            first = self._queue.get_nowait() if self._stop.is_set() else self._queue.get(timeout=1)
+        except queue.Empty:
+            return None if self._stop.is_set() else []
+        batch = [first] if first is not None else []
+        end = time.monotonic() + self.window
+        while True:
+            remaining = 0 if self._stop.is_set() else end - time.monotonic()
+            try:
+                message = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if message is not None:
+                batch.append(message)
+        return batch
+
+    def _drain(self):
+        messages = []
+        while True:
+            try:
+                message = self._queue.get_nowait()
+            except queue.Empty:
+                return messages
+            if message is not None:
+                messages.append(message)
+
+    def _deliver(self, text):
+        for attempt in range(self.max_retries + 1):
+            ok, retry_after = _post_telegram(text)
+            if ok:
+                self.sent += 1
+                return True
+            if retry_after is None or attempt == self.max_retries:
+                return False
+            delay = retry_after or min(2 ** attempt, 30)
+            if not self._backoff(delay):
+                return False
+            instrumentation.REGISTRY.add_wait("telegram", delay)
         return False
 
+    def _backoff(self, delay):
+        # Trong lúc stop() chỉ chờ nếu vẫn còn trong ngân sách thời gian.
+        until = time.monotonic() + delay
+        while True:
+            if self._deadline is not None and until > self._deadline:
+                return False
+            remaining = until - time.monotonic()
+            if remaining <= 0:
+                return True
+            if self._stop.is_set():
+                time.sleep(remaining)
+            else:
+                self._stop.wait(remaining)
 
-def pre_buy_screen_and_sizing(symbol, fallback_usdt):
+    def _drop(self, messages):
+        messages = [m for m in messages if m]
+        if messages:
+            self.dropped += len(messages)
+            logger.warning("⚠️ Bỏ %s tin Telegram chưa gửi được", len(messages), extra={"stage": "telegram", "reason": "dropped"})
+
+    def stop(self, timeout=TELEGRAM_FLUSH_TIMEOUT):
+        self._deadline = time.monotonic() + timeout
+        self._stop.set()
+        self._queue.put(None)
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._drop(self._drain())
+
+
+def get_telegram_notifier():
+    return _lazy_client("telegram_notifier", TelegramNotifier)
+
+
+def set_telegram_notifier(notifier):
+    _clients["telegram_notifier"] = notifier
+
+
+def send_to_telegram(message):
+    """Đưa tin vào hàng đợi gửi nền; trả về ngay, không chờ Telegram API."""
+    if not TELEGRAM_TOKEN or not TELEGRAM_CHAT_ID:
+        logger.warning("⚠️ Thiếu TELEGRAM_BOT_TOKEN hoặc TELEGRAM_CHAT_ID")
+        return False
+    get_telegram_notifier().send(message)
+    return True
+
+
+def bulk_prescreen(symbols=None):
+    """Lọc thanh khoản/spread cho nhiều symbol từ một snapshot fetch_tickers().
+
+    symbols dạng "BTC-USDT"; None = toàn bộ cặp USDT spot. Trả về list symbol
+    đạt điều kiện, xếp theo volume 24h giảm dần.
+    """
+    tickers = market_cache.fetch_tickers()
+    if symbols is None:
+        symbols = [s.replace("/", "-") for s in tickers if s.endswith("/USDT")]
+
+    ranked = []
+    for symbol in dict.fromkeys(symbols):
+        tkr = tickers.get(symbol.replace("-", "/"))
+        if not tkr:
+            logger.info("⛔ Bỏ %s lý do: no_ticker", symbol, extra={"stage": "prescreen", "reason": "no_ticker"})
+            continue
+        if not _pass_liquidity_and_spread(tkr):
+            logger.info("⛔ Bỏ %s lý do: liquidity", symbol, extra={"stage": "prescreen", "reason": "liquidity"})
+            continue
+        ranked.append((_quote_volume(tkr), symbol))
+    ranked.sort(key=lambda x: x[0], reverse=True)
+    return [symbol for _, symbol in ranked]
+
+
+@instrumentation.timed("screen.pre_buy", symbol_arg=True)
+def pre_buy_screen(symbol):
     sym_slash = symbol.replace("-", "/")
     try:
-        tkr = exchange.fetch_ticker(sym_slash)
+        tkr = market_cache.fetch_ticker(sym_slash)
     except Exception as e:
-        logger.info(f"⛔ Bỏ {symbol}: không lấy được ticker ({e})")
-        return False, None, None, None, None, "no_ticker"
+        logger.info("⛔ Bỏ %s: không lấy được ticker (%s)", symbol, e, extra={"stage": "pre_buy", "reason": "no_ticker"})
+        return False, None, None, None, "no_ticker"
     if not _pass_liquidity_and_spread(tkr):
-        return False, None, None, None, None, "liquidity"
+        return False, None, None, None, "liquidity"
     entry = float(tkr.get("last") or 0.0)
     if entry <= 0:
-        return False, None, None, None, None, "bad_price"
-    o15 = exchange.fetch_ohlcv(sym_slash, timeframe="15m", limit=120)
+        return False, None, None, None, "bad_price"
+    o15 = market_cache.fetch_ohlcv(sym_slash, timeframe="15m", limit=SCREEN_15M_LIMIT)
+    btc15 = market_cache.fetch_ohlcv("BTC/USDT", timeframe="15m", limit=80)
+    passed, stop, tp, reason = evaluate_entry(o15, btc15, entry)
+    if not passed:
+        return False, None, None, None, reason
+    return True, float(entry), float(stop), float(tp), reason
+
+
+@instrumentation.timed("indicators.evaluate_entry")
+def evaluate_entry(o15, btc15, entry, params=None):
+    """Bộ lọc kỹ thuật + stop/tp của pre_buy_screen trên dữ liệu có sẵn (dùng chung với backtest)."""
+    params = UPGRADE if params is None else params
     if len(o15) < 40:
-        return False, None, None, None, None, "no_ohlcv"
+        return False, None, None, "no_ohlcv"
     adx_val = _adx14(o15)
     atrp = _atr_pct(o15)
     closes15 = [x[4] for x in o15]
-    bbw = _bb_width(closes15)
+    bb_stats = indicators.RollingBollinger()
+    bbw = bb_stats.extend(closes15)
     vols = [x[5] for x in o15][-50:]
-    vthr = _percentile(vols, UPGRADE["vol_pctile"]) or 0.0
+    vthr = _percentile(vols, params["vol_pctile"]) or 0.0
     vol_ok = len(vols) >= 10 and vols[-1] >= max(vthr, sum(vols) / len(vols))
 
-    btc15 = exchange.fetch_ohlcv("BTC/USDT", timeframe="15m", limit=80)
     btc_ok = True
     if len(btc15) >= 3:
         nowp = btc15[-1][4]
         past = btc15[-3][4]
-        btc_ok = ((nowp - past) / past) > -UPGRADE["btc_drop_block"]
+        btc_ok = ((nowp - past) / past) > -params["btc_drop_block"]
 
-    choppy_ok = adx_val is not None and adx_val >= UPGRADE["min_adx"] and atrp >= UPGRADE["min_atr_pct"]
-    widths = []
-    for i in range(20, len(closes15)):
-        widths.append(_bb_width(closes15[:i]))
-    p25 = _percentile(widths, UPGRADE["min_bbwidth_pctile"]) or 0.0
+    choppy_ok = adx_val is not None and adx_val >= params["min_adx"] and atrp >= params["min_atr_pct"]
+    p25 = bb_stats.percentile(params["min_bbwidth_pctile"]) or 0.0
     bbw_ok = bbw >= p25
     if not (choppy_ok and bbw_ok and vol_ok and btc_ok):
-        return False, None, None, None, None, "filters"
+        return False, None, None, "filters"
 
     lowN = min(x[3] for x in o15[-10:])
     stop_atr = entry - 1.8 * (atrp * entry)
     stop = max(lowN, stop_atr)
     if stop >= entry:
-        return False, None, None, None, None, "rr_invalid"
-    tp = entry + UPGRADE["min_rr"] * (entry - stop)
+        return False, None, None, "rr_invalid"
+    tp = entry + params["min_rr"] * (entry - stop)
+    return True, float(stop), float(tp), "ok"
+
+
+SCORE_WEIGHTS = {"adx": 0.25, "atr": 0.15, "volume": 0.2, "rr": 0.2, "trend": 0.2}
+
+
+def score_setup(o15, entry, stop, trend_score, params=None):
+    """Điểm 0..1 để xếp hạng các coin đã qua evaluate_entry.
+
+    Gồm ADX, ATR%, percentile volume nến cuối, R:R tới đỉnh 50 nến (tp luôn
+    bằng min_rr nên dùng khoảng trống tới đỉnh thay thế) và điểm trend đa khung.
+    """
+    params = UPGRADE if params is None else params
+    adx_val = _adx14(o15) or 0.0
+    atrp = _atr_pct(o15)
+    vols = [x[5] for x in o15][-50:]
+    vol_rank = sum(1 for v in vols if v <= vols[-1]) / len(vols) if vols else 0.0
+    risk = entry - stop
+    room = max(x[2] for x in o15[-50:]) - entry if o15 else 0.0
+    rr = room / risk if risk > 0 else 0.0
+    parts = {
+        "adx": min(adx_val / 50, 1.0),
+        "atr": min(atrp / (3 * params["min_atr_pct"]), 1.0) if params["min_atr_pct"] > 0 else 0.0,
+        "volume": vol_rank,
+        "rr": min(max(rr, 0.0) / (2 * params["min_rr"]), 1.0),
+        "trend": min(trend_score / (2 * len(TREND_TIMEFRAMES)), 1.0),
+    }
+    return sum(SCORE_WEIGHTS[k] * v for k, v in parts.items())
+
+
+MIN_ORDER_USDT = 5
+
 
-    bal = exchange.fetch_balance()
+def size_position(entry, stop, fallback_usdt):
+    bal = market_cache.fetch_balance()
     free_usdt = float(bal.get("USDT", {}).get("free", 0.0))
     risk_usdt = free_usdt * UPGRADE["risk_per_trade"]
     loss_per_unit = entry - stop
     amt = risk_usdt / loss_per_unit if loss_per_unit > 0 else 0.0
-    if amt * entry < 5:
+    if amt * entry < MIN_ORDER_USDT:
         amt = fallback_usdt / entry
-    return True, float(amt), float(entry), float(stop), float(tp), "ok"
+    return float(amt)
+
+
+def pre_buy_screen_and_sizing(symbol, fallback_usdt):
+    passed, entry, stop, tp, reason = pre_buy_screen(symbol)
+    if not passed:
+        return False, None, None, None, None, reason
+    return True, size_position(entry, stop, fallback_usdt), entry, stop, tp, reason
+
 
 def _save_bought_coin(symbol: str, entry_price: float, stop_price, tp_price):
     key = symbol.upper().replace("/", "-")
 
     try:
-        records = storage_sheet.get_all_records()
-
-        for i, row in enumerate(records):
-            if row.get("Symbol") == key:
-                storage_sheet.update(f"B{i+2}:E{i+2}", [[
-                    entry_price,
-                    stop_price,
-                    tp_price,
-                    _now_iso()
-                ]])
-                return key, {
-                    "price": entry_price,
-                    "stop": stop_price,
-                    "tp": tp_price,
-                    "timestamp": _now_iso()
-                }
-
-        storage_sheet.append_row([
-            key,
-            entry_price,
-            stop_price,
-            tp_price,
-            _now_iso()
-        ])
-
+        ts = _now_iso()
+        get_entry_store().upsert(key, entry_price, stop_price, tp_price, ts)
+        get_sheet_syncer().notify()
         return key, {
             "price": entry_price,
             "stop": stop_price,
             "tp": tp_price,
-            "timestamp": _now_iso()
+            "timestamp": ts
         }
 
     except Exception as e:
-        logger.error(f"❌ Lỗi ghi Google Sheet: {e}")
+        logger.error("❌ Lỗi ghi entry %s: %s", key, e, extra={"stage": "buy"})
         return key, {}
 
 
+def _remove_bought_coin(symbol_dash):
+    try:
+        get_entry_store().delete(symbol_dash)
+        get_sheet_syncer().notify()
+    except Exception as e:
+        logger.warning("⚠️ Không thể xoá %s khỏi store: %s", symbol_dash, e, extra={"stage": "sell"})
+
+
+def _exit_reason(entry_data, current_price):
+    """Luật thoát lệnh dùng chung cho auto_sell_once và watcher: "tp", "sl", "gain" hoặc None."""
+    entry_price = entry_data.get("price")
+    stop_in = entry_data.get("stop")
+    tp_in = entry_data.get("tp")
+    if isinstance(tp_in, (int, float)) and current_price >= tp_in:
+        return "tp"
+    if isinstance(stop_in, (int, float)) and current_price <= stop_in:
+        return "sl"
+    if ((current_price - entry_price) / entry_price) * 100 >= 30:
+        return "gain"
+    return None
+
+
+def _num_or_nan(value):
+    return float(value) if isinstance(value, (int, float)) else float("nan")
+
+
+class Position:
+    __slots__ = ("symbol_dash", "symbol_slash", "balance", "entry")
+
+    def __init__(self, symbol_dash, balance, entry):
+        self.symbol_dash = symbol_dash
+        self.symbol_slash = symbol_dash.replace("-", "/")
+        self.balance = balance
+        self.entry = entry
+
+
+class PositionSnapshot:
+    """Các coin đang giữ và có entry, index theo symbol, kèm cột entry/stop/tp.
+
+    Dựng bằng cách duyệt entry store (vài chục dòng) thay vì toàn bộ kết quả
+    fetch_balance() (key tổng hợp free/used/total/info, coin bụi, số dư 0).
+    exit_reasons() áp _exit_reason cho mọi vị thế trong một phép so sánh mảng.
+    """
+
+    def __init__(self, positions):
+        self.positions = list(positions)
+        self.index = {p.symbol_slash: i for i, p in enumerate(self.positions)}
+        self.entry = np.array([float(p.entry["price"]) for p in self.positions], dtype=float)
+        self.stop = np.array([_num_or_nan(p.entry.get("stop")) for p in self.positions], dtype=float)
+        self.tp = np.array([_num_or_nan(p.entry.get("tp")) for p in self.positions], dtype=float)
+
+    @classmethod
+    def build(cls, balances, entries, skip_armed=False):
+        """skip_armed=True bỏ các vị thế đã có lệnh OCO trên sàn."""
+        positions = []
+        for symbol_dash, entry_data in entries.items():
+            if not isinstance(entry_data, dict):
+                continue
+            balance_data = balances.get(symbol_dash.split("-")[0])
+            if not isinstance(balance_data, dict):
+                continue
+            try:
+                balance = float(balance_data.get("total") or 0)
+            except (TypeError, ValueError):
+                continue
+            if balance < 1:
+                continue
+            if not isinstance(entry_data.get("price"), (int, float)):
+                logger.warning("⚠️ %s entry_price KHÔNG phải số: %s", symbol_dash, entry_data.get("price"), extra={"stage": "sell"})
+                continue
+            if skip_armed and entry_data.get("algo_id"):
+                continue
+            positions.append(Position(symbol_dash, balance, entry_data))
+        return cls(positions)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __iter__(self):
+        return iter(self.positions)
+
+    def get(self, symbol_slash):
+        i = self.index.get(symbol_slash)
+        return None if i is None else self.positions[i]
+
+    def symbols(self):
+        return [p.symbol_slash for p in self.positions]
+
+    def prices(self, tickers):
+        """Giá last theo thứ tự vị thế; NaN nếu thiếu ticker hoặc giá không hợp lệ."""
+        out = np.full(len(self.positions), np.nan)
+        for i, p in enumerate(self.positions):
+            ticker = tickers.get(p.symbol_slash) or tickers.get(p.symbol_dash)
+            if not ticker or "last" not in ticker:
+                logger.warning(
+                    "⚠️ Không có giá hiện tại cho %s hoặc %s (ticker=None hoặc thiếu key 'last')",
+                    p.symbol_dash, p.symbol_slash, extra={"stage": "sell", "reason": "no_ticker"},
+                )
+                continue
+            try:
+                out[i] = float(ticker["last"])
+            except (TypeError, ValueError) as e:
+                logger.warning(
+                    "⚠️ Giá hiện tại của %s KHÔNG hợp lệ: %s (%s)", p.symbol_dash, ticker.get("last"), e,
+                    extra={"stage": "sell", "reason": "bad_price"},
+                )
+        return out
+
+    def exit_reasons(self, prices):
+        """Giống _exit_reason cho từng vị thế: list "tp"/"sl"/"gain"/None."""
+        prices = np.asarray(prices, dtype=float)
+        with np.errstate(invalid="ignore"):
+            tp = prices >= self.tp
+            sl = prices <= self.stop
+            gain = (prices - self.entry) / self.entry * 100 >= 30
+        reasons = np.where(tp, "tp", np.where(sl, "sl", np.where(gain, "gain", "")))
+        return [r or None for r in reasons.tolist()]
+
+
+@instrumentation.timed("run.sell", symbol_arg=True)
+@exchange_scheduler.priority(PRIORITY_EXIT)
+def _sell_position(symbol_dash, symbol_slash, balance, reason, entry_data, current_price):
+    entry_price = entry_data.get("price")
+    if reason == "tp":
+        logger.info(
+            "🎯 TP hit %s: entry=%s tp=%s last=%s", symbol_dash, entry_price, entry_data.get("tp"), current_price,
+            extra={"stage": "sell", "reason": reason},
+        )
+    elif reason == "sl":
+        logger.info(
+            "🛑 SL hit %s: entry=%s sl=%s last=%s", symbol_dash, entry_price, entry_data.get("stop"), current_price,
+            extra={"stage": "sell", "reason": reason},
+        )
+    else:
+        percent_gain = ((current_price - entry_price) / entry_price) * 100
+        logger.info(
+            "✅ CHỐT LỜI: %s tăng %.2f%% từ %s => %s", symbol_dash, percent_gain, entry_price, current_price,
+            extra={"stage": "sell", "reason": reason},
+        )
+
+    started = time.perf_counter()
+    try:
+        get_exchange().create_market_sell_order(symbol_slash, balance)
+        market_cache.invalidate_balance()
+    except Exception as e:
+        fields = {"stage": "sell", "reason": reason}
+        if reason == "tp":
+            logger.error("❌ Lỗi bán TP %s: %s", symbol_dash, e, extra=fields)
+        elif reason == "sl":
+            logger.error("❌ Lỗi bán SL %s: %s", symbol_dash, e, extra=fields)
+        else:
+            logger.error("❌ Lỗi khi bán %s: %s", symbol_dash, e, extra=fields)
+        return False
+
+    fields = {"stage": "sell", "reason": reason, "latency_ms": round((time.perf_counter() - started) * 1000, 1)}
+    if reason == "tp":
+        logger.info("✅ Đã bán TP %s số lượng %s", symbol_dash, balance, extra=fields)
+    elif reason == "sl":
+        logger.info("✅ Đã bán SL %s số lượng %s", symbol_dash, balance, extra=fields)
+    else:
+        logger.info("💰 Đã bán %s số lượng %s để chốt lời", symbol_dash, balance, extra=fields)
+    # xoá khỏi sheet
+    _remove_bought_coin(symbol_dash)
+    return True
+
+
+# ===================== EXCHANGE-SIDE EXITS (OCO) =====================
+# EXCHANGE_EXITS=true: ngay sau khi mua, đặt lệnh OCO (SL + TP, khớp market)
+# trên OKX qua algo order của ccxt để sàn tự thoát lệnh. algo id lưu trong
+# entry store; auto_sell_once/watcher bỏ qua các entry này và
+# reconcile_exchange_exits() đồng bộ kết quả khớp/huỷ về store.
+EXCHANGE_EXITS = os.getenv("EXCHANGE_EXITS", "false").lower() == "true"
+EXIT_DUST_USDT = float(os.getenv("EXIT_DUST_USDT", 5))
+ALGO_ORDER_PARAMS = {"trigger": True}
+
+
+def _arm_exchange_exit(symbol_dash, stop, tp):
+    """Đặt OCO (hoặc trigger đơn nếu chỉ có SL/TP) cho toàn bộ coin đang free; trả về algo id."""
+    if not stop and not tp:
+        return None
+    symbol_slash = symbol_dash.replace("-", "/")
+    market_cache.invalidate_balance()
+    amount = float(market_cache.fetch_balance().get(symbol_dash.split("-")[0], {}).get("free") or 0)
+    if amount <= 0:
+        logger.warning("⚠️ Không có %s free để đặt OCO", symbol_dash, extra={"stage": "oco", "reason": "no_balance"})
+        return None
+
+    params = {}
+    if stop:
+        params["stopLossPrice"] = float(stop)
+    if tp:
+        params["takeProfitPrice"] = float(tp)
+    try:
+        order = get_exchange().create_order(symbol_slash, "market", "sell", amount, None, params)
+    except Exception as e:
+        logger.error(
+            "❌ Không thể đặt OCO cho %s, dùng auto sell: %s", symbol_dash, e,
+            extra={"stage": "oco", "reason": "fallback"},
+        )
+        return None
+    market_cache.invalidate_balance()
+    algo_id = str(order["id"])
+    get_entry_store().set_algo_id(symbol_dash, algo_id)
+    logger.info(
+        "🛡 Đã đặt OCO %s: amount=%s sl=%s tp=%s (algo %s)", symbol_dash, amount, stop, tp, algo_id,
+        extra={"stage": "oco", "reason": "armed"},
+    )
+    return algo_id
+
+
+def reconcile_exchange_exits(entries=None):
+    """Đồng bộ trạng thái các lệnh OCO về entry store; trả về số entry đã thay đổi.
+
+    - closed + không còn coin: vị thế đã đóng -> xoá entry.
+    - closed nhưng còn coin (khớp một phần): đặt OCO mới cho phần còn lại.
+    - canceled/expired/rejected: bỏ algo id để auto sell theo dõi lại; nếu
+      coin đã hết (bán tay) thì xoá entry.
+    """
+    entries = get_entry_store().all() if entries is None else entries
+    armed = {symbol: entry for symbol, entry in _shard_entries(entries).items() if entry.get("algo_id")}
+    if not armed:
+        return 0
+
+    market_cache.invalidate_balance()
+    balances = market_cache.fetch_balance()
+    changed = 0
+    for symbol_dash, entry in armed.items():
+        algo_id = entry["algo_id"]
+        try:
+            order = get_exchange().fetch_order(algo_id, symbol_dash.replace("-", "/"), dict(ALGO_ORDER_PARAMS))
+        except Exception as e:
+            logger.warning("⚠️ Không lấy được trạng thái OCO %s (algo %s): %s", symbol_dash, algo_id, e, extra={"stage": "oco"})
+            continue
+        status = order.get("status")
+        if status == "open":
+            continue
+
+        remaining = float(balances.get(symbol_dash.split("-")[0], {}).get("total") or 0)
+        is_dust = remaining * float(entry["price"]) < EXIT_DUST_USDT
+        get_entry_store().set_algo_id(symbol_dash, None)
+        if status == "closed" and is_dust:
+            logger.info("✅ OCO %s đã khớp (algo %s), đóng vị thế", symbol_dash, algo_id, extra={"stage": "oco", "reason": status})
+            _remove_bought_coin(symbol_dash)
+            send_to_telegram(f"✅ OCO {symbol_dash} đã khớp trên sàn, vị thế đã đóng")
+        elif status == "closed":
+            logger.warning("⚠️ OCO %s khớp một phần, còn %s -> đặt lại OCO", symbol_dash, remaining, extra={"stage": "oco", "reason": "partial"})
+            _arm_exchange_exit(symbol_dash, entry.get("stop"), entry.get("tp"))
+        elif is_dust:
+            logger.info("🧹 OCO %s bị %s và không còn coin, xoá entry", symbol_dash, status, extra={"stage": "oco", "reason": status})
+            _remove_bought_coin(symbol_dash)
+        else:
+            logger.warning("⚠️ OCO %s bị %s, chuyển sang auto sell", symbol_dash, status, extra={"stage": "oco", "reason": status})
+        changed += 1
+    return changed
+
+
+@instrumentation.timed("run.auto_sell")
+@exchange_scheduler.priority(PRIORITY_EXIT)
 def auto_sell_once():
-    global spot_entry_prices
     logger.info("🟢 [AUTO SELL WATCHER] Đã khởi động luồng kiểm tra auto sell")
 
-    new_data = load_entry_prices()
-    if isinstance(new_data, dict):
-        spot_entry_prices = new_data.copy()
-    else:
-        spot_entry_prices = {}
-        logger.warning("⚠️ Dữ liệu load từ JSON không phải dict!")
+    try:
+        reconcile_exchange_exits()
+    except Exception as e:
+        logger.error("❌ Lỗi đồng bộ lệnh OCO: %s", e, extra={"stage": "oco"})
+
+    entries = load_entry_prices()
 
     try:
         logger.info("🔄 [AUTO SELL] Kiểm tra ví SPOT để chốt lời...")
-        balances = exchange.fetch_balance()
-        tickers = exchange.fetch_tickers()
-        updated_prices = spot_entry_prices.copy()
+        snapshot = PositionSnapshot.build(market_cache.fetch_balance(), _shard_entries(entries), skip_armed=True)
+        if not snapshot:
+            return
+        prices = snapshot.prices(market_cache.fetch_tickers(snapshot.symbols()))
 
-        for coin, balance_data in balances.items():
-            was_updated = False
+        for position, current_price, reason in zip(snapshot, prices.tolist(), snapshot.exit_reasons(prices)):
+            if reason is None:
+                continue
             try:
-                if not isinstance(balance_data, dict):
-                    continue
-                if "total" not in balance_data:
-                    continue
+                # _sell_position tự xoá entry của coin vừa bán khỏi store.
+                _sell_position(position.symbol_dash, position.symbol_slash, position.balance, reason, position.entry, current_price)
+            except Exception as e:
+                logger.error("❌ Lỗi khi xử lý coin %s: %s", position.symbol_dash, e, extra={"stage": "sell"})
+                continue
+    except Exception as e:
+        logger.error("❌ Lỗi chính trong auto_sell_once(): %s", e, extra={"stage": "sell"})
 
-                balance = float(balance_data.get("total", 0))
-                if balance <= 0:
-                    continue
-                if balance < 1:
-                    continue
-                if coin.upper() == "USDT":
-                    continue
 
-                symbol_dash = f"{coin}-USDT"
-                symbol_slash = f"{coin}/USDT"
-                ticker = tickers.get(symbol_dash) or tickers.get(symbol_slash)
-                if not ticker or "last" not in ticker:
-                    logger.warning(f"⚠️ Không có giá hiện tại cho {symbol_dash} hoặc {symbol_slash} (ticker=None hoặc thiếu key 'last')")
-                    continue
+# ===================== PRICE WATCHER (WEBSOCKET) =====================
+WATCH_REFRESH_SECONDS = float(os.getenv("WATCH_REFRESH_SECONDS", 60))
+# Bán lỗi thì symbol nghỉ WATCH_SELL_RETRY_SECONDS, gấp đôi sau mỗi lần lỗi
+# liên tiếp (tối đa WATCH_SELL_RETRY_MAX), thay vì gửi lệnh lại ở mỗi tick.
+WATCH_SELL_RETRY_SECONDS = float(os.getenv("WATCH_SELL_RETRY_SECONDS", 15))
+WATCH_SELL_RETRY_MAX = float(os.getenv("WATCH_SELL_RETRY_MAX", 600))
+
+
+class PriceFeed(abc.ABC):
+    """Nguồn giá cho watcher.
+
+    subscribe() nhận danh sách symbol dạng "BTC/USDT"; ticks() lặp các cặp
+    (symbol, last) và yield None khi rảnh quá `idle_timeout` giây để watcher
+    có cơ hội làm mới danh sách vị thế. ticks() kết thúc khi feed đóng.
+    """
+
+    @abc.abstractmethod
+    def subscribe(self, symbols):
+        ...
+
+    @abc.abstractmethod
+    def ticks(self, idle_timeout=1.0):
+        ...
+
+    def close(self):
+        pass
 
+
+class OkxTickerFeed(PriceFeed):
+    """Ticker stream public của OKX qua ccxt.pro, chạy event loop trong thread riêng."""
+
+    def __init__(self):
+        self._symbols = []
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def subscribe(self, symbols):
+        self._symbols = list(symbols)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="okx-ticker-feed", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        asyncio.run(self._watch())
+
+    async def _watch(self):
+        import ccxt.pro as ccxtpro
+
+        client = ccxtpro.okx({"options": {"defaultType": "spot"}})
+        try:
+            while not self._stop.is_set():
+                symbols = self._symbols
+                if not symbols:
+                    await asyncio.sleep(0.5)
+                    continue
                 try:
-                    current_price = float(ticker["last"])
+                    tickers = await client.watch_tickers(symbols)
                 except Exception as e:
-                    logger.warning(f"⚠️ Giá hiện tại của {coin} KHÔNG hợp lệ: {ticker.get('last')} ({e})")
+                    logger.warning("⚠️ Lỗi WebSocket ticker: %s", e, extra={"stage": "sell", "reason": "websocket"})
+                    await asyncio.sleep(1)
                     continue
+                for symbol, tkr in tickers.items():
+                    if tkr.get("last") is not None:
+                        self._queue.put((symbol, float(tkr["last"])))
+        finally:
+            await client.close()
+            self._queue.put(StopIteration)
+
+    def ticks(self, idle_timeout=1.0):
+        while True:
+            try:
+                item = self._queue.get(timeout=idle_timeout)
+            except queue.Empty:
+                yield None
+                continue
+            if item is StopIteration:
+                return
+            yield item
 
-                entry_data = spot_entry_prices.get(symbol_dash)
-                if not isinstance(entry_data, dict):
-                    logger.warning(f"⚠️ {symbol_dash} entry_data KHÔNG phải dict: {entry_data}")
-                    continue
+    def close(self):
+        self._stop.set()
 
-                entry_price = entry_data.get("price")
-                if not isinstance(entry_price, (int, float)):
-                    logger.warning(f"⚠️ {symbol_dash} entry_price KHÔNG phải số: {entry_price}")
-                    continue
 
-                stop_in = entry_data.get("stop")
-                tp_in = entry_data.get("tp")
-
-                if isinstance(tp_in, (int, float)) and current_price >= tp_in:
-                    logger.info(f"🎯 TP hit {symbol_dash}: entry={entry_price} tp={tp_in} last={current_price}")
-                    try:
-                        exchange.create_market_sell_order(symbol_slash, balance)
-                        logger.info(f"✅ Đã bán TP {symbol_dash} số lượng {balance}")
-                        updated_prices.pop(symbol_dash, None)
-                        # xoá khỏi sheet
-                        try:
-                            records = storage_sheet.get_all_records()
-                            for i, row in enumerate(records):
-                                if row.get("Symbol") == symbol_dash:
-                                    storage_sheet.delete_rows(i + 2)
-                                    break
-                        except Exception as e:
-                            logger.warning(f"⚠️ Không thể xoá {symbol_dash} khỏi sheet: {e}")
-                        was_updated = True
-                    except Exception as e:
-                        logger.error(f"❌ Lỗi bán TP {symbol_dash}: {e}")
-                    if was_updated:
-                        spot_entry_prices = updated_prices.copy()
-                        save_entry_prices(spot_entry_prices)
-                    continue
+class ReplayFeed(PriceFeed):
+    """Phát lại giá từ file JSONL ({"symbol": "BTC/USDT", "last": 1.0}) hoặc list tuple."""
 
-                if isinstance(stop_in, (int, float)) and current_price <= stop_in:
-                    logger.info(f"🛑 SL hit {symbol_dash}: entry={entry_price} sl={stop_in} last={current_price}")
-                    try:
-                        exchange.create_market_sell_order(symbol_slash, balance)
-                        logger.info(f"✅ Đã bán SL {symbol_dash} số lượng {balance}")
-                        updated_prices.pop(symbol_dash, None)
-                        # xoá khỏi sheet
-                        try:
-                            records = storage_sheet.get_all_records()
-                            for i, row in enumerate(records):
-                                if row.get("Symbol") == symbol_dash:
-                                    storage_sheet.delete_rows(i + 2)
-                                    break
-                        except Exception as e:
-                            logger.warning(f"⚠️ Không thể xoá {symbol_dash} khỏi sheet: {e}")
-                        was_updated = True
-                    except Exception as e:
-                        logger.error(f"❌ Lỗi bán SL {symbol_dash}: {e}")
-                    if was_updated:
-                        spot_entry_prices = updated_prices.copy()
-                        save_entry_prices(spot_entry_prices)
-                    continue
+    def __init__(self, source):
+        self._source = source
+        self._symbols = set()
 
-                percent_gain = ((current_price - entry_price) / entry_price) * 100
-                if percent_gain >= 30:
-                    logger.info(f"✅ CHỐT LỜI: {symbol_dash} tăng {percent_gain:.2f}% từ {entry_price} => {current_price}")
-                    try:
-                        exchange.create_market_sell_order(symbol_slash, balance)
-                        logger.info(f"💰 Đã bán {symbol_dash} số lượng {balance} để chốt lời")
-                        updated_prices.pop(symbol_dash, None)
-                        # xoá khỏi sheet
-                        try:
-                            records = storage_sheet.get_all_records()
-                            for i, row in enumerate(records):
-                                if row.get("Symbol") == symbol_dash:
-                                    storage_sheet.delete_rows(i + 2)
-                                    break
-                        except Exception as e:
-                            logger.warning(f"⚠️ Không thể xoá {symbol_dash} khỏi sheet: {e}")
-                        was_updated = True
-                    except Exception as e:
-                        logger.error(f"❌ Lỗi khi bán {symbol_dash}: {e}")
-
-                if was_updated:
-                    spot_entry_prices = updated_prices.copy()
-                    save_entry_prices(spot_entry_prices)
-            except Exception as e:
-                logger.error(f"❌ Lỗi khi xử lý coin {coin}: {e}")
-                continue
-    except Exception as e:
-        logger.error(f"❌ Lỗi chính trong auto_sell_once(): {e}")
+    def subscribe(self, symbols):
+        self._symbols = set(symbols)
+
+    def ticks(self, idle_timeout=1.0):
+        if isinstance(self._source, (str, Path)):
+            with open(self._source, encoding="utf-8") as f:
+                items = [json.loads(line) for line in f if line.strip()]
+            items = [(item["symbol"], float(item["last"])) for item in items]
+        else:
+            items = list(self._source)
+        for symbol, last in items:
+            if symbol in self._symbols:
+                yield symbol, last
 
 
-def fetch_sheet():
+def _held_positions(entries):
+    """{symbol_slash: (symbol_dash, balance, entry_data)} cho các coin đang giữ, có entry và chưa có OCO."""
+    snapshot = PositionSnapshot.build(market_cache.fetch_balance(), _shard_entries(entries), skip_armed=True)
+    return {p.symbol_slash: (p.symbol_dash, p.balance, p.entry) for p in snapshot}
+
+
+def watch_and_sell(feed, max_runtime=None):
+    logger.info("🟢 [WATCHER] Bắt đầu theo dõi giá realtime")
+    started = time.time()
+    held = _held_positions(load_entry_prices())
+    refreshed = time.time()
+    feed.subscribe(list(held))
+    logger.info("👀 [WATCHER] Theo dõi %s vị thế: %s", len(held), list(held), extra={"stage": "sell"})
+    failures = {}  # symbol_slash -> (số lần bán lỗi liên tiếp, thời điểm được thử lại)
+
+    try:
+        for tick in feed.ticks():
+            now = time.time()
+            if max_runtime is not None and now - started >= max_runtime:
+                break
+            if now - refreshed >= WATCH_REFRESH_SECONDS:
+                market_cache.invalidate_balance()
+                held = _held_positions(load_entry_prices())
+                refreshed = now
+                feed.subscribe(list(held))
+            if tick is None:
+                continue
+
+            symbol_slash, current_price = tick
+            position = held.get(symbol_slash)
+            if position is None:
+                continue
+            symbol_dash, balance, entry_data = position
+            reason = _exit_reason(entry_data, current_price)
+            if not reason:
+                continue
+            failed, retry_at = failures.get(symbol_slash, (0, 0.0))
+            if now < retry_at:
+                continue
+            if _sell_position(symbol_dash, symbol_slash, balance, reason, entry_data, current_price):
+                failures.pop(symbol_slash, None)
+                held.pop(symbol_slash, None)
+                feed.subscribe(list(held))
+            else:
+                delay = min(WATCH_SELL_RETRY_SECONDS * 2 ** failed, WATCH_SELL_RETRY_MAX)
+                failures[symbol_slash] = (failed + 1, now + delay)
+                logger.warning(
+                    "⚠️ [WATCHER] Bán %s lỗi, thử lại sau %.0fs", symbol_slash, delay,
+                    extra={"stage": "sell", "reason": reason},
+                )
+    finally:
+        feed.close()
+    logger.info("🔴 [WATCHER] Dừng theo dõi giá")
+
+
+# ===================== SIGNAL INGESTION =====================
+# Sheet tín hiệu được tải có điều kiện (ETag / If-Modified-Since) và đọc dạng
+# stream; mỗi dòng được băm và lưu cục bộ nên dòng đã loại (ĐÃ MUA, sai tín
+# hiệu, thiếu giá, quá hạn) không bị parse/quét lại ở các lần chạy sau.
+SIGNAL_DB_PATH = os.getenv("SIGNAL_DB_PATH", "signals.db")
+
+
+def _iter_lines(chunks):
+    # Tách theo "\n" và giữ ký tự xuống dòng để csv.reader ghép được ô nhiều dòng.
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    tail = ""
+    for chunk in chunks:
+        parts = (tail + decoder.decode(chunk)).split("\n")
+        tail = parts.pop()
+        for part in parts:
+            yield part + "\n"
+    tail += decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def _stream_csv_rows(res):
+    try:
+        yield from csv.reader(_iter_lines(res.iter_content(chunk_size=64 * 1024)))
+    finally:
+        res.close()
+
+
+def fetch_sheet(validators=None):
+    """Tải CSV tín hiệu dạng stream.
+
+    Trả về (rows, validators); rows là iterator các dòng CSV, hoặc None nếu
+    sheet không đổi so với `validators` (HTTP 304).
+    """
+    validators = validators or {}
+    headers = {}
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+    csv_url = SPREADSHEET_URL.replace("/edit#gid=", "/export?format=csv&gid=")
+    with instrumentation.timer("sheet.fetch_csv"):
+        res = requests.get(csv_url, headers=headers, timeout=20, stream=True)
+    if res.status_code == 304:
+        res.close()
+        return None, validators
     try:
-        csv_url = SPREADSHEET_URL.replace("/edit#gid=", "/export?format=csv&gid=")
-        res = requests.get(csv_url, timeout=20)
         res.raise_for_status()
-        return list(csv.reader(res.content.decode("utf-8").splitlines()))
-    except Exception as e:
-        logger.error(f"❌ Không thể tải Google Sheet: {e}")
-        return []
+    except Exception:
+        res.close()
+        raise
+    fresh = {"etag": res.headers.get("ETag"), "last_modified": res.headers.get("Last-Modified")}
+    return _stream_csv_rows(res), fresh
+
+
+def _row_digest(row):
+    return hashlib.sha1("\x1f".join(row).encode("utf-8")).hexdigest()
+
+
+class SignalIngestor:
+    """Đọc Sheet tín hiệu theo kiểu tăng dần, trạng thái lưu trong SQLite.
+
+    Dòng mới/đổi (digest chưa thấy) được parse một lần: nếu hợp lệ thì lưu là
+    actionable kèm hạn (expires_at), ngược lại lưu là đã loại. Dòng đã thấy
+    chỉ cần tra digest; dòng actionable hết hạn được chuyển sang đã loại.
+    Dòng biến mất khỏi Sheet bị xoá khỏi kho.
+    """
+
+    def __init__(self, path, source=None):
+        self.path = str(path)
+        # Mặc định tra fetch_sheet lúc gọi để bench/simulator thay được nguồn.
+        self._source = source or (lambda validators: fetch_sheet(validators))
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS signals ("
+            "digest TEXT PRIMARY KEY, idx INTEGER NOT NULL, symbol TEXT, row TEXT, "
+            "actionable INTEGER NOT NULL, expires_at REAL)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def _validators(self):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'validators'").fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def pending(self):
+        """Các dòng cần quét: list (i, row, symbol) theo thứ tự trên Sheet."""
+        with self._lock:
+            try:
+                rows, validators = self._source(self._validators())
+                if rows is None:
+                    logger.info("📄 Sheet tín hiệu không đổi, dùng lại trạng thái cục bộ")
+                    return self._stored_pending()
+                return self._ingest(rows, validators)
+            except Exception as e:
+                logger.error("❌ Không thể tải Google Sheet: %s", e, extra={"stage": "signal"})
+                return []
+
+    def _expire(self, now):
+        expired = self._conn.execute(
+            "SELECT idx, symbol FROM signals WHERE actionable = 1 AND expires_at IS NOT NULL AND expires_at < ?", (now,)
+        ).fetchall()
+        for i, symbol in expired:
+            logger.info("⏱ Bỏ qua %s (dòng %s) vì đã quá hạn", symbol, i, extra={"stage": "signal", "reason": "expired"})
+        if expired:
+            self._conn.execute(
+                "UPDATE signals SET actionable = 0 WHERE actionable = 1 AND expires_at IS NOT NULL AND expires_at < ?", (now,)
+            )
+
+    def _stored_pending(self):
+        self._expire(time.time())
+        return [
+            (i, json.loads(row), symbol)
+            for i, row, symbol in self._conn.execute(
+                "SELECT idx, row, symbol FROM signals WHERE actionable = 1 ORDER BY idx"
+            )
+        ]
+
+    def _ingest(self, rows, validators):
+        known = {digest: idx for digest, idx in self._conn.execute("SELECT digest, idx FROM signals")}
+        seen = set()
+        added, moved = [], []
+        for i, row in enumerate(rows):
+            if i == 0:
+                continue
+            digest = _row_digest(row)
+            if digest in seen:
+                continue
+            seen.add(digest)
+            if digest in known:
+                if known[digest] != i:
+                    moved.append((i, digest))
+                continue
+            symbol, expires_at = None, None
+            try:
+                symbol = _parse_signal_row(i, row)
+            except Exception as e:
+                logger.error("❌ Lỗi khi xử lý dòng %s - %s: %s", i, row, e, extra={"stage": "signal"})
+            if symbol:
+                try:
+                    expires_at = _signal_expiry(row)
+                except Exception:
+                    pass  # _parse_signal_row đã cảnh báo; giữ như cũ: không có hạn.
+            added.append((
+                digest, i, symbol, json.dumps(row, ensure_ascii=False) if symbol else None,
+                1 if symbol else 0, expires_at,
+            ))
+
+        gone = [(digest,) for digest in known.keys() - seen]
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.executemany("DELETE FROM signals WHERE digest = ?", gone)
+            self._conn.executemany("UPDATE signals SET idx = ? WHERE digest = ?", moved)
+            self._conn.executemany("INSERT INTO signals VALUES (?, ?, ?, ?, ?, ?)", added)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('validators', ?)", (json.dumps(validators),)
+            )
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        pending = self._stored_pending()
+        logger.info(
+            "📄 Sheet tín hiệu: %s dòng, %s mới/đổi, %s bị xoá, %s cần xét", len(seen), len(added), len(gone), len(pending),
+            extra={"stage": "signal"},
+        )
+        return pending
 
 
-def compute_rsi(closes, period=14):
-    deltas = [closes[i] - closes[i - 1] for i in range(1, len(closes))]
-    gains = [delta if delta > 0 else 0 for delta in deltas]
-    losses = [-delta if delta < 0 else 0 for delta in deltas]
+def get_signal_ingestor():
+    return _lazy_client("signal_ingestor", lambda: SignalIngestor(SIGNAL_DB_PATH))
 
-    avg_gain = sum(gains[:period]) / period
-    avg_loss = sum(losses[:period]) / period
-    if avg_loss == 0:
-        return 100
 
-    rs = avg_gain / avg_loss
-    rsi = 100 - (100 / (1 + rs))
-    return rsi
+def set_signal_ingestor(ingestor):
+    _clients["signal_ingestor"] = ingestor
 
 
-def get_short_term_trend(symbol):
-    score = 0
-    timeframes = ["1h", "4h", "1d"]
+def compute_rsi(closes, period=14):
+    return float(indicators.rsi_first_window(closes, period))
 
-    for tf in timeframes:
-        try:
-            ohlcv = exchange.fetch_ohlcv(symbol.replace("-", "/"), timeframe=tf, limit=50)
-            closes = [c[4] for c in ohlcv]
-            if len(closes) < 50:
-                continue
 
-            ema20 = sum(closes[-20:]) / 20
-            ema50 = sum(closes[-50:]) / 50
-            rsi = compute_rsi(closes, period=14)
+@instrumentation.timed("indicators.trend_score")
+def _trend_score(ohlcv):
+    closes = [c[4] for c in ohlcv]
+    if len(closes) < 50:
+        return 0
 
-            if rsi > 60 and ema20 > ema50:
-                score += 2
-            elif rsi > 50 and ema20 > ema50:
-                score += 1
-        except Exception as e:
-            logger.warning(f"⚠️ Không thể fetch nến {tf} cho {symbol}: {e}")
-            continue
+    ema20 = sum(closes[-20:]) / 20
+    ema50 = sum(closes[-50:]) / 50
+    rsi = compute_rsi(closes, period=14)
 
+    if rsi > 60 and ema20 > ema50:
+        return 2
+    elif rsi > 50 and ema20 > ema50:
+        return 1
+    return 0
+
+
+def _trend_label(score):
     if score >= 3:
         return "TĂNG"
     elif score <= 1:
@@ -520,142 +2242,649 @@ def get_short_term_trend(symbol):
     return "KHÔNG RÕ"
 
 
-def _process_buy(symbol, trend_label, usdt_amount=20):
-    global spot_entry_prices
-    price = float(exchange.fetch_ticker(symbol.replace("-", "/"))["last"])
+TREND_TIMEFRAMES = ["1h", "4h", "1d"]
+# Memo mặc định TẮT: điểm trend tính lại mỗi lần trên cả nến đang chạy như cũ.
+# Đặt TREND_MEMO_PATH (vd. trend_memo.db) để bật; khi đó điểm từng khung chỉ
+# tính trên nến đã đóng nên chỉ đổi khi khung đó có nến mới đóng và được nhớ
+# qua các lần chạy. Đây là thay đổi tín hiệu có chủ ý: nhãn TĂNG/GIẢM không
+# còn phản ứng với nến 1h/4h/1d đang chạy.
+TREND_MEMO_PATH = os.getenv("TREND_MEMO_PATH", "")
+TREND_MEMO_MAX_SYMBOLS = int(os.getenv("TREND_MEMO_MAX_SYMBOLS", 2000))
+
+
+class TrendMemo:
+    """Điểm _trend_score theo (symbol, timeframe), kèm open-time nến đã đóng gần nhất.
+
+    get() chỉ trúng khi open-time khớp, nên điểm tự hết hạn khi khung đó có
+    nến mới đóng; các khung chưa sang nến vẫn dùng lại. Giữ tối đa
+    `max_symbols` symbol, bỏ symbol lâu không dùng nhất (LRU). Bảng SQLite là
+    bản ghi xuyên suốt giữa các lần chạy; tra cứu dùng bản trong bộ nhớ, thời
+    điểm dùng được ghi xuống đĩa cùng put() hoặc khi gọi flush() cuối lần chạy.
+    """
+
+    def __init__(self, path, max_symbols=TREND_MEMO_MAX_SYMBOLS):
+        self.path = str(path)
+        self.max_symbols = max_symbols
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS trend_memo ("
+            "symbol TEXT NOT NULL, timeframe TEXT NOT NULL, closed_ts INTEGER NOT NULL, "
+            "score INTEGER NOT NULL, used_at REAL NOT NULL, PRIMARY KEY (symbol, timeframe)) WITHOUT ROWID"
+        )
+        self._symbols = OrderedDict()
+        self._touched = {}
+        for symbol, tf, closed_ts, score in self._conn.execute(
+            "SELECT symbol, timeframe, closed_ts, score FROM trend_memo ORDER BY used_at"
+        ):
+            self._symbols.setdefault(symbol, {})[tf] = (closed_ts, score)
+            self._symbols.move_to_end(symbol)
+
+    def get(self, symbol, timeframe, closed_ts):
+        with self._lock:
+            entry = self._symbols.get(symbol, {}).get(timeframe)
+            if entry is None or entry[0] != closed_ts:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._symbols.move_to_end(symbol)
+            self._touched[symbol] = time.time()
+            return entry[1]
+
+    def _write_touched(self):
+        touched, self._touched = self._touched, {}
+        self._conn.executemany(
+            "UPDATE trend_memo SET used_at = ? WHERE symbol = ?", [(at, symbol) for symbol, at in touched.items()]
+        )
+
+    def flush(self):
+        with self._lock:
+            if not self._touched:
+                return
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._write_touched()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def put(self, symbol, timeframe, closed_ts, score):
+        with self._lock:
+            self._symbols.setdefault(symbol, {})[timeframe] = (closed_ts, score)
+            self._symbols.move_to_end(symbol)
+            evicted = []
+            while len(self._symbols) > self.max_symbols:
+                evicted.append((self._symbols.popitem(last=False)[0],))
+                self._touched.pop(evicted[-1][0], None)
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._write_touched()
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO trend_memo (symbol, timeframe, closed_ts, score, used_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (symbol, timeframe, closed_ts, score, time.time()),
+                )
+                self._conn.executemany("DELETE FROM trend_memo WHERE symbol = ?", evicted)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def stats(self):
+        with self._lock:
+            return {"symbols": len(self._symbols), "hits": self.hits, "misses": self.misses}
+
+
+def get_short_term_trend(symbol):
+    return _trend_label(_trend_total(symbol))
+
+
+@instrumentation.timed("screen.trend", symbol_arg=True)
+def _trend_total(symbol):
+    score = 0
+    memo = get_trend_memo()
+
+    for tf in TREND_TIMEFRAMES:
+        try:
+            closed = _last_closed_open(tf)
+            cached = memo.get(symbol, tf, closed) if memo is not None else None
+            if cached is not None:
+                score += cached
+                continue
+            if memo is None:
+                score += _trend_score(market_cache.fetch_ohlcv(symbol.replace("-", "/"), timeframe=tf, limit=50))
+                continue
+            # Điểm được nhớ đến hết nến nên chỉ tính trên nến đã đóng (bỏ nến
+            # đang chạy); nến đóng cuối chưa có trên sàn thì tính nhưng không nhớ.
+            ohlcv = market_cache.fetch_ohlcv(symbol.replace("-", "/"), timeframe=tf, limit=51)
+            bars = [c for c in ohlcv if c[0] <= closed][-50:]
+            tf_score = _trend_score(bars)
+            if bars and bars[-1][0] == closed:
+                memo.put(symbol, tf, closed, tf_score)
+            score += tf_score
+        except Exception as e:
+            logger.warning("⚠️ Không thể fetch nến %s cho %s: %s", tf, symbol, e, extra={"stage": "trend"})
+            continue
+
+    return score
+
+
+@instrumentation.timed("indicators.one_hour_filter")
+def _one_hour_filter(trend, ohlcv):
+    """Lọc FOMO (và nén với SIDEWAY) trên nến 1h.
+
+    Trả về (reason, (rsi, vol, vol_sma20, price_change)); reason None nghĩa là đạt.
+    """
+    closes = [c[4] for c in ohlcv]
+    volumes = [c[5] for c in ohlcv]
+    rsi = compute_rsi(closes, period=14)
+    vol = volumes[-1]
+    vol_sma20 = sum(volumes[-20:]) / 20
+    price_now = closes[-1]
+    price_3bars_ago = closes[-4]
+    price_change = (price_now - price_3bars_ago) / price_3bars_ago * 100
+    metrics = (rsi, vol, vol_sma20, price_change)
+
+    if rsi > 70 or vol > vol_sma20 * 2 or price_change > 10:
+        return "fomo", metrics
+    if trend == "SIDEWAY":
+        if len(closes) < 20:
+            return "no_data", metrics
+        if rsi >= 55 or vol >= vol_sma20:
+            return "not_compressed", metrics
+    return None, metrics
+
+
+@instrumentation.timed("run.process_buy", symbol_arg=True)
+@exchange_scheduler.priority(PRIORITY_ENTRY)
+def _process_buy(symbol, trend_label, usdt_amount=20, screen=None, budget=None):
+    price = float(market_cache.fetch_ticker(symbol.replace("-", "/"))["last"])
     amount = round(usdt_amount / price, 6)
-    logger.info(f"💰 [{trend_label}] Mua {amount} {symbol} với {usdt_amount} USDT (giá {price})")
+    logger.info("💰 [%s] Mua %s %s với %s USDT (giá %s)", trend_label, amount, symbol, usdt_amount, price, extra={"stage": "buy"})
 
     sym_slash = symbol.replace("-", "/")
-    passed, amt2, entry2, stop2, tp2, reason = pre_buy_screen_and_sizing(symbol, usdt_amount)
+    if screen is None:
+        screen = pre_buy_screen(symbol)
+    passed, entry2, stop2, tp2, reason = screen
     if not passed:
-        logger.info(f"⛔ Bỏ {sym_slash} lý do: {reason}")
+        logger.info("⛔ Bỏ %s lý do: %s", sym_slash, reason, extra={"stage": "buy", "reason": reason})
         return False
 
-    amount = amt2
-    order = exchange.create_market_buy_order(sym_slash, amount)
-    logger.info(f"✅ BUY {sym_slash}: amount={amount} ~ {amount * entry2:.2f} USDT @~{entry2}")
+    amount = size_position(entry2, stop2, usdt_amount)
+    if budget is not None:
+        amount = budget.cap(amount, entry2)
+        if amount * entry2 < MIN_ORDER_USDT:
+            logger.info("⛔ Bỏ %s lý do: hết vốn cho lần chạy này", sym_slash, extra={"stage": "buy", "reason": "budget"})
+            return False
+    started = time.perf_counter()
+    order = get_exchange().create_market_buy_order(sym_slash, amount)
+    market_cache.invalidate_balance()
+    if budget is not None:
+        budget.spend(amount * entry2)
+    logger.info(
+        "✅ BUY %s: amount=%s ~ %.2f USDT @~%s", sym_slash, amount, amount * entry2, entry2,
+        extra={"stage": "buy", "latency_ms": round((time.perf_counter() - started) * 1000, 1)},
+    )
 
     try:
         key, saved_data = _save_bought_coin(symbol, entry2, stop2 if UPGRADE["use_stop_for_spot"] else None, tp2)
-        logger.info(f"✅ Đã mua {symbol} theo {trend_label}: {order}")
-        logger.info(f"💾 Đã lưu JSON cho {key}: {saved_data}")
+        if EXCHANGE_EXITS and saved_data:
+            saved_data["algo_id"] = _arm_exchange_exit(key, saved_data["stop"], saved_data["tp"])
+        logger.info("✅ Đã mua %s theo %s: %s", symbol, trend_label, order, extra={"stage": "buy"})
+        logger.info("💾 Đã lưu JSON cho %s: %s", key, saved_data, extra={"stage": "buy"})
 
         content = json.dumps({key: saved_data}, indent=2, ensure_ascii=False)
         send_to_telegram(f"✅ Đã mua {key} và cập nhật JSON:\n```\n{content}\n```")
     except Exception as e:
-        logger.warning(f"⚠️ Không thể gửi Telegram hoặc lưu JSON cho {symbol}: {e}")
+        logger.warning("⚠️ Không thể gửi Telegram hoặc lưu JSON cho %s: %s", symbol, e, extra={"stage": "buy"})
 
-    time.sleep(1)
     return True
 
 
-def run_bot():
-    rows = fetch_sheet()
+def _parse_signal_row(i, row):
+    if not row or len(row) < 2:
+        logger.warning("⚠️ Dòng %s không hợp lệ: %s", i, row, extra={"stage": "signal", "reason": "invalid"})
+        return None
+
+    symbol = row[0].strip().upper()
+    signal = row[1].strip().upper()
+    gia_mua = float(row[2]) if len(row) > 2 and row[2] and row[2] != "Giá" else None
+    da_mua = row[5].strip().upper() if len(row) > 5 else ""
+
+    logger.info("🛒 Đang xét mua %s...", symbol, extra={"stage": "signal"})
+
+    if not gia_mua or da_mua == "ĐÃ MUA":
+        bought = da_mua == "ĐÃ MUA"
+        logger.info(
+            "⏩ Bỏ qua %s do %s", symbol, "đã mua" if bought else "thiếu giá",
+            extra={"stage": "signal", "reason": "bought" if bought else "no_price"},
+        )
+        return None
+
+    if signal != "MUA MẠNH":
+        logger.info("❌ %s bị loại do tín hiệu Sheet = %s", symbol, signal, extra={"stage": "signal", "reason": "signal"})
+        return None
+
+    try:
+        expires_at = _signal_expiry(row)
+        if expires_at is not None and time.time() > expires_at:
+            freq_minutes = int(row[4].strip())
+            elapsed = (time.time() - expires_at) / 60 + freq_minutes
+            logger.info(
+                "⏱ Bỏ qua %s vì đã quá hạn %s phút (đã qua %d phút)", symbol, freq_minutes, elapsed,
+                extra={"stage": "signal", "reason": "expired"},
+            )
+            return None
+    except Exception as e:
+        logger.warning("⚠️ Không thể kiểm tra tần suất cho %s: %s", symbol, e, extra={"stage": "signal"})
+
+    return symbol
+
+
+def _signal_expiry(row):
+    """Epoch hết hạn của dòng tín hiệu (Ngày GMT+7 + Tần suất phút); None nếu không có tần suất."""
+    if len(row) > 4 and row[4].strip():
+        freq_minutes = int(row[4].strip())
+        signal_time = datetime.strptime(row[3].strip(), "%Y-%m-%d %H:%M:%S").replace(
+            tzinfo=timezone(timedelta(hours=7))
+        )
+        return signal_time.timestamp() + freq_minutes * 60
+    return None
+
+
+def _held_amount(symbol):
+    coin_name = symbol.split("-")[0]
+    balances = market_cache.fetch_balance()
+    return balances.get(coin_name, {}).get("total", 0)
+
+
+# Ngân sách mỗi lần run_bot (0 = không giới hạn; MAX_ORDERS_PER_RUN âm = không
+# mở lệnh mới, shard.py dùng khi tài khoản có ít lệnh hơn số shard).
+# RANK_CANDIDATES=true: quét và chấm điểm mọi dòng trước, rồi mua theo điểm
+# cao nhất thay vì thứ tự Sheet.
+RANK_CANDIDATES = os.getenv("RANK_CANDIDATES", "false").lower() == "true"
+MAX_ORDERS_PER_RUN = int(os.getenv("MAX_ORDERS_PER_RUN", 0))
+RUN_CAPITAL_USDT = float(os.getenv("RUN_CAPITAL_USDT", 0))
+
+
+class RunBudget:
+    """Giới hạn số lệnh và tổng USDT được mua trong một lần run_bot."""
+
+    def __init__(self, max_orders=MAX_ORDERS_PER_RUN, capital=RUN_CAPITAL_USDT):
+        self.max_orders = max_orders
+        self.capital = capital
+        self.orders = 0
+        self.spent = 0.0
+
+    def exhausted(self):
+        if self.max_orders < 0 or (self.max_orders and self.orders >= self.max_orders):
+            return True
+        return bool(self.capital) and self.capital - self.spent < MIN_ORDER_USDT
+
+    def cap(self, amount, price):
+        if not self.capital:
+            return amount
+        return min(amount, (self.capital - self.spent) / price)
+
+    def spend(self, notional):
+        self.orders += 1
+        self.spent += notional
+
+
+def _scored_candidate(symbol, trend_label, screen, trend_score):
+    score = None
+    if screen[0]:
+        o15 = market_cache.fetch_ohlcv(symbol.replace("-", "/"), timeframe="15m", limit=SCREEN_15M_LIMIT)
+        score = score_setup(o15, screen[1], screen[2], trend_score)
+    return symbol, trend_label, screen, score
+
+
+def _ranked(candidates):
+    """Lấy dần candidate theo điểm giảm dần bằng heap (đủ lệnh/vốn thì dừng sớm)."""
+    heap = []
+    for seq, candidate in enumerate(candidates):
+        symbol, _, screen, score = candidate
+        if score is None:
+            logger.info("⛔ Bỏ %s lý do: %s", symbol.replace("-", "/"), screen[4], extra={"stage": "rank", "reason": screen[4]})
+            continue
+        heap.append((-score, seq, candidate))
+    heapq.heapify(heap)
+    if logger.isEnabledFor(logging.INFO):
+        top = ", ".join(f"{c[0]}={-s:.3f}" for s, _, c in heapq.nsmallest(10, heap))
+        logger.info("🏆 Xếp hạng %s coin đạt lọc: %s", len(heap), top, extra={"stage": "rank"})
+    while heap:
+        yield heapq.heappop(heap)[2]
+
+
+@instrumentation.timed("screen.candidate", symbol_arg=True)
+def _screen_candidate(symbol):
+    """Phần network-bound của một dòng tín hiệu (không đặt lệnh).
+
+    Trả về (symbol, trend_label, screen, score) nếu coin qua bộ lọc trend/1h,
+    ngược lại None; score là None khi pre_buy_screen không đạt.
+    """
+    asset_balance = _held_amount(symbol)
+    if asset_balance and asset_balance > 1:
+        logger.info(
+            "❌ Bỏ qua %s vì đã có %s %s trong ví", symbol, asset_balance, symbol.split("-")[0],
+            extra={"stage": "screen", "reason": "held"},
+        )
+        return None
+
+    trend_score = _trend_total(symbol)
+    trend = _trend_label(trend_score)
+    logger.info("📉 Xu hướng ngắn hạn của %s = %s", symbol, trend, extra={"stage": "screen"})
 
-    for i, row in enumerate(rows):
+    if trend == "TĂNG":
         try:
-            if i == 0:
-                continue
-            if not row or len(row) < 2:
-                logger.warning(f"⚠️ Dòng {i} không hợp lệ: {row}")
-                continue
+            ohlcv = market_cache.fetch_ohlcv(symbol.replace("-", "/"), timeframe="1h", limit=30)
+            reason, (rsi, vol, vol_sma20, price_change) = _one_hour_filter(trend, ohlcv)
+            if reason == "fomo":
+                logger.info(
+                    "⛔ %s bị loại do FOMO trong trend TĂNG (RSI=%.1f, Δgiá 3h=%.1f%%)", symbol, rsi, price_change,
+                    extra={"stage": "screen", "reason": reason},
+                )
+                return None
+
+            return _scored_candidate(symbol, "TĂNG", pre_buy_screen(symbol), trend_score)
+        except Exception as e:
+            logger.error("❌ Lỗi khi mua %s theo trend TĂNG: %s", symbol, e, extra={"stage": "screen"})
+            return None
 
-            symbol = row[0].strip().upper()
-            signal = row[1].strip().upper()
-            gia_mua = float(row[2]) if len(row) > 2 and row[2] and row[2] != "Giá" else None
-            ngay = row[3].strip() if len(row) > 3 else ""
-            da_mua = row[5].strip().upper() if len(row) > 5 else ""
+    if trend == "SIDEWAY":
+        try:
+            ohlcv = market_cache.fetch_ohlcv(symbol.replace("-", "/"), timeframe="1h", limit=30)
+            reason, (rsi, vol, vol_sma20, price_change) = _one_hour_filter(trend, ohlcv)
+            if reason == "fomo":
+                logger.info(
+                    "⛔ %s bị loại do dấu hiệu FOMO (RSI=%.2f, Δgiá 3h=%.1f%%, vol=%.0f)", symbol, rsi, price_change, vol,
+                    extra={"stage": "screen", "reason": reason},
+                )
+                return None
+            if reason == "no_data":
+                logger.warning("⚠️ Không đủ dữ liệu nến cho %s", symbol, extra={"stage": "screen", "reason": reason})
+                return None
+            if reason == "not_compressed":
+                logger.info("⛔ %s bị loại (SIDEWAY nhưng không nén đủ mạnh)", symbol, extra={"stage": "screen", "reason": reason})
+                return None
+
+            return _scored_candidate(symbol, "SIDEWAY", pre_buy_screen(symbol), trend_score)
+        except Exception as e:
+            logger.error("❌ Lỗi khi mua %s theo SIDEWAY: %s", symbol, e, extra={"stage": "screen"})
+            return None
 
-            logger.info(f"🛒 Đang xét mua {symbol}...")
+    return None
 
-            if not gia_mua or da_mua == "ĐÃ MUA":
-                logger.info(f"⏩ Bỏ qua {symbol} do {'đã mua' if da_mua == 'ĐÃ MUA' else 'thiếu giá'}")
-                continue
 
-            if signal != "MUA MẠNH":
-                logger.info(f"❌ {symbol} bị loại do tín hiệu Sheet = {signal}")
-                continue
+def _screened(futures):
+    for i, row, future in futures:
+        try:
+            candidate = future.result()
+        except Exception as e:
+            logger.error("❌ Lỗi khi xử lý dòng %s - %s: %s", i, row, e, extra={"stage": "screen"})
+            continue
+        if candidate:
+            yield candidate
 
-            if len(row) > 4 and row[4].strip():
-                try:
-                    freq_minutes = int(row[4].strip())
-                    signal_time = datetime.strptime(ngay, "%Y-%m-%d %H:%M:%S").replace(
-                        tzinfo=timezone(timedelta(hours=7))
-                    )
-                    now_vn = datetime.now(timezone(timedelta(hours=7)))
-                    elapsed = (now_vn - signal_time).total_seconds() / 60
-                    if elapsed > freq_minutes:
-                        logger.info(f"⏱ Bỏ qua {symbol} vì đã quá hạn {freq_minutes} phút (đã qua {int(elapsed)} phút)")
-                        continue
-                except Exception as e:
-                    logger.warning(f"⚠️ Không thể kiểm tra tần suất cho {symbol}: {e}")
 
-            coin_name = symbol.split("-")[0]
-            balances = exchange.fetch_balance()
-            asset_balance = balances.get(coin_name, {}).get("total", 0)
+@instrumentation.timed("run.run_bot")
+def run_bot():
+    pending = [p for p in get_signal_ingestor().pending() if _in_shard(p[2])]
+
+    if pending:
+        try:
+            liquid = set(bulk_prescreen([symbol for _, _, symbol in pending]))
+            pending = [p for p in pending if p[2] in liquid]
+        except Exception as e:
+            logger.warning("⚠️ Không thể pre-screen bằng fetch_tickers, lọc từng symbol: %s", e, extra={"stage": "prescreen"})
+
+    # Pha 1: screening + chấm điểm chạy song song. Pha 2: đặt lệnh tuần tự
+    # (theo thứ tự Sheet, hoặc theo điểm nếu RANK_CANDIDATES) để sizing luôn
+    # thấy số dư USDT nhất quán, dừng khi hết ngân sách lệnh/vốn.
+    budget = RunBudget()
+    with ThreadPoolExecutor(max_workers=max(1, SCAN_WORKERS)) as pool:
+        futures = [(i, row, pool.submit(_screen_candidate, symbol)) for i, row, symbol in pending]
+        candidates = _screened(futures)
+        if RANK_CANDIDATES:
+            candidates = _ranked(list(candidates))
+        for candidate in candidates:
+            if budget.exhausted():
+                logger.info(
+                    "🧾 Hết ngân sách lần chạy: %s lệnh, %.2f USDT", budget.orders, budget.spent,
+                    extra={"stage": "buy", "reason": "budget"},
+                )
+                break
+            symbol, trend_label, screen, _ = candidate
+            asset_balance = _held_amount(symbol)
             if asset_balance and asset_balance > 1:
-                logger.info(f"❌ Bỏ qua {symbol} vì đã có {asset_balance} {coin_name} trong ví")
+                logger.info(
+                    "❌ Bỏ qua %s vì đã có %s %s trong ví", symbol, asset_balance, symbol.split("-")[0],
+                    extra={"stage": "buy", "reason": "held"},
+                )
                 continue
+            try:
+                _process_buy(symbol, trend_label, screen=screen, budget=budget)
+            except Exception as e:
+                logger.error("❌ Lỗi khi mua %s theo trend %s: %s", symbol, trend_label, e, extra={"stage": "buy"})
+        for _, _, future in futures:
+            future.cancel()
 
-            trend = get_short_term_trend(symbol)
-            logger.info(f"📉 Xu hướng ngắn hạn của {symbol} = {trend}")
 
-            if trend == "TĂNG":
-                try:
-                    ohlcv = exchange.fetch_ohlcv(symbol.replace("-", "/"), timeframe="1h", limit=30)
-                    closes = [c[4] for c in ohlcv]
-                    volumes = [c[5] for c in ohlcv]
-                    rsi = compute_rsi(closes, period=14)
-                    vol = volumes[-1]
-                    vol_sma20 = sum(volumes[-20:]) / 20
-                    price_now = closes[-1]
-                    price_3bars_ago = closes[-4]
-                    price_change = (price_now - price_3bars_ago) / price_3bars_ago * 100
-
-                    if rsi > 70 or vol > vol_sma20 * 2 or price_change > 10:
-                        logger.info(f"⛔ {symbol} bị loại do FOMO trong trend TĂNG (RSI={rsi:.1f}, Δgiá 3h={price_change:.1f}%)")
-                        continue
-
-                    _process_buy(symbol, "TĂNG")
-                    continue
-                except Exception as e:
-                    logger.error(f"❌ Lỗi khi mua {symbol} theo trend TĂNG: {e}")
-                    continue
+METRICS_OUT = os.getenv("METRICS_OUT", "run_metrics.json")
+
+
+def _write_metrics_report(path):
+    if logger.isEnabledFor(logging.INFO):
+        top = ", ".join(f"{stage}={total:.2f}s/{count}" for stage, total, count in instrumentation.REGISTRY.top_stages())
+        logger.info("⏱ Stage tốn thời gian nhất: %s", top, extra={"stage": "metrics"})
+    if not path:
+        return
+    try:
+        instrumentation.REGISTRY.write_report(path)
+        logger.info("📈 Đã ghi báo cáo metrics: %s", path, extra={"stage": "metrics"})
+    except Exception as e:
+        logger.warning("⚠️ Không thể ghi báo cáo metrics %s: %s", path, e, extra={"stage": "metrics"})
+
+
+# ===================== DAEMON =====================
+# Chạy liên tục thay cho cron: client, cache và kho nến được giữ ấm giữa các
+# chu kỳ. Chu kỳ mua và chu kỳ bán có interval riêng, căn theo bội số của
+# interval tính từ epoch UTC (900s = đúng mốc đóng nến 15m) cộng một độ trễ nhỏ.
+DAEMON_BUY_INTERVAL = float(os.getenv("DAEMON_BUY_INTERVAL", 900))
+DAEMON_SELL_INTERVAL = float(os.getenv("DAEMON_SELL_INTERVAL", 60))
+DAEMON_CLOSE_DELAY = float(os.getenv("DAEMON_CLOSE_DELAY", 3))
+DAEMON_SHUTDOWN_TIMEOUT = float(os.getenv("DAEMON_SHUTDOWN_TIMEOUT", 60))
+
+
+def _next_aligned(interval, now, delay=0.0):
+    """Mốc kế tiếp sau `now`: bội số của interval (từ epoch) cộng delay."""
+    return (now - delay) // interval * interval + interval + delay
 
-            if trend == "SIDEWAY":
-                try:
-                    ohlcv = exchange.fetch_ohlcv(symbol.replace("-", "/"), timeframe="1h", limit=30)
-                    closes = [c[4] for c in ohlcv]
-                    volumes = [c[5] for c in ohlcv]
-                    rsi = compute_rsi(closes, period=14)
-                    vol = volumes[-1]
-                    vol_sma20 = sum(volumes[-20:]) / 20
-                    price_now = closes[-1]
-                    price_3bars_ago = closes[-4]
-                    price_change = (price_now - price_3bars_ago) / price_3bars_ago * 100
-
-                    if rsi > 70 or vol > vol_sma20 * 2 or price_change > 10:
-                        logger.info(f"⛔ {symbol} bị loại do dấu hiệu FOMO (RSI={rsi:.2f}, Δgiá 3h={price_change:.1f}%, vol={vol:.0f})")
-                        continue
-                    if len(closes) < 20:
-                        logger.warning(f"⚠️ Không đủ dữ liệu nến cho {symbol}")
-                        continue
-                    if rsi >= 55 or vol >= vol_sma20:
-                        logger.info(f"⛔ {symbol} bị loại (SIDEWAY nhưng không nén đủ mạnh)")
-                        continue
-
-                    _process_buy(symbol, "SIDEWAY")
-                except Exception as e:
-                    logger.error(f"❌ Lỗi khi mua {symbol} theo SIDEWAY: {e}")
-        except Exception as e:
-            logger.error(f"❌ Lỗi khi xử lý dòng {i} - {row}: {e}")
 
+class DaemonJob:
+    def __init__(self, name, interval, func):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.next_run = None
+        self.runs = 0
+        self.skipped = 0
+        self.failures = 0
+        self.thread = None
+        self._running = threading.Lock()
+
+
+class DaemonScheduler:
+    """Chạy các job theo chu kỳ riêng trong thread riêng.
+
+    Một job không bao giờ chạy chồng lên chính nó: nếu chu kỳ trước chưa xong
+    khi tới mốc mới thì mốc đó bị bỏ qua. stop() (SIGTERM/SIGINT) dừng lập
+    lịch và chờ các chu kỳ đang chạy xong trong DAEMON_SHUTDOWN_TIMEOUT.
+    """
+
+    def __init__(self, jobs, delay=DAEMON_CLOSE_DELAY):
+        self.jobs = list(jobs)
+        self.delay = delay
+        self._stop = threading.Event()
+
+    def stop(self, *_):
+        self._stop.set()
+
+    def _launch(self, job):
+        if not job._running.acquire(blocking=False):
+            job.skipped += 1
+            logger.warning("⏭ Bỏ chu kỳ %s: chu kỳ trước chưa xong", job.name, extra={"stage": "daemon", "reason": "overlap"})
+            return
+
+        def _target():
+            started = time.perf_counter()
+            try:
+                job.func()
+                job.runs += 1
+            except Exception as e:
+                job.failures += 1
+                logger.error("❌ Lỗi chu kỳ %s: %s", job.name, e, extra={"stage": "daemon"})
+            finally:
+                job._running.release()
+            elapsed = time.perf_counter() - started
+            logger.info(
+                "⏱ Chu kỳ %s xong trong %.3fs", job.name, elapsed,
+                extra={"stage": "daemon", "latency_ms": round(elapsed * 1000, 1)},
+            )
+
+        job.thread = threading.Thread(target=_target, name=f"daemon-{job.name}", daemon=True)
+        job.thread.start()
+
+    def run(self, max_runtime=None):
+        started = time.time()
+        for job in self.jobs:
+            job.next_run = started
+        while not self._stop.is_set():
+            now = time.time()
+            if max_runtime is not None and now - started >= max_runtime:
+                break
+            for job in self.jobs:
+                if now >= job.next_run:
+                    self._launch(job)
+                    job.next_run = _next_aligned(job.interval, now, self.delay)
+            wake = min(job.next_run for job in self.jobs)
+            if max_runtime is not None:
+                wake = min(wake, started + max_runtime)
+            self._stop.wait(max(0.0, wake - time.time()))
+        self.join()
+
+    def join(self, timeout=DAEMON_SHUTDOWN_TIMEOUT):
+        deadline = time.time() + timeout
+        for job in self.jobs:
+            if job.thread is not None:
+                job.thread.join(max(0.0, deadline - time.time()))
+                if job.thread.is_alive():
+                    logger.warning("⚠️ Chu kỳ %s chưa xong sau %ss, thoát không chờ", job.name, timeout, extra={"stage": "daemon"})
+
+    def stats(self):
+        return {job.name: {"runs": job.runs, "skipped": job.skipped, "failures": job.failures} for job in self.jobs}
+
+
+def _warm_clients():
+    # Khởi tạo trước để chu kỳ đầu không phải trả chi phí import/auth/load_markets.
+    for name, warm in (
+        ("exchange", lambda: getattr(get_exchange(), "load_markets", lambda: None)()),
+        ("storage_sheet", get_storage_sheet),
+        ("entry_store", load_entry_prices),
+        ("telegram", get_telegram_session),
+    ):
+        try:
+            warm()
+        except Exception as e:
+            logger.warning("⚠️ Không thể khởi tạo trước %s: %s", name, e, extra={"stage": "daemon"})
+
+
+def _log_cache_stats():
+    logger.info("📊 Market cache: %s", market_cache.stats())
+    logger.info("🚦 Exchange scheduler: %s", exchange_scheduler.stats())
+    candle_store = get_candle_store()
+    if candle_store is not None:
+        compacted = candle_store.compact()
+        logger.info("🕯 Candle store: %s, đã compact %s nến cũ", candle_store.stats(), compacted)
+    trend_memo = get_trend_memo()
+    if trend_memo is not None:
+        trend_memo.flush()
+        logger.info("🧠 Trend memo: %s", trend_memo.stats())
+
+
+def run_daemon(max_runtime=None, metrics_out=None, buy_interval=DAEMON_BUY_INTERVAL, sell_interval=DAEMON_SELL_INTERVAL):
+    def _buy_cycle():
+        market_cache.invalidate_balance()
+        market_cache.invalidate_ohlcv()
+        run_bot()
+        _log_cache_stats()
+        market_cache.prune()
+        _write_metrics_report(metrics_out)
+
+    def _sell_cycle():
+        market_cache.invalidate_balance()
+        auto_sell_once()
+
+    scheduler = DaemonScheduler([
+        DaemonJob("buy", buy_interval, _buy_cycle),
+        DaemonJob("sell", sell_interval, _sell_cycle),
+    ])
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, scheduler.stop)
+        signal.signal(signal.SIGINT, scheduler.stop)
+    logger.info("🟢 [DAEMON] Mua mỗi %.0fs, bán mỗi %.0fs", buy_interval, sell_interval, extra={"stage": "daemon"})
+    _warm_clients()
+    scheduler.run(max_runtime)
+    logger.info("🔴 [DAEMON] Dừng: %s", scheduler.stats(), extra={"stage": "daemon"})
+    return scheduler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="OKX spot auto bot")
+    parser.add_argument("--watch", action="store_true", help="theo dõi giá realtime và bán khi chạm TP/SL")
+    parser.add_argument("--replay", help="file JSONL giá để phát lại thay cho WebSocket (dùng với --watch)")
+    parser.add_argument("--max-runtime", type=float, help="số giây tối đa cho --watch/--daemon")
+    parser.add_argument("--daemon", action="store_true", help="chạy liên tục: chu kỳ mua/bán theo DAEMON_BUY_INTERVAL/DAEMON_SELL_INTERVAL")
+    parser.add_argument("--prescreen", action="store_true", help="in danh sách cặp USDT đạt lọc thanh khoản/spread rồi thoát")
+    parser.add_argument("--startup-profile", action="store_true", help="in thời gian import và khởi tạo client")
+    parser.add_argument("--metrics-out", default=METRICS_OUT, help="file báo cáo metrics (.json hoặc .prom cho Prometheus textfile); rỗng = không ghi")
+    args = parser.parse_args(argv)
 
-def main():
     print(f"🟢 Bắt đầu bot lúc {datetime.now(timezone.utc).isoformat()}")
-    run_bot()
-    auto_sell_once()
+    instrumentation.REGISTRY.reset()
+    get_sheet_syncer().start()
+    try:
+        if args.prescreen:
+            print(json.dumps(bulk_prescreen(), indent=2))
+            return
+
+        if args.watch:
+            feed = ReplayFeed(args.replay) if args.replay else OkxTickerFeed()
+            watch_and_sell(feed, max_runtime=args.max_runtime)
+            return
+
+        if args.daemon:
+            run_daemon(max_runtime=args.max_runtime, metrics_out=args.metrics_out)
+            return
+
+        market_cache.reset()
+        run_bot()
+        auto_sell_once()
+        _log_cache_stats()
+    finally:
+        get_sheet_syncer().stop()
+        get_telegram_notifier().stop()
+        _write_metrics_report(args.metrics_out)
+        if args.startup_profile:
+            print(json.dumps({k: round(v, 4) for k, v in STARTUP_TIMINGS.items()}, indent=2))
+
+
+STARTUP_TIMINGS["import_main"] = time.perf_counter() - _IMPORT_STARTED
 
 
 if __name__ == "__main__":
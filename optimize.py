@@ -0,0 +1,296 @@
+"""Quét tham số UPGRADE (grid hoặc random) trên nến lịch sử.
+
+Mỗi symbol được xử lý trong một process: xu hướng, bộ lọc 1h và các chỉ báo
+của evaluate_entry (DX, ATR%, độ rộng Bollinger và thứ hạng của nó, thứ hạng
+volume, biến động BTC 3 nến, stop) chỉ tính một lần cho mọi nến ứng viên;
+sau đó mọi bộ tham số chỉ còn là phép so sánh ngưỡng + mô phỏng thoát lệnh.
+
+    python optimize.py --data-dir candles --grid min_adx=18,22,26 min_rr=1.5,1.8,2.2
+    python optimize.py --data-dir candles.db --random 200 --env-out best.env
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import backtest
+import indicators
+import main as bot
+
+PARAM_ENV = {
+    "min_adx": "MIN_ADX",
+    "min_atr_pct": "MIN_ATR_PCT",
+    "min_bbwidth_pctile": "MIN_BBWIDTH_PCTILE",
+    "vol_pctile": "VOL_PCTILE",
+    "btc_drop_block": "BTC_DROP_BLOCK",
+    "min_rr": "MIN_RR",
+}
+
+DEFAULT_GRID = {
+    "min_adx": [18, 22, 26, 30],
+    "min_atr_pct": [0.004, 0.006, 0.008],
+    "min_bbwidth_pctile": [0.15, 0.25, 0.4],
+    "vol_pctile": [0.6, 0.7, 0.8],
+    "btc_drop_block": [0.005, 0.008, 0.012],
+    "min_rr": [1.5, 1.8, 2.2, 2.6],
+}
+
+RANDOM_RANGES = {
+    "min_adx": (12, 35),
+    "min_atr_pct": (0.002, 0.012),
+    "min_bbwidth_pctile": (0.05, 0.6),
+    "vol_pctile": (0.5, 0.9),
+    "btc_drop_block": (0.003, 0.02),
+    "min_rr": (1.2, 3.0),
+}
+
+
+def _rank_ok(cnt_le, n, q):
+    # bbw >= _percentile(vals, q)  <=>  có ít nhất k + 1 giá trị <= bbw (k = chỉ số nearest-rank).
+    k = np.clip(np.round(q * (n - 1)), 0, None)
+    return (n > 0) & (cnt_le >= k + 1) | (n == 0)
+
+
+def precompute_symbol(symbol, data_dir, step=1):
+    """Đặc trưng (không phụ thuộc tham số) tại mọi nến ứng viên của một symbol."""
+    o15 = backtest.load_candles(data_dir, symbol, backtest.BASE_TF)
+    btc15 = backtest.load_candles(data_dir, backtest.BTC_SYMBOL, backtest.BASE_TF)
+    higher = {tf: backtest.load_timeframe(data_dir, symbol, tf) for tf in set(bot.TREND_TIMEFRAMES) | {"1h"}}
+    limit = bot.SCREEN_15M_LIMIT
+    if len(o15) < max(40, limit):
+        return None
+
+    base_ms = bot._tf_seconds(backtest.BASE_TF) * 1000
+    higher_times = {tf: [c[0] for c in rows] for tf, rows in higher.items()}
+    btc_times = [c[0] for c in btc15]
+    cols = indicators.to_columns(o15)
+
+    # Xu hướng + lọc 1h chỉ đổi khi có nến khung lớn đóng -> memo theo vị trí cuối cửa sổ.
+    memo = {}
+    candidates = []
+    bb = indicators.RollingBollinger(history=limit - 20)
+    bb_rank = {}
+    for t in range(len(o15)):
+        bb.append(o15[t][4])
+        if t < limit - 1 or (t - limit + 1) % step:
+            continue
+        now_ms = o15[t][0] + base_ms
+        ends = tuple(
+            bisect_right(higher_times[tf], now_ms - bot._tf_seconds(tf) * 1000) for tf in bot.TREND_TIMEFRAMES + ["1h"]
+        )
+        if ends not in memo:
+            windows = {tf: higher[tf][max(0, e - 50):e] for tf, e in zip(bot.TREND_TIMEFRAMES, ends)}
+            trend = bot._trend_label(sum(bot._trend_score(windows[tf]) for tf in bot.TREND_TIMEFRAMES))
+            ok = False
+            if trend in ("TĂNG", "SIDEWAY"):
+                h1 = higher["1h"][max(0, ends[-1] - 30):ends[-1]]
+                ok = len(h1) >= 20 and bot._one_hour_filter(trend, h1)[0] is None
+            memo[ends] = ok
+        if memo[ends]:
+            candidates.append(t)
+            widths = bb._sorted
+            bb_rank[t] = (bisect_right(widths, bb.width), len(widths))
+
+    if not candidates:
+        return {"symbol": symbol, "t": np.array([], dtype=int), "cols": cols, "base_ms": base_ms}
+
+    t_idx = np.array(candidates)
+    win = lambda row: np.lib.stride_tricks.sliding_window_view(row, limit)[t_idx - limit + 1]
+    high_w, low_w, close_w = win(cols[indicators.HIGH]), win(cols[indicators.LOW]), win(cols[indicators.CLOSE])
+    dx = indicators.dx_last(high_w, low_w, close_w)
+    atrp = indicators.atr_pct_last(high_w, low_w, close_w)
+
+    vol_w = win(cols[indicators.VOLUME])[:, -50:]
+    vol_last = vol_w[:, -1]
+    vol_cnt_le = (vol_w <= vol_last[:, None]).sum(axis=1)
+    vol_mean_ok = vol_last >= vol_w.mean(axis=1)
+
+    btc_ret = np.full(len(t_idx), np.nan)
+    for i, t in enumerate(t_idx):
+        end = bisect_right(btc_times, o15[t][0])
+        if end >= 3:
+            btc_ret[i] = (btc15[end - 1][4] - btc15[end - 3][4]) / btc15[end - 3][4]
+
+    entry = close_w[:, -1]
+    low_n = low_w[:, -10:].min(axis=1)
+    stop = np.maximum(low_n, entry - 1.8 * (atrp * entry))
+
+    return {
+        "symbol": symbol,
+        "t": t_idx,
+        "cols": cols,
+        "base_ms": base_ms,
+        "dx": dx,
+        "atrp": atrp,
+        "bb_cnt_le": np.array([bb_rank[t][0] for t in candidates]),
+        "bb_n": np.array([bb_rank[t][1] for t in candidates]),
+        "vol_cnt_le": vol_cnt_le,
+        "vol_n": np.full(len(t_idx), vol_w.shape[1]),
+        "vol_mean_ok": vol_mean_ok,
+        "btc_ret": btc_ret,
+        "entry": entry,
+        "stop": stop,
+    }
+
+
+def _first_exit(features, t, entry, stop, tp):
+    """Cùng luật với backtest._simulate_exit: SL trước, rồi TP, rồi +30%."""
+    cols = features["cols"]
+    opens = cols[indicators.OPEN][t + 1:]
+    highs = cols[indicators.HIGH][t + 1:]
+    lows = cols[indicators.LOW][t + 1:]
+    n = len(lows)
+    hits = []
+    for reason, mask in (
+        ("sl", lows <= stop),
+        ("tp", highs >= tp),
+        ("gain", (highs - entry) / entry * 100 >= 30),
+    ):
+        idx = int(mask.argmax()) if n and mask.any() else n
+        hits.append((idx, reason))
+    idx, reason = min(hits, key=lambda h: (h[0], ("sl", "tp", "gain").index(h[1])))
+    if idx >= n:
+        return None
+    if reason == "sl":
+        price = min(opens[idx], stop)
+    elif reason == "tp":
+        price = max(opens[idx], tp)
+    else:
+        price = max(opens[idx], entry * 1.3)
+    return t + 1 + idx, reason, float(price)
+
+
+def evaluate_params(features, params, fee=0.001):
+    if features is None or not len(features["t"]):
+        return []
+    passed = (
+        ~np.isnan(features["dx"])
+        & (features["dx"] >= params["min_adx"])
+        & (features["atrp"] >= params["min_atr_pct"])
+        & _rank_ok(features["bb_cnt_le"], features["bb_n"], params["min_bbwidth_pctile"])
+        & features["vol_mean_ok"]
+        & _rank_ok(features["vol_cnt_le"], features["vol_n"], params["vol_pctile"])
+        & (np.isnan(features["btc_ret"]) | (features["btc_ret"] > -params["btc_drop_block"]))
+        & (features["stop"] < features["entry"])
+    )
+    trades = []
+    busy_until = -1
+    ts = features["cols"][indicators.TS]
+    for i in np.flatnonzero(passed):
+        t = int(features["t"][i])
+        if t <= busy_until:
+            continue
+        entry, stop = float(features["entry"][i]), float(features["stop"][i])
+        tp = entry + params["min_rr"] * (entry - stop)
+        hit = _first_exit(features, t, entry, stop, tp)
+        if hit is None:
+            break
+        j, reason, price = hit
+        busy_until = j
+        trades.append({
+            "symbol": features["symbol"],
+            "exit_time": int(ts[j]) + features["base_ms"],
+            "reason": reason,
+            "return": price / entry * (1 - fee) / (1 + fee) - 1,
+        })
+    return trades
+
+
+def _sweep_symbol(args):
+    symbol, data_dir, param_sets, step, fee = args
+    features = precompute_symbol(symbol, data_dir, step)
+    return [evaluate_params(features, params, fee) for params in param_sets]
+
+
+def build_param_sets(grid=None, n_random=0, seed=0):
+    base = {k: bot.UPGRADE[k] for k in PARAM_ENV}
+    if n_random:
+        rng = random.Random(seed)
+        sets = [dict(base)]
+        for _ in range(n_random):
+            sets.append({k: round(rng.uniform(*RANDOM_RANGES[k]), 6) for k in PARAM_ENV})
+        return sets
+    grid = grid or DEFAULT_GRID
+    keys = list(grid)
+    sets = []
+    for combo in itertools.product(*(grid[k] for k in keys)):
+        params = dict(base)
+        params.update(zip(keys, combo))
+        sets.append(params)
+    return sets
+
+
+def sweep(data_dir, param_sets, symbols=None, step=1, fee=0.001, workers=None, notional=20.0):
+    symbols = symbols or [s for s in backtest.list_symbols(data_dir) if s != backtest.BTC_SYMBOL]
+    per_param = [[] for _ in param_sets]
+    jobs = [(symbol, data_dir, param_sets, step, fee) for symbol in symbols]
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        for results in pool.map(_sweep_symbol, jobs):
+            for i, trades in enumerate(results):
+                per_param[i].extend(trades)
+    rows = []
+    for params, trades in zip(param_sets, per_param):
+        summary = backtest.summarize(trades, notional)
+        summary["params"] = params
+        rows.append(summary)
+    return rows
+
+
+def _parse_grid(items):
+    grid = {}
+    for item in items:
+        key, _, values = item.partition("=")
+        if key not in PARAM_ENV:
+            raise SystemExit(f"Tham số không hợp lệ: {key} (chọn trong {', '.join(PARAM_ENV)})")
+        grid[key] = [float(v) for v in values.split(",") if v]
+    return grid
+
+
+def write_env(path, params):
+    with open(path, "w", encoding="utf-8") as f:
+        for key, env in PARAM_ENV.items():
+            f.write(f"{env}={params[key]}\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tối ưu ngưỡng UPGRADE trên nến lịch sử")
+    parser.add_argument("--data-dir", required=True, help="thư mục file nến hoặc file candles.db (xem backtest.py)")
+    parser.add_argument("--symbols", nargs="*")
+    parser.add_argument("--grid", nargs="*", help="vd: min_adx=18,22,26 min_rr=1.5,2 (mặc định: DEFAULT_GRID)")
+    parser.add_argument("--random", type=int, default=0, help="số bộ tham số ngẫu nhiên thay cho grid")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--step", type=int, default=1)
+    parser.add_argument("--fee", type=float, default=0.001)
+    parser.add_argument("--notional", type=float, default=20.0)
+    parser.add_argument("--min-trades", type=int, default=10, help="bỏ các bộ có ít giao dịch hơn")
+    parser.add_argument("--metric", choices=["pnl_usdt", "hit_rate", "pnl_dd"], default="pnl_usdt")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--env-out", help="ghi bộ tham số tốt nhất ra file env")
+    args = parser.parse_args(argv)
+
+    grid = _parse_grid(args.grid) if args.grid else None
+    param_sets = build_param_sets(grid, args.random, args.seed)
+    rows = sweep(args.data_dir, param_sets, args.symbols, args.step, args.fee, args.workers, args.notional)
+    for row in rows:
+        row["pnl_dd"] = row["pnl_usdt"] / max(row["max_drawdown_usdt"], 1e-9)
+    rows = [r for r in rows if r["trades"] >= args.min_trades]
+    rows.sort(key=lambda r: r[args.metric], reverse=True)
+
+    print(f"{'#':>3} {'trades':>6} {'hit':>6} {'pnl':>9} {'maxdd':>8}  params")
+    for i, row in enumerate(rows[:args.top], 1):
+        params = " ".join(f"{k}={row['params'][k]}" for k in PARAM_ENV)
+        print(f"{i:>3} {row['trades']:>6} {row['hit_rate']:>6.2%} {row['pnl_usdt']:>9.2f} {row['max_drawdown_usdt']:>8.2f}  {params}")
+
+    if rows and args.env_out:
+        write_env(args.env_out, rows[0]["params"])
+        print(f"Đã ghi {args.env_out}: {json.dumps({PARAM_ENV[k]: rows[0]['params'][k] for k in PARAM_ENV})}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+"""Chạy bot cho nhiều tài khoản OKX / watchlist song song trên nhiều process.
+
+Mỗi job = (tài khoản, shard) chạy trong một process riêng (spawn) với exchange
+client, entry store, kho tín hiệu/trend memo và phần hạn mức rate limit riêng.
+Các shard của cùng một tài khoản chia watchlist theo crc32(symbol) (SHARD_INDEX
+/ SHARD_COUNT trong main.py) và dùng chung entry store của tài khoản; chỉ shard
+0 đẩy entry lên Google Sheet, các shard khác ghi outbox để shard 0 (hoặc bước
+sync cuối) đẩy lên. Process điều phối gộp metrics (histogram thô, không phải
+quantile) và gửi Telegram qua một notifier chung để tin được gom và không vượt
+rate limit của bot Telegram.
+
+    python shard.py accounts.json --workers 4 --shards-per-account 2
+    python shard.py accounts.json --daemon --max-runtime 3600
+    python shard.py accounts.json --simulate 200     # sàn/Sheet giả lập, không cần mạng
+
+accounts.json là list tài khoản, ví dụ:
+
+    [{"name": "sub1",
+      "api_key_env": "OKX_SUB1_KEY", "api_secret_env": "OKX_SUB1_SECRET",
+      "api_passphrase_env": "OKX_SUB1_PASSPHRASE",
+      "spreadsheet_url": "https://docs.google.com/.../edit#gid=0",
+      "storage_worksheet": "spot_entry_storage_sub1",
+      "env": {"MAX_ORDERS_PER_RUN": "2"}}]
+
+api_key/api_secret/api_passphrase có thể ghi trực tiếp thay cho *_env;
+spreadsheet_url và storage_worksheet mặc định theo biến môi trường hiện tại.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+from pathlib import Path
+
+import instrumentation
+
+# main.py đọc cấu hình (API key, đường dẫn store, hạn mức...) lúc import, nên
+# chỉ import trong process worker sau khi đã đặt env của job; process con
+# (spawn) cũng import lại module này nên không import main ở top-level.
+CREDENTIAL_KEYS = {"api_key": "OKX_API_KEY", "api_secret": "OKX_API_SECRET", "api_passphrase": "OKX_API_PASSPHRASE"}
+DEFAULT_MAX_RPS = float(os.getenv("EXCHANGE_MAX_RPS", 20))
+
+
+def _credential(account, key):
+    if account.get(key):
+        return account[key]
+    env_name = account.get(f"{key}_env")
+    return os.environ.get(env_name, "") if env_name else ""
+
+
+def load_accounts(path, simulate=False):
+    accounts = json.loads(Path(path).read_text(encoding="utf-8"))
+    if not isinstance(accounts, list) or not accounts:
+        raise ValueError(f"{path}: cần một list tài khoản")
+    names, worksheets = set(), set()
+    for account in accounts:
+        name = account.get("name")
+        if not name or name in names:
+            raise ValueError(f"Tên tài khoản thiếu hoặc bị trùng: {name!r}")
+        names.add(name)
+        worksheet = (
+            account.get("storage_sheet_key", os.getenv("STORAGE_SHEET_KEY", "")),
+            account.get("storage_worksheet", os.getenv("STORAGE_WORKSHEET", "spot_entry_storage")),
+        )
+        if worksheet in worksheets:
+            raise ValueError(f"{name}: storage_worksheet {worksheet[1]!r} đã được tài khoản khác dùng")
+        worksheets.add(worksheet)
+        if not simulate:
+            missing = [key for key in CREDENTIAL_KEYS if not _credential(account, key)]
+            if missing:
+                raise ValueError(f"{name}: thiếu {', '.join(missing)}")
+    return accounts
+
+
+def _budget_share(env, shards, shard):
+    """Chia ngân sách run_bot của tài khoản cho các shard để tổng không vượt hạn mức."""
+    share = {}
+    orders = int(env.get("MAX_ORDERS_PER_RUN") or 0)
+    if orders > 0:
+        orders = orders // shards + (1 if shard < orders % shards else 0)
+        share["MAX_ORDERS_PER_RUN"] = str(orders or -1)
+    capital = float(env.get("RUN_CAPITAL_USDT") or 0)
+    if capital > 0:
+        share["RUN_CAPITAL_USDT"] = str(capital / shards)
+    return share
+
+
+def build_jobs(accounts, args):
+    """Mỗi tài khoản tách thành `shards_per_account` job; hạn mức chia theo số job chạy cùng lúc.
+
+    MAX_ORDERS_PER_RUN / RUN_CAPITAL_USDT là của cả tài khoản: các shard chạy
+    song song trên cùng số dư nên mỗi shard chỉ nhận phần của mình.
+    """
+    shards = max(1, args.shards_per_account)
+    total = len(accounts) * shards
+    concurrent = total if args.daemon else max(1, min(args.workers, total))
+    state_dir = Path(args.state_dir)
+    jobs = []
+    for seed, account in enumerate(accounts):
+        name = account["name"]
+        account_dir = state_dir / name
+        account_dir.mkdir(parents=True, exist_ok=True)
+        # Trend memo đổi cách chấm điểm (chỉ nến đã đóng) nên chỉ bật khi được cấu hình.
+        memo = account.get("env", {}).get("TREND_MEMO_PATH", os.getenv("TREND_MEMO_PATH", ""))
+        for shard in range(shards):
+            env = {
+                "SPREADSHEET_URL": account.get("spreadsheet_url", os.getenv("SPREADSHEET_URL", "")),
+                "STORAGE_WORKSHEET": account.get("storage_worksheet", os.getenv("STORAGE_WORKSHEET", "spot_entry_storage")),
+                "ENTRY_DB_PATH": str(account_dir / "spot_entries.db"),
+                "SIGNAL_DB_PATH": str(account_dir / f"signals.{shard}.db"),
+                "TREND_MEMO_PATH": str(account_dir / f"trend_memo.{shard}.db") if memo else "",
+                "CANDLE_STORE_PATH": str(state_dir / "candles.db"),
+                "SHARD_INDEX": str(shard),
+                "SHARD_COUNT": str(shards),
+                # Endpoint public chung IP với mọi process, endpoint tài khoản chung API key.
+                "EXCHANGE_PUBLIC_SHARE": str(1 / concurrent),
+                "EXCHANGE_ACCOUNT_SHARE": str(1 / shards),
+                "EXCHANGE_MAX_RPS": str(DEFAULT_MAX_RPS / concurrent),
+            }
+            if account.get("storage_sheet_key"):
+                env["STORAGE_SHEET_KEY"] = account["storage_sheet_key"]
+            for key, env_name in CREDENTIAL_KEYS.items():
+                env[env_name] = _credential(account, key)
+            env.update({k: str(v) for k, v in account.get("env", {}).items()})
+            env.update(_budget_share({**os.environ, **env}, shards, shard))
+            jobs.append({
+                "tag": f"{name}#{shard}" if shards > 1 else name,
+                "account": name,
+                "shard": shard,
+                "env": env,
+                "sync_sheet": shard == 0,
+                "daemon": args.daemon,
+                "max_runtime": args.max_runtime,
+                "simulate": args.simulate,
+                "seed": args.seed + seed,
+                "metrics_out": str(account_dir / f"metrics.{shard}.json"),
+            })
+    return jobs, concurrent
+
+
+class _ForwardingNotifier:
+    """Thay TelegramNotifier trong worker: đẩy tin về process điều phối."""
+
+    def __init__(self, channel, tag):
+        self.channel = channel
+        self.tag = tag
+
+    def send(self, message):
+        self.channel.put((self.tag, message))
+
+    def stop(self, timeout=None):
+        pass
+
+
+class _AccountFilter(logging.Filter):
+    def __init__(self, tag):
+        super().__init__()
+        self.tag = tag
+
+    def filter(self, record):
+        record.account = self.tag
+        return True
+
+
+def _simulate(bot, job):
+    from bench import signal_rows
+    from simulator import SimExchange, SimWorksheet
+
+    ex = SimExchange.synthetic(job["simulate"], seed=job["seed"])
+    bot.set_exchange(ex)
+    bot.set_storage_sheet(SimWorksheet(seed=job["seed"]))
+    rows = signal_rows(ex.symbols())
+    bot.fetch_sheet = lambda validators=None: (iter(rows), {})
+
+
+def _run_job(job, notify):
+    os.environ.update(job["env"])
+    import main as bot
+
+    tag = job["tag"]
+    bot.logger.addFilter(_AccountFilter(tag))
+    if bot.LOG_FORMAT != "json":
+        bot.handler.setFormatter(bot._TextFormatter(f"%(asctime)s - [{tag}] %(levelname)s - %(message)s"))
+    bot.set_telegram_notifier(_ForwardingNotifier(notify, tag))
+    if job["simulate"]:
+        _simulate(bot, job)
+
+    bot.instrumentation.REGISTRY.reset()
+    if job["sync_sheet"]:
+        bot.get_sheet_syncer().start()
+    try:
+        if job["daemon"]:
+            bot.run_daemon(max_runtime=job["max_runtime"], metrics_out=job["metrics_out"])
+        else:
+            bot.market_cache.reset()
+            bot.run_bot()
+            bot.auto_sell_once()
+            bot._log_cache_stats()
+    finally:
+        if job["sync_sheet"]:
+            bot.get_sheet_syncer().stop()
+        bot._write_metrics_report(job["metrics_out"])
+    return bot.instrumentation.REGISTRY.snapshot()
+
+
+def _worker(job, results, notify):
+    started = time.perf_counter()
+    try:
+        snapshot = _run_job(job, notify)
+        results.put((job["tag"], snapshot, None, time.perf_counter() - started))
+    except BaseException as e:
+        results.put((job["tag"], None, f"{type(e).__name__}: {e}", time.perf_counter() - started))
+
+
+def _sync_job(job, results, notify):
+    # Đẩy nốt outbox do các shard > 0 ghi sau khi shard 0 đã dừng.
+    started = time.perf_counter()
+    try:
+        os.environ.update(job["env"])
+        import main as bot
+
+        bot.get_sheet_syncer().flush()
+        results.put((job["tag"], None, None, time.perf_counter() - started))
+    except BaseException as e:
+        results.put((job["tag"], None, f"{type(e).__name__}: {e}", time.perf_counter() - started))
+
+
+def _forward_notifications(bot, notify):
+    while True:
+        item = notify.get()
+        if item is None:
+            return
+        tag, message = item
+        bot.send_to_telegram(f"[{tag}] {message}")
+
+
+def run_jobs(jobs, workers, target=_worker, notify=None, ctx=None):
+    """Chạy job trên tối đa `workers` process; trả về {tag: (snapshot, error, giây)}."""
+    ctx = ctx or multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    pending = list(jobs)
+    running = {}
+    done = {}
+
+    def _terminate(signum, frame):
+        pending.clear()
+        for process in running.values():
+            process.terminate()
+
+    previous = signal.signal(signal.SIGTERM, _terminate) if threading.current_thread() is threading.main_thread() else None
+    try:
+        while pending or running:
+            while pending and len(running) < workers:
+                job = pending.pop(0)
+                process = ctx.Process(target=target, args=(job, results, notify), name=job["tag"])
+                process.start()
+                running[job["tag"]] = process
+            try:
+                tag, snapshot, error, seconds = results.get(timeout=1)
+            except KeyboardInterrupt:
+                # Ctrl-C cũng đến các process con (cùng process group): chờ chúng dừng.
+                pending.clear()
+                continue
+            except queue.Empty:
+                for tag, process in list(running.items()):
+                    if process.exitcode is not None and tag not in done:
+                        # Chết không kịp báo kết quả (bị kill, segfault...).
+                        done[tag] = (None, f"process thoát với mã {process.exitcode}", None)
+                        running.pop(tag).join()
+                continue
+            done[tag] = (snapshot, error, seconds)
+            process = running.pop(tag, None)
+            if process is not None:
+                process.join()
+    finally:
+        if previous is not None:
+            signal.signal(signal.SIGTERM, previous)
+    return done
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Chạy bot cho nhiều tài khoản/watchlist trên nhiều process")
+    parser.add_argument("accounts", help="file JSON danh sách tài khoản")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="số process chạy cùng lúc")
+    parser.add_argument("--shards-per-account", type=int, default=1, help="số process chia watchlist của mỗi tài khoản")
+    parser.add_argument("--daemon", action="store_true", help="mỗi job chạy run_daemon (mọi job chạy cùng lúc)")
+    parser.add_argument("--max-runtime", type=float, help="số giây tối đa cho --daemon")
+    parser.add_argument("--state-dir", default="shard_state", help="thư mục chứa store của từng tài khoản")
+    parser.add_argument("--metrics-out", default="shard_metrics.json", help="báo cáo metrics gộp (.json hoặc .prom)")
+    parser.add_argument("--simulate", type=int, default=0, help="số symbol trên sàn giả lập cho mỗi tài khoản (0 = sàn thật)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    accounts = load_accounts(args.accounts, simulate=bool(args.simulate))
+    jobs, workers = build_jobs(accounts, args)
+    import main as bot
+
+    ctx = multiprocessing.get_context("spawn")
+    notify = ctx.Queue()
+    forwarder = threading.Thread(target=_forward_notifications, args=(bot, notify), daemon=True)
+    forwarder.start()
+    print(f"🟢 Chạy {len(jobs)} job ({len(accounts)} tài khoản) trên {workers} process")
+
+    registry = instrumentation.REGISTRY
+    registry.reset()
+    try:
+        done = run_jobs(jobs, workers, notify=notify, ctx=ctx)
+        syncs = [job for job in jobs if job["shard"] == 0 and args.shards_per_account > 1 and not args.simulate]
+        if syncs:
+            for tag, (_, error, _) in run_jobs(syncs, workers, target=_sync_job, notify=notify, ctx=ctx).items():
+                if error:
+                    print(f"⚠️ Sync Sheet {tag} lỗi: {error}")
+    finally:
+        notify.put(None)
+        forwarder.join(timeout=10)
+        bot.get_telegram_notifier().stop()
+
+    failed = 0
+    for job in jobs:
+        snapshot, error, seconds = done.get(job["tag"], (None, "không chạy", None))
+        if snapshot is not None:
+            registry.merge(snapshot, symbol_prefix=f"{job['account']}:")
+        if error:
+            failed += 1
+            print(f"❌ {job['tag']}: {error}")
+        else:
+            print(f"✅ {job['tag']}: xong trong {seconds:.1f}s")
+    if args.metrics_out:
+        registry.write_report(args.metrics_out)
+        print(f"📈 Metrics gộp: {args.metrics_out}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,469 @@
+"""Sàn và Google Sheet giả lập, chạy offline, kết quả lặp lại được.
+
+SimExchange có đúng phần API ccxt mà bot dùng: fetch_ticker, fetch_tickers,
+fetch_ohlcv, fetch_balance, create_market_buy_order, create_market_sell_order
+và algo order OCO/trigger của OKX (create_order với stopLossPrice /
+takeProfitPrice, fetch_order, cancel_order). Dữ liệu lấy từ fixture đã ghi
+(cùng định dạng với backtest.py: thư mục <SYMBOL>_<tf>.json/.csv hoặc
+candles.db, thêm tickers.json và balance.json nếu có) hoặc sinh ngẫu nhiên
+theo seed. SimWorksheet giả lập
+worksheet gspread mà EntryStore/SheetSyncer dùng. Cả hai đều cấu hình được độ
+trễ và rate limit.
+
+    python simulator.py record --symbols ETH-USDT SOL-USDT --out fixtures
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+from pathlib import Path
+
+import backtest
+import main as bot
+
+TIMEFRAMES = ("15m", "1h", "4h", "1d")
+FEE = 0.001
+
+
+class SimError(Exception):
+    pass
+
+
+class RateLimitExceeded(SimError):
+    pass
+
+
+class InsufficientFunds(SimError):
+    pass
+
+
+class _Throttle:
+    """Token bucket: `rate` request/giây, tối đa `burst` request dồn."""
+
+    def __init__(self, rate=None, burst=None, strict=False):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate or 1.0)
+        self.strict = strict
+        self.waited = 0.0
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            if wait and self.strict:
+                self._tokens += 1
+                raise RateLimitExceeded(f"rate limit {self.rate}/s")
+            self.waited += wait
+        if wait:
+            time.sleep(wait)
+
+
+class _SimClient:
+    def __init__(self, latency=0.0, jitter=0.0, rate_limit=None, burst=None, strict_rate_limit=False, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle = _Throttle(rate_limit, burst, strict_rate_limit)
+        self.calls = {}
+        self._rng = random.Random(seed)
+        self._lock = threading.RLock()
+
+    def _call(self, name):
+        self.throttle.acquire()
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            delay = self.latency + (self._rng.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay:
+            time.sleep(delay)
+
+    def reset_counters(self):
+        with self._lock:
+            self.calls = {}
+            self.throttle.waited = 0.0
+
+
+def _symbol_seed(symbol, seed):
+    return zlib.crc32(f"{seed}:{symbol}".encode())
+
+
+def synthetic_candles(symbol, timeframe, bars=500, seed=0, now=None):
+    """Random walk theo seed của symbol; nến cuối là nến đang chạy tại `now`."""
+    period_ms = bot._tf_seconds(timeframe) * 1000
+    now_ms = int((time.time() if now is None else now) * 1000)
+    last_open = now_ms - now_ms % period_ms
+    sym_rng = random.Random(_symbol_seed(symbol, seed))
+    drift = sym_rng.uniform(-0.0015, 0.002)
+    vol = sym_rng.uniform(0.004, 0.015)
+    price = sym_rng.uniform(0.05, 500.0)
+    base_volume = sym_rng.uniform(2e5, 5e7) / price
+    rng = random.Random(_symbol_seed(f"{symbol}|{timeframe}", seed))
+    scale = (period_ms / 900_000) ** 0.5
+    candles = []
+    for i in range(bars):
+        o = price
+        price = max(o * (1 + drift * scale + rng.gauss(0, vol * scale)), 1e-8)
+        h = max(o, price) * (1 + abs(rng.gauss(0, vol * scale / 3)))
+        l = min(o, price) * (1 - abs(rng.gauss(0, vol * scale / 3)))
+        v = base_volume * period_ms / 86_400_000 * rng.uniform(0.3, 2.5)
+        candles.append([last_open - (bars - 1 - i) * period_ms, o, h, l, price, v])
+    return candles
+
+
+def _align_to_now(candles, timeframe, now=None):
+    # Dời fixture cũ để nến cuối trùng nến đang chạy, giữ logic cửa sổ của cache/kho nến.
+    if not candles:
+        return candles
+    period_ms = bot._tf_seconds(timeframe) * 1000
+    now_ms = int((time.time() if now is None else now) * 1000)
+    shift = (now_ms - now_ms % period_ms) - candles[-1][0]
+    return [[c[0] + shift] + list(c[1:6]) for c in candles]
+
+
+class SimExchange(_SimClient):
+    """Thay thế ccxt.okx cho bot: dữ liệu từ fixture hoặc sinh theo seed."""
+
+    def __init__(self, symbols=(), candles=None, tickers=None, balance=None, fixtures=None,
+                 history=500, seed=0, align=True, **kwargs):
+        super().__init__(seed=seed, **kwargs)
+        self.fixtures = fixtures
+        self.history = history
+        self.seed = seed
+        self.align = align
+        self._symbols = list(dict.fromkeys(symbols))
+        self._candles = dict(candles or {})
+        self._tickers = dict(tickers or {})
+        self.balance = {"USDT": 1000.0}
+        self.balance.update(balance or {})
+        self.frozen = {}
+        self.orders = []
+        self.algo_orders = {}
+        # Tỉ lệ khớp khi OCO kích hoạt (< 1 để thử khớp một phần).
+        self.algo_fill_ratio = 1.0
+
+    @classmethod
+    def synthetic(cls, count, quote="USDT", **kwargs):
+        symbols = ["BTC/USDT"] + [f"SIM{i:04d}/{quote}" for i in range(count)]
+        return cls(symbols, **kwargs)
+
+    @classmethod
+    def from_fixtures(cls, path, **kwargs):
+        """Nạp fixture do `record_fixtures` ghi (hoặc dữ liệu của backtest.py)."""
+        path = Path(path)
+        tickers, balance = {}, {}
+        root = path if path.is_dir() else path.parent
+        if (root / "tickers.json").exists():
+            tickers = json.loads((root / "tickers.json").read_text(encoding="utf-8"))
+        if (root / "balance.json").exists():
+            balance = json.loads((root / "balance.json").read_text(encoding="utf-8"))
+        symbols = [s.replace("-", "/") for s in backtest.list_symbols(str(path))]
+        return cls(symbols, tickers=tickers, balance=balance, fixtures=str(path), **kwargs)
+
+    def symbols(self):
+        return [s for s in self._symbols if s != "BTC/USDT"]
+
+    def _series(self, symbol, timeframe):
+        key = (symbol, timeframe)
+        with self._lock:
+            candles = self._candles.get(key)
+        if candles is not None:
+            return candles
+        if self.fixtures:
+            candles = backtest.load_timeframe(self.fixtures, symbol.replace("/", "-"), timeframe)
+            if self.align:
+                candles = _align_to_now(candles, timeframe)
+        elif symbol in self._symbols:
+            candles = synthetic_candles(symbol, timeframe, self.history, self.seed)
+        else:
+            candles = []
+        with self._lock:
+            return self._candles.setdefault(key, candles)
+
+    def set_price(self, symbol, price):
+        """Đẩy giá cuối của symbol (ticker + close nến đang chạy) để thử TP/SL; kích hoạt OCO."""
+        with self._lock:
+            for tf in TIMEFRAMES:
+                candles = self._candles.get((symbol, tf)) or self._series(symbol, tf)
+                if candles:
+                    last = candles[-1]
+                    last[2], last[3], last[4] = max(last[2], price), min(last[3], price), price
+            if symbol in self._tickers:
+                self._tickers[symbol] = dict(self._tickers[symbol], last=price, bid=price * 0.9998, ask=price * 1.0002)
+            for algo in list(self.algo_orders.values()):
+                if algo["symbol"] == symbol and algo["status"] == "open":
+                    sl, tp = algo["stopLossPrice"], algo["takeProfitPrice"]
+                    if (sl is not None and price <= sl) or (tp is not None and price >= tp):
+                        self._trigger(algo)
+
+    def _trigger(self, algo):
+        base = algo["symbol"].split("/")[0]
+        self.frozen[base] = self.frozen.get(base, 0.0) - algo["amount"]
+        filled = algo["amount"] * self.algo_fill_ratio
+        child = self._fill("sell", algo["symbol"], filled)
+        algo.update(status="closed", filled=filled, remaining=algo["amount"] - filled, info={"ordId": child["id"]})
+
+    def _ticker(self, symbol):
+        with self._lock:
+            recorded = self._tickers.get(symbol)
+        if recorded is not None:
+            return dict(recorded)
+        candles = self._series(symbol, "15m")
+        if not candles:
+            return None
+        last = candles[-1][4]
+        quote_volume = sum(c[4] * c[5] for c in candles[-96:])
+        return {
+            "symbol": symbol,
+            "timestamp": candles[-1][0],
+            "last": last,
+            "bid": last * 0.9998,
+            "ask": last * 1.0002,
+            "quoteVolume": quote_volume,
+            "info": {"volCcy24h": str(quote_volume)},
+        }
+
+    # ---------- ccxt surface ----------
+
+    def fetch_ohlcv(self, symbol, timeframe="1m", since=None, limit=None, params=None):
+        self._call("fetch_ohlcv")
+        candles = self._series(symbol, timeframe)
+        if since is not None:
+            rows = [c for c in candles if c[0] >= since]
+            rows = rows[:limit] if limit else rows
+        else:
+            rows = candles[-limit:] if limit else candles
+        return [list(c) for c in rows]
+
+    def fetch_ticker(self, symbol, params=None):
+        self._call("fetch_ticker")
+        tkr = self._ticker(symbol)
+        if tkr is None:
+            raise SimError(f"không có symbol {symbol}")
+        return tkr
+
+    def fetch_tickers(self, symbols=None, params=None):
+        self._call("fetch_tickers")
+        out = {}
+        for symbol in symbols or self._symbols:
+            tkr = self._ticker(symbol)
+            if tkr is not None:
+                out[symbol] = tkr
+        return out
+
+    def fetch_balance(self, params=None):
+        self._call("fetch_balance")
+        with self._lock:
+            out = {"info": {}, "free": {}, "used": {}, "total": {}}
+            for coin, amount in self.balance.items():
+                used = self.frozen.get(coin, 0.0)
+                out[coin] = {"free": amount - used, "used": used, "total": amount}
+                out["free"][coin], out["used"][coin], out["total"][coin] = amount - used, used, amount
+            return out
+
+    def _free(self, coin):
+        return self.balance.get(coin, 0.0) - self.frozen.get(coin, 0.0)
+
+    def _fill(self, side, symbol, amount):
+        base, quote = symbol.split("/")
+        tkr = self._ticker(symbol)
+        if tkr is None:
+            raise SimError(f"không có symbol {symbol}")
+        with self._lock:
+            if side == "buy":
+                price = tkr["ask"]
+                cost = amount * price
+                if cost > self.balance.get(quote, 0.0) + 1e-9:
+                    raise InsufficientFunds(f"cần {cost:.4f} {quote}, còn {self.balance.get(quote, 0.0):.4f}")
+                self.balance[quote] = self.balance.get(quote, 0.0) - cost
+                self.balance[base] = self.balance.get(base, 0.0) + amount * (1 - FEE)
+            else:
+                price = tkr["bid"]
+                if amount > self._free(base) + 1e-9:
+                    raise InsufficientFunds(f"cần {amount} {base}, còn {self._free(base)}")
+                self.balance[base] = self.balance.get(base, 0.0) - amount
+                self.balance[quote] = self.balance.get(quote, 0.0) + amount * price * (1 - FEE)
+                cost = amount * price
+            order = {
+                "id": str(len(self.orders) + 1),
+                "symbol": symbol,
+                "type": "market",
+                "side": side,
+                "amount": amount,
+                "filled": amount,
+                "price": price,
+                "average": price,
+                "cost": cost,
+                "status": "closed",
+            }
+            self.orders.append(order)
+            return dict(order)
+
+    def create_market_buy_order(self, symbol, amount, params=None):
+        self._call("create_market_buy_order")
+        return self._fill("buy", symbol, amount)
+
+    def create_market_sell_order(self, symbol, amount, params=None):
+        self._call("create_market_sell_order")
+        return self._fill("sell", symbol, amount)
+
+    def create_order(self, symbol, type, side, amount, price=None, params=None):
+        """Lệnh thường hoặc algo order (OCO nếu có cả stopLossPrice và takeProfitPrice)."""
+        self._call("create_order")
+        params = params or {}
+        sl, tp = params.get("stopLossPrice"), params.get("takeProfitPrice")
+        if sl is None and tp is None:
+            if type != "market":
+                raise SimError("SimExchange chỉ hỗ trợ lệnh market")
+            return self._fill(side, symbol, amount)
+        base = symbol.split("/")[0]
+        with self._lock:
+            if side != "sell" or amount > self._free(base) + 1e-9:
+                raise InsufficientFunds(f"cần {amount} {base} free cho algo order, còn {self._free(base)}")
+            self.frozen[base] = self.frozen.get(base, 0.0) + amount
+            algo = {
+                "id": f"algo-{len(self.algo_orders) + 1}",
+                "symbol": symbol,
+                "type": "oco" if sl is not None and tp is not None else "conditional",
+                "side": side,
+                "amount": amount,
+                "filled": 0.0,
+                "remaining": amount,
+                "stopLossPrice": sl,
+                "takeProfitPrice": tp,
+                "status": "open",
+                "info": {},
+            }
+            self.algo_orders[algo["id"]] = algo
+            return dict(algo)
+
+    def fetch_order(self, id, symbol=None, params=None):
+        self._call("fetch_order")
+        with self._lock:
+            algo = self.algo_orders.get(id)
+            if algo is not None:
+                return dict(algo)
+            for order in self.orders:
+                if order["id"] == id:
+                    return dict(order)
+        raise SimError(f"không có order {id}")
+
+    def cancel_order(self, id, symbol=None, params=None):
+        self._call("cancel_order")
+        with self._lock:
+            algo = self.algo_orders.get(id)
+            if algo is None or algo["status"] != "open":
+                raise SimError(f"không huỷ được order {id}")
+            base = algo["symbol"].split("/")[0]
+            self.frozen[base] = self.frozen.get(base, 0.0) - algo["amount"]
+            algo["status"] = "canceled"
+            return dict(algo)
+
+
+class SimWorksheet(_SimClient):
+    """Worksheet gspread trong bộ nhớ: đủ cho EntryStore bootstrap và SheetMutationBatcher."""
+
+    id = 0
+
+    def __init__(self, header=None, rows=(), **kwargs):
+        super().__init__(**kwargs)
+        self.header = list(header or bot.SHEET_COLUMNS)
+        self.rows = [list(r) for r in rows]
+
+    @classmethod
+    def from_entries(cls, entries, **kwargs):
+        rows = [[symbol, e.get("price"), e.get("stop"), e.get("tp"), e.get("timestamp")] for symbol, e in entries.items()]
+        return cls(bot.SHEET_COLUMNS, rows, **kwargs)
+
+    @property
+    def spreadsheet(self):
+        return self
+
+    def get_all_values(self):
+        self._call("get_all_values")
+        with self._lock:
+            return [list(self.header)] + [list(r) for r in self.rows]
+
+    def get_all_records(self):
+        self._call("get_all_records")
+        with self._lock:
+            return [dict(zip(self.header, r)) for r in self.rows]
+
+    def col_values(self, col):
+        self._call("col_values")
+        with self._lock:
+            return [self.header[col - 1]] + [r[col - 1] if len(r) >= col else "" for r in self.rows]
+
+    def append_row(self, values):
+        self._call("append_row")
+        with self._lock:
+            self.rows.append(list(values))
+
+    def delete_rows(self, index):
+        self._call("delete_rows")
+        with self._lock:
+            del self.rows[index - 2]
+
+    @staticmethod
+    def _value(cell):
+        value = cell.get("userEnteredValue")
+        return next(iter(value.values())) if value else ""
+
+    def batch_update(self, body):
+        self._call("batch_update")
+        with self._lock:
+            for req in body["requests"]:
+                if "updateCells" in req:
+                    u = req["updateCells"]
+                    row = self.rows[u["range"]["startRowIndex"] - 1]
+                    start = u["range"]["startColumnIndex"]
+                    values = [self._value(c) for c in u["rows"][0]["values"]]
+                    row.extend([""] * (start + len(values) - len(row)))
+                    row[start:start + len(values)] = values
+                elif "deleteDimension" in req:
+                    del self.rows[req["deleteDimension"]["range"]["startIndex"] - 1]
+                elif "appendCells" in req:
+                    for row in req["appendCells"]["rows"]:
+                        self.rows.append([self._value(c) for c in row["values"]])
+        return {"replies": [{} for _ in body["requests"]]}
+
+
+def record_fixtures(client, symbols, out_dir, timeframes=TIMEFRAMES, limit=300):
+    """Ghi nến/ticker/số dư thật thành fixture cho SimExchange.from_fixtures()."""
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    symbols = list(dict.fromkeys(["BTC/USDT"] + [s.replace("-", "/") for s in symbols]))
+    for symbol in symbols:
+        for tf in timeframes:
+            candles = client.fetch_ohlcv(symbol, timeframe=tf, limit=limit)
+            (out / f"{symbol.replace('/', '-')}_{tf}.json").write_text(json.dumps(candles), encoding="utf-8")
+    tickers = client.fetch_tickers()
+    (out / "tickers.json").write_text(json.dumps({s: tickers[s] for s in symbols if s in tickers}), encoding="utf-8")
+    balance = {coin: v["total"] for coin, v in client.fetch_balance().items()
+               if isinstance(v, dict) and "total" in v and isinstance(v["total"], (int, float))}
+    (out / "balance.json").write_text(json.dumps(balance), encoding="utf-8")
+    return len(symbols)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ghi fixture cho SimExchange từ OKX thật")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rec = sub.add_parser("record", help="ghi nến, ticker và số dư hiện tại")
+    rec.add_argument("--symbols", nargs="+", required=True)
+    rec.add_argument("--out", required=True)
+    rec.add_argument("--limit", type=int, default=300)
+    args = parser.parse_args(argv)
+
+    count = record_fixtures(bot.get_exchange(), args.symbols, args.out, limit=args.limit)
+    print(f"Đã ghi fixture cho {count} symbol vào {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# Các module của bot nằm phẳng ở thư mục gốc repo.
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+class _Messages(list):
+    def send(self, message):
+        self.append(message)
+
+    def stop(self, timeout=None):
+        pass
+
+
+@pytest.fixture
+def sim(monkeypatch, tmp_path):
+    """main.py chạy trên SimExchange/SimWorksheet với store tạm; trả về sàn giả lập.
+
+    Tin Telegram được giữ trong `sim.messages` thay vì gửi đi.
+    """
+    import main as bot
+    from simulator import SimExchange, SimWorksheet
+
+    monkeypatch.setattr(bot, "_clients", {})
+    monkeypatch.setattr(bot, "CANDLE_STORE_PATH", "")
+    monkeypatch.setattr(bot, "TREND_MEMO_PATH", "")
+    monkeypatch.setattr(bot, "TELEGRAM_TOKEN", "token")
+    monkeypatch.setattr(bot, "TELEGRAM_CHAT_ID", "chat")
+    exchange = SimExchange.synthetic(3, seed=1, balance={"USDT": 1000})
+    exchange.messages = _Messages()
+    bot.set_exchange(exchange)
+    bot.set_storage_sheet(SimWorksheet())
+    bot.set_entry_store(bot.EntryStore(tmp_path / "entries.db"))
+    bot.get_entry_store().replace_all({})  # coi như đã nạp từ Sheet
+    bot.set_telegram_notifier(exchange.messages)
+    bot.market_cache.reset()
+    yield exchange
+    bot.market_cache.reset()
@@ -0,0 +1,91 @@
+"""Lệnh OCO phía sàn (EXCHANGE_EXITS) chạy trên SimExchange."""
+import pytest
+
+import main as bot
+
+SYMBOL = "SIM0000/USDT"
+SYMBOL_DASH = "SIM0000-USDT"
+
+
+@pytest.fixture
+def armed(sim, monkeypatch):
+    """Mua SIM0000 với EXCHANGE_EXITS bật; trả về (giá vào, entry)."""
+    monkeypatch.setattr(bot, "EXCHANGE_EXITS", True)
+    # auto_sell_once bỏ qua số dư < 1 coin, nên đưa giá về mức mua được vài chục coin.
+    price = 10.0
+    sim.set_price(SYMBOL, price)
+    screen = (True, price, price * 0.97, price * 1.05, "ok")
+    assert bot._process_buy(SYMBOL_DASH, "TĂNG", screen=screen)
+    return price, bot.get_entry_store().get(SYMBOL_DASH)
+
+
+def _coin(sim):
+    return sim.fetch_balance()["SIM0000"]
+
+
+def test_buy_arms_oco_for_filled_amount(sim, armed):
+    price, entry = armed
+    algo = sim.algo_orders[entry["algo_id"]]
+    assert algo["status"] == "open" and algo["type"] == "oco"
+    assert algo["amount"] == pytest.approx(_coin(sim)["total"])
+    assert algo["stopLossPrice"] == pytest.approx(entry["stop"])
+    assert algo["takeProfitPrice"] == pytest.approx(entry["tp"])
+    assert _coin(sim)["free"] == pytest.approx(0)
+
+
+def test_open_oco_is_left_alone(sim, armed):
+    _, entry = armed
+    assert bot.reconcile_exchange_exits() == 0
+    bot.auto_sell_once()
+    assert bot.get_entry_store().get(SYMBOL_DASH)["algo_id"] == entry["algo_id"]
+    assert [o["side"] for o in sim.orders] == ["buy"]
+
+
+@pytest.mark.parametrize("move", [1.06, 0.9], ids=["tp", "sl"])
+def test_triggered_oco_removes_entry(sim, armed, move):
+    price, _ = armed
+    sim.set_price(SYMBOL, price * move)
+    assert bot.reconcile_exchange_exits() == 1
+    assert bot.get_entry_store().get(SYMBOL_DASH) is None
+    assert _coin(sim)["total"] == pytest.approx(0)
+    assert any("OCO SIM0000-USDT đã khớp" in m for m in sim.messages)
+
+
+def test_partial_fill_rearms_remaining(sim, armed):
+    price, entry = armed
+    bought = _coin(sim)["total"]
+    sim.algo_fill_ratio = 0.5
+    sim.set_price(SYMBOL, price * 1.06)
+
+    assert bot.reconcile_exchange_exits() == 1
+    rearmed = bot.get_entry_store().get(SYMBOL_DASH)
+    assert rearmed["algo_id"] not in (None, entry["algo_id"])
+    algo = sim.algo_orders[rearmed["algo_id"]]
+    assert algo["status"] == "open"
+    assert algo["amount"] == pytest.approx(bought / 2)
+
+    sim.algo_fill_ratio = 1.0
+    sim.set_price(SYMBOL, price * 0.9)
+    assert bot.reconcile_exchange_exits() == 1
+    assert bot.get_entry_store().get(SYMBOL_DASH) is None
+
+
+def test_canceled_oco_falls_back_to_auto_sell(sim, armed):
+    price, entry = armed
+    sim.cancel_order(entry["algo_id"])
+    assert bot.reconcile_exchange_exits() == 1
+    assert bot.get_entry_store().get(SYMBOL_DASH)["algo_id"] is None
+
+    sim.set_price(SYMBOL, price * 1.1)
+    bot.market_cache.reset()
+    bot.auto_sell_once()
+    assert bot.get_entry_store().get(SYMBOL_DASH) is None
+    assert [o["side"] for o in sim.orders] == ["buy", "sell"]
+
+
+def test_canceled_oco_without_coins_removes_entry(sim, armed):
+    _, entry = armed
+    sim.cancel_order(entry["algo_id"])
+    sim.balance["SIM0000"] = 0.0
+    assert bot.reconcile_exchange_exits() == 1
+    assert bot.get_entry_store().get(SYMBOL_DASH) is None
@@ -0,0 +1,292 @@
+"""So sánh indicators.* và RollingBollinger với bản sao helper gốc của main.py."""
+import math
+import random
+
+import numpy as np
+import pytest
+
+import indicators
+
+
+# ---------- Helper gốc (đóng băng từ main.py trước khi vector hoá) ----------
+
+def _percentile(vals, q):
+    vals = [float(x) for x in vals if x is not None]
+    if not vals:
+        return None
+    vals.sort()
+    k = max(0, min(len(vals) - 1, int(round(q * (len(vals) - 1)))))
+    return vals[k]
+
+
+def _ema(series, n):
+    if len(series) < n:
+        return None
+    k = 2 / (n + 1)
+    s = sum(series[:n]) / n
+    for x in series[n:]:
+        s = x * k + s * (1 - k)
+    return s
+
+
+def _adx14(ohlcv):
+    if len(ohlcv) < 20:
+        return None
+
+    def tr(h, l, pc):
+        return max(h - l, abs(h - pc), abs(l - pc))
+
+    plus_dm, minus_dm, trs = [], [], []
+    for i in range(1, len(ohlcv)):
+        h1, l1 = ohlcv[i][2], ohlcv[i][3]
+        h0, l0 = ohlcv[i - 1][2], ohlcv[i - 1][3]
+        up = h1 - h0
+        dn = l0 - l1
+        plus_dm.append(up if (up > dn and up > 0) else 0.0)
+        minus_dm.append(dn if (dn > up and dn > 0) else 0.0)
+        trs.append(tr(h1, l1, ohlcv[i - 1][4]))
+
+    n = 14
+
+    def smma(vals):
+        s = sum(vals[:n])
+        prev = s / n
+        out = [prev]
+        for x in vals[n:]:
+            prev = (prev * (n - 1) + x) / n
+            out.append(prev)
+        return out[-1]
+
+    tr_n = smma(trs)
+    plus_n = smma(plus_dm)
+    minus_n = smma(minus_dm)
+    if tr_n == 0:
+        return None
+    dip = 100 * (plus_n / tr_n)
+    dim = 100 * (minus_n / tr_n)
+    if (dip + dim) == 0:
+        return None
+    dx = 100 * abs(dip - dim) / (dip + dim)
+    return dx
+
+
+def _atr_pct(ohlcv, n=14):
+    if len(ohlcv) < n + 2:
+        return 0.0
+
+    def tr(h, l, pc):
+        return max(h - l, abs(h - pc), abs(l - pc))
+
+    trs = []
+    pc = ohlcv[-(n + 1)][4]
+    for i in range(len(ohlcv) - n, len(ohlcv)):
+        h, l, c = ohlcv[i][2], ohlcv[i][3], ohlcv[i][4]
+        trs.append(tr(h, l, pc))
+        pc = c
+    atr = sum(trs) / len(trs)
+    close = ohlcv[-1][4] or 0.0
+    return atr / close if close else 0.0
+
+
+def _bb_width(closes, n=20, k=2.0):
+    if len(closes) < n:
+        return 0.0
+    w = closes[-n:]
+    ma = sum(w) / n
+    std = (sum((x - ma) ** 2 for x in w) / n) ** 0.5
+    upper = ma + k * std
+    lower = ma - k * std
+    return (upper - lower) / ma if ma else 0.0
+
+
+def compute_rsi(closes, period=14):
+    deltas = [closes[i] - closes[i - 1] for i in range(1, len(closes))]
+    gains = [delta if delta > 0 else 0 for delta in deltas]
+    losses = [-delta if delta < 0 else 0 for delta in deltas]
+
+    avg_gain = sum(gains[:period]) / period
+    avg_loss = sum(losses[:period]) / period
+    if avg_loss == 0:
+        return 100
+
+    rs = avg_gain / avg_loss
+    rsi = 100 - (100 / (1 + rs))
+    return rsi
+
+
+# ---------- Dữ liệu ----------
+
+def _candles(seed, n, start=100.0):
+    rng = random.Random(seed)
+    out, price = [], start
+    for i in range(n):
+        o = price
+        c = max(o * (1 + rng.gauss(0, 0.01)), 1e-6)
+        h = max(o, c) * (1 + abs(rng.gauss(0, 0.004)))
+        l = min(o, c) * (1 - abs(rng.gauss(0, 0.004)))
+        out.append([i * 900_000, o, h, l, c, rng.uniform(10, 1000)])
+        price = c
+    return out
+
+
+SEEDS = range(8)
+LENGTHS = [5, 16, 20, 21, 40, 150]
+
+
+def _cols(ohlcv):
+    cols = indicators.to_columns(ohlcv)
+    return cols[indicators.HIGH], cols[indicators.LOW], cols[indicators.CLOSE]
+
+
+def _same(new, old):
+    if old is None:
+        assert new is None or math.isnan(new)
+    else:
+        assert float(new) == pytest.approx(old, rel=1e-9, abs=1e-12)
+
+
+# ---------- Từng helper ----------
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("length", LENGTHS)
+def test_ema_last(seed, length):
+    closes = [c[4] for c in _candles(seed, length)]
+    for n in (9, 20, 50):
+        _same(indicators.ema_last(closes, n), _ema(closes, n))
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("length", LENGTHS)
+def test_rsi_first_window(seed, length):
+    closes = [c[4] for c in _candles(seed, length)]
+    if length > 14:
+        _same(indicators.rsi_first_window(closes), compute_rsi(closes))
+
+
+def test_rsi_first_window_no_losses():
+    closes = [float(x) for x in range(1, 30)]
+    assert float(indicators.rsi_first_window(closes)) == compute_rsi(closes) == 100
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("length", LENGTHS)
+def test_dx_last(seed, length):
+    ohlcv = _candles(seed, length)
+    if length >= 20:
+        _same(indicators.dx_last(*_cols(ohlcv)), _adx14(ohlcv))
+    else:
+        assert _adx14(ohlcv) is None
+        assert math.isnan(indicators.dx_last(*_cols(ohlcv)))
+
+
+def test_dx_last_flat_market():
+    ohlcv = [[i, 1.0, 1.0, 1.0, 1.0, 1.0] for i in range(30)]
+    assert _adx14(ohlcv) is None
+    assert math.isnan(indicators.dx_last(*_cols(ohlcv)))
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("length", LENGTHS)
+def test_atr_pct_last(seed, length):
+    ohlcv = _candles(seed, length)
+    for n in (7, 14):
+        _same(indicators.atr_pct_last(*_cols(ohlcv), n), _atr_pct(ohlcv, n))
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("length", LENGTHS)
+def test_bb_width_last(seed, length):
+    closes = [c[4] for c in _candles(seed, length)]
+    _same(indicators.bb_width_last(closes), _bb_width(closes))
+    series = indicators.bb_width_series(closes)
+    for i in range(20, length + 1):
+        _same(series[i - 1], _bb_width(closes[:i]))
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("q", [0.0, 0.25, 0.5, 0.9, 1.0])
+def test_percentile(seed, q):
+    rng = random.Random(seed)
+    vals = [rng.uniform(0, 100) for _ in range(rng.randint(1, 60))]
+    _same(indicators.percentile(vals, q), _percentile(vals, q))
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_rolling_percentile(seed):
+    rng = random.Random(seed)
+    vals = [rng.uniform(0, 100) for _ in range(80)]
+    out = indicators.rolling_percentile(vals, 20, 0.25)
+    for i in range(20, len(vals) + 1):
+        _same(out[i - 1], _percentile(vals[i - 20:i], 0.25))
+
+
+# ---------- Nhiều symbol xếp chồng ----------
+
+def test_stacked_matches_per_symbol():
+    series = [_candles(seed, 60 + 7 * seed) for seed in SEEDS]
+    stacked = indicators.stack_ohlcv(series)
+    high, low, close = stacked[indicators.HIGH], stacked[indicators.LOW], stacked[indicators.CLOSE]
+    n = stacked.shape[-1]
+    dx = indicators.dx_last(high, low, close)
+    atr = indicators.atr_pct_last(high, low, close)
+    bbw = indicators.bb_width_last(close)
+    ema = indicators.ema_last(close, 20)
+    rsi = indicators.rsi_first_window(close)
+    for i, ohlcv in enumerate(series):
+        tail = ohlcv[-n:]
+        closes = [c[4] for c in tail]
+        _same(dx[i], _adx14(tail))
+        _same(atr[i], _atr_pct(tail))
+        _same(bbw[i], _bb_width(closes))
+        _same(ema[i], _ema(closes, 20))
+        _same(rsi[i], compute_rsi(closes))
+
+
+# ---------- RollingBollinger ----------
+
+def _baseline_bollinger(closes, q):
+    # Cách evaluate_entry cũ tính ngưỡng: percentile các độ rộng của mọi tiền tố trước nến cuối.
+    widths = [_bb_width(closes[:i]) for i in range(20, len(closes))]
+    return _bb_width(closes), _percentile(widths, q)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("length", [20, 21, 40, 150])
+@pytest.mark.parametrize("q", [0.1, 0.25, 0.5])
+def test_rolling_bollinger_extend(seed, length, q):
+    closes = [c[4] for c in _candles(seed, length)]
+    stats = indicators.RollingBollinger()
+    width = stats.extend(closes)
+    old_width, old_pct = _baseline_bollinger(closes, q)
+    _same(width, old_width)
+    _same(stats.percentile(q), old_pct)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_rolling_bollinger_append(seed):
+    closes = [c[4] for c in _candles(seed, 200)]
+    stats = indicators.RollingBollinger()
+    stats.extend(closes[:30])
+    for i in range(30, len(closes)):
+        width = stats.append(closes[i])
+        old_width, old_pct = _baseline_bollinger(closes[: i + 1], 0.25)
+        _same(width, old_width)
+        _same(stats.percentile(0.25), old_pct)
+
+
+def test_rolling_bollinger_history_window():
+    closes = [c[4] for c in _candles(3, 120)]
+    stats = indicators.RollingBollinger(history=30)
+    stats.extend(closes[:60])
+    for x in closes[60:]:
+        stats.append(x)
+    widths = [_bb_width(closes[:i]) for i in range(20, len(closes))][-30:]
+    assert len(stats) == 30
+    _same(stats.percentile(0.25), _percentile(widths, 0.25))
+
+
+def test_rolling_bollinger_short_series():
+    stats = indicators.RollingBollinger()
+    assert stats.extend([1.0] * 10) is None
+    assert stats.percentile(0.25) is None
+    assert np.isnan(indicators.bb_width_series([1.0] * 10)).all()
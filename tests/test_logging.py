@@ -0,0 +1,54 @@
+"""_RepeatFilter chỉ ẩn cảnh báo lặp lại của cùng một coin."""
+import logging
+
+import instrumentation
+import main as bot
+
+
+def _passes(filters, msg, *args):
+    record = bot.logger.makeRecord(bot.logger.name, logging.WARNING, __file__, 0, msg, args, None)
+    return all(f.filter(record) for f in filters), record
+
+
+def _filters(window=300):
+    return [bot._ContextFilter(), bot._RepeatFilter(window)]
+
+
+def test_same_timeframe_different_symbols_are_all_emitted():
+    filters = _filters()
+    msg = "⚠️ Không thể fetch nến %s cho %s: %s"
+    for symbol in ("AAA-USDT", "BBB-USDT", "CCC-USDT"):
+        assert _passes(filters, msg, "15m", symbol, TimeoutError("timeout"))[0]
+    assert not _passes(filters, msg, "15m", "AAA-USDT", TimeoutError("timeout khác"))[0]
+
+
+def test_symbol_from_scope_is_part_of_key():
+    filters = _filters()
+    msg = "⚠️ Không thể dựng nến %s từ %s: %s"
+    for symbol in ("AAA-USDT", "BBB-USDT"):
+        with instrumentation.symbol_scope(symbol):
+            assert _passes(filters, msg, "1h", "15m", ValueError("thiếu nến"))[0]
+    with instrumentation.symbol_scope("AAA-USDT"):
+        assert not _passes(filters, msg, "1h", "15m", ValueError("thiếu nến"))[0]
+
+
+def test_suppressed_count_on_next_emit(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(bot.time, "monotonic", lambda: clock[0])
+    filters = _filters(window=10)
+    msg = "⚠️ %s entry_price KHÔNG phải số: %s"
+    assert _passes(filters, msg, "X-USDT", None)[0]
+    assert not _passes(filters, msg, "X-USDT", None)[0]
+    assert not _passes(filters, msg, "X-USDT", None)[0]
+    clock[0] += 11
+    emitted, record = _passes(filters, msg, "X-USDT", None)
+    assert emitted and record.suppressed == 2
+
+
+def test_other_levels_and_disabled_window_pass_through():
+    filters = _filters(window=0)
+    assert _passes(filters, "⚠️ %s", "X")[0]
+    assert _passes(filters, "⚠️ %s", "X")[0]
+    record = bot.logger.makeRecord(bot.logger.name, logging.ERROR, __file__, 0, "❌ %s", ("X",), None)
+    repeat = bot._RepeatFilter(300)
+    assert repeat.filter(record) and repeat.filter(record)
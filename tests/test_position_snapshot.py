@@ -0,0 +1,118 @@
+"""PositionSnapshot.exit_reasons phải ra cùng quyết định với vòng lặp _exit_reason cũ."""
+import logging
+import random
+
+import pytest
+
+import main as bot
+
+
+@pytest.fixture(autouse=True)
+def _quiet_logger():
+    level = bot.logger.level
+    bot.logger.setLevel(logging.CRITICAL)
+    yield
+    bot.logger.setLevel(level)
+
+
+def _old_exit_decisions(balances, entries, tickers):
+    # Bộ lọc và luật thoát của auto_sell_once trước PositionSnapshot (duyệt toàn bộ số dư).
+    decisions = {}
+    for coin, balance_data in balances.items():
+        if not isinstance(balance_data, dict) or "total" not in balance_data:
+            continue
+        balance = float(balance_data.get("total", 0))
+        if balance < 1 or coin.upper() == "USDT":
+            continue
+        symbol_dash = f"{coin}-USDT"
+        symbol_slash = f"{coin}/USDT"
+        ticker = tickers.get(symbol_dash) or tickers.get(symbol_slash)
+        if not ticker or "last" not in ticker:
+            continue
+        try:
+            current_price = float(ticker["last"])
+        except Exception:
+            continue
+        entry_data = entries.get(symbol_dash)
+        if not isinstance(entry_data, dict):
+            continue
+        if not isinstance(entry_data.get("price"), (int, float)):
+            continue
+        if entry_data.get("algo_id"):
+            continue
+        decisions[symbol_dash] = bot._exit_reason(entry_data, current_price)
+    return decisions
+
+
+def _new_exit_decisions(balances, entries, tickers):
+    snapshot = bot.PositionSnapshot.build(balances, entries, skip_armed=True)
+    prices = snapshot.prices(tickers)
+    reasons = snapshot.exit_reasons(prices)
+    return {
+        p.symbol_dash: reason
+        for p, price, reason in zip(snapshot, prices, reasons)
+        if price == price
+    }
+
+
+def _portfolio(seed, size=300):
+    rng = random.Random(seed)
+    balances = {"USDT": {"total": 1000.0}, "free": {}, "total": {}, "used": {}, "info": {}}
+    entries, prices = {}, {}
+    for i in range(size):
+        coin = f"C{i}"
+        entry = rng.uniform(0.01, 100)
+        balances[coin] = {"total": rng.choice([0, 0.2, 1, 3.5, 250])}
+        entries[f"{coin}-USDT"] = {
+            "price": rng.choice([entry] * 8 + ["1.5", None]),
+            "stop": rng.choice([None, "", "0.9", entry * rng.uniform(0.8, 1.0)]),
+            "tp": rng.choice([None, "x", entry * rng.uniform(1.0, 1.5)]),
+            "algo_id": rng.choice([None] * 5 + ["A1"]),
+        }
+        prices[coin] = entry
+    # Số dư không có entry và entry không còn số dư.
+    balances["ORPHAN"] = {"total": 10.0}
+    entries["GONE-USDT"] = {"price": 1.0, "stop": 0.9, "tp": 1.1}
+    return rng, balances, entries, prices
+
+
+def _tickers(rng, prices):
+    tickers = {}
+    for coin, price in prices.items():
+        roll = rng.random()
+        if roll < 0.02:
+            continue
+        if roll < 0.03:
+            tickers[f"{coin}/USDT"] = {"last": "n/a"}
+        elif roll < 0.5:
+            tickers[f"{coin}/USDT"] = {"last": price}
+        else:
+            tickers[f"{coin}-USDT"] = {"last": price}
+    return tickers
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_exit_reasons_match_old_loop_over_price_series(seed):
+    rng, balances, entries, prices = _portfolio(seed)
+    fired = set()
+    for _ in range(120):
+        prices = {coin: price * (1 + rng.gauss(0, 0.03)) for coin, price in prices.items()}
+        tickers = _tickers(rng, prices)
+        old = _old_exit_decisions(balances, entries, tickers)
+        assert _new_exit_decisions(balances, entries, tickers) == old
+        fired.update(reason for reason in old.values() if reason)
+    assert fired == {"tp", "sl", "gain"}
+
+
+def test_exit_reasons_boundaries():
+    entries = {
+        "A-USDT": {"price": 10.0, "stop": 9.0, "tp": 12.0},
+        "B-USDT": {"price": 10.0, "stop": 9.0, "tp": 12.0},
+        "C-USDT": {"price": 10.0, "stop": None, "tp": None},
+        "D-USDT": {"price": 10.0, "stop": 9.0, "tp": 8.0},
+    }
+    balances = {coin: {"total": 5} for coin in "ABCD"}
+    snapshot = bot.PositionSnapshot.build(balances, entries)
+    prices = [12.0, 9.0, 13.0, 8.5]
+    expected = [bot._exit_reason(p.entry, price) for p, price in zip(snapshot, prices)]
+    assert snapshot.exit_reasons(prices) == expected == ["tp", "sl", "gain", "tp"]
@@ -0,0 +1,38 @@
+"""Ngân sách run_bot của một tài khoản được chia cho các shard."""
+import argparse
+
+import pytest
+
+import shard
+
+
+def _args(tmp_path, shards):
+    return argparse.Namespace(
+        shards_per_account=shards, daemon=False, workers=4, state_dir=str(tmp_path),
+        max_runtime=None, simulate=10, seed=0,
+    )
+
+
+@pytest.mark.parametrize("orders,shards", [(5, 2), (4, 4), (1, 3), (7, 1)])
+def test_order_budget_is_split_across_shards(tmp_path, orders, shards):
+    accounts = [{"name": "a", "env": {"MAX_ORDERS_PER_RUN": str(orders), "RUN_CAPITAL_USDT": "90"}}]
+    jobs, _ = shard.build_jobs(accounts, _args(tmp_path, shards))
+    limits = [int(job["env"]["MAX_ORDERS_PER_RUN"]) for job in jobs]
+    assert sum(max(limit, 0) for limit in limits) == orders
+    assert all(limit != 0 for limit in limits)
+    assert sum(float(job["env"]["RUN_CAPITAL_USDT"]) for job in jobs) == pytest.approx(90)
+
+
+def test_unlimited_budget_stays_unlimited(tmp_path, monkeypatch):
+    monkeypatch.delenv("MAX_ORDERS_PER_RUN", raising=False)
+    monkeypatch.delenv("RUN_CAPITAL_USDT", raising=False)
+    jobs, _ = shard.build_jobs([{"name": "a"}], _args(tmp_path, 3))
+    assert all("MAX_ORDERS_PER_RUN" not in job["env"] for job in jobs)
+    assert all("RUN_CAPITAL_USDT" not in job["env"] for job in jobs)
+
+
+def test_negative_order_budget_blocks_entries():
+    import main as bot
+
+    assert bot.RunBudget(max_orders=-1, capital=0).exhausted()
+    assert not bot.RunBudget(max_orders=0, capital=0).exhausted()
@@ -0,0 +1,116 @@
+"""TelegramNotifier gửi tới một stub http.server thay cho api.telegram.org."""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import pytest
+
+import main as bot
+
+
+class _Stub(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.requests = []
+        self.responses = []  # (status, body); hết thì trả 200
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"])).decode("utf-8")
+        self.server.requests.append((time.monotonic(), self.path, {k: v[0] for k, v in parse_qs(body).items()}))
+        status, payload = self.server.responses.pop(0) if self.server.responses else (200, {"ok": True})
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    server = _Stub()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(bot, "_clients", {})
+    monkeypatch.setattr(bot, "TELEGRAM_API_URL", server.url)
+    monkeypatch.setattr(bot, "TELEGRAM_TOKEN", "123:abc")
+    monkeypatch.setattr(bot, "TELEGRAM_CHAT_ID", "42")
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_messages_in_window_are_coalesced(stub):
+    notifier = bot.TelegramNotifier(window=0.3)
+    started = time.monotonic()
+    for i in range(3):
+        notifier.send(f"tin {i}")
+    assert time.monotonic() - started < 0.1
+    notifier.stop(timeout=5)
+
+    assert len(stub.requests) == 1
+    _, path, form = stub.requests[0]
+    assert path == "/bot123:abc/sendMessage"
+    assert form["chat_id"] == "42"
+    assert form["text"] == "tin 0\n\ntin 1\n\ntin 2"
+    assert (notifier.sent, notifier.dropped) == (1, 0)
+
+
+def test_429_waits_retry_after_then_delivers(stub):
+    stub.responses = [(429, {"ok": False, "error_code": 429, "parameters": {"retry_after": 0.3}})]
+    notifier = bot.TelegramNotifier(window=0)
+    notifier.send("✅ BUY")
+    notifier.stop(timeout=5)
+
+    assert len(stub.requests) == 2
+    assert stub.requests[1][0] - stub.requests[0][0] >= 0.3
+    assert stub.requests[1][2]["text"] == "✅ BUY"
+    assert (notifier.sent, notifier.dropped) == (1, 0)
+
+
+def test_client_error_is_dropped_without_retry(stub):
+    stub.responses = [(400, {"ok": False, "description": "Bad Request: can't parse entities"})]
+    notifier = bot.TelegramNotifier(window=0)
+    notifier.send("*lỗi markdown")
+    notifier.stop(timeout=5)
+
+    assert len(stub.requests) == 1
+    assert (notifier.sent, notifier.dropped) == (0, 1)
+
+
+def test_stop_gives_up_when_retry_after_exceeds_flush_budget(stub):
+    stub.responses = [(429, {"ok": False, "parameters": {"retry_after": 30}})]
+    notifier = bot.TelegramNotifier(window=0)
+    notifier.send("tin")
+    time.sleep(0.2)
+    started = time.monotonic()
+    notifier.stop(timeout=0.5)
+
+    assert time.monotonic() - started < 2
+    assert len(stub.requests) == 1
+    assert notifier.dropped == 1
+
+
+def test_long_batches_are_split_on_message_boundaries(stub):
+    notifier = bot.TelegramNotifier(window=0.3)
+    messages = [f"{i}:" + "x" * 1500 for i in range(5)]
+    for message in messages:
+        notifier.send(message)
+    notifier.stop(timeout=5)
+
+    texts = [form["text"] for _, _, form in stub.requests]
+    assert all(len(text) <= bot.TELEGRAM_MAX_CHARS for text in texts)
+    assert "\n\n".join(texts) == "\n\n".join(messages)
@@ -0,0 +1,43 @@
+"""TrendMemo: tra cứu không ghi đĩa, thời điểm dùng được ghi khi flush/put."""
+import main as bot
+
+
+def test_hits_do_not_write_until_flush(tmp_path):
+    memo = bot.TrendMemo(tmp_path / "memo.db", max_symbols=10)
+    memo.put("AAA-USDT", "1h", 1000, 2)
+    memo.put("BBB-USDT", "1h", 1000, -1)
+    changes = memo._conn.total_changes
+    for _ in range(50):
+        assert memo.get("AAA-USDT", "1h", 1000) == 2
+    assert memo.get("AAA-USDT", "1h", 2000) is None
+    assert memo._conn.total_changes == changes
+
+    memo.flush()
+    assert memo._conn.total_changes == changes + 1
+    memo.flush()
+    assert memo._conn.total_changes == changes + 1
+
+
+def test_flushed_recency_survives_reload(tmp_path):
+    path = tmp_path / "memo.db"
+    memo = bot.TrendMemo(path, max_symbols=2)
+    memo.put("AAA-USDT", "1h", 1000, 1)
+    memo.put("BBB-USDT", "1h", 1000, 1)
+    memo.get("AAA-USDT", "1h", 1000)
+    memo.flush()
+
+    reloaded = bot.TrendMemo(path, max_symbols=2)
+    reloaded.put("CCC-USDT", "1h", 1000, 1)
+    assert reloaded.get("AAA-USDT", "1h", 1000) == 1
+    assert reloaded.get("BBB-USDT", "1h", 1000) is None
+
+
+def test_put_writes_pending_touches(tmp_path):
+    path = tmp_path / "memo.db"
+    memo = bot.TrendMemo(path, max_symbols=10)
+    memo.put("AAA-USDT", "1h", 1000, 1)
+    memo.put("BBB-USDT", "1h", 1000, 1)
+    memo.get("AAA-USDT", "1h", 1000)
+    memo.put("CCC-USDT", "4h", 1000, 1)
+    order = [row[0] for row in memo._conn.execute("SELECT symbol FROM trend_memo ORDER BY used_at")]
+    assert order == ["BBB-USDT", "AAA-USDT", "CCC-USDT"]
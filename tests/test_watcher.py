@@ -0,0 +1,76 @@
+"""watch_and_sell chạy bằng ReplayFeed trên SimExchange."""
+import json
+
+import pytest
+
+import main as bot
+
+SYMBOL = "SIM0002/USDT"
+SYMBOL_DASH = "SIM0002-USDT"
+
+
+@pytest.fixture
+def held(sim):
+    """10 SIM0002 với SL -10% / TP +10%; trả về giá vào."""
+    price = sim._ticker(SYMBOL)["last"]
+    sim.balance["SIM0002"] = 10.0
+    bot.get_entry_store().upsert(SYMBOL_DASH, price, price * 0.9, price * 1.1, bot._now_iso())
+    return price
+
+
+def test_price_feed_is_abstract():
+    with pytest.raises(TypeError):
+        bot.PriceFeed()
+
+    class Partial(bot.PriceFeed):
+        def subscribe(self, symbols):
+            pass
+
+    with pytest.raises(TypeError):
+        Partial()
+
+
+@pytest.mark.parametrize("move,reason", [(1.12, "tp"), (0.85, "sl")])
+def test_exit_tick_sells_once_and_removes_entry(sim, held, move, reason):
+    ticks = [
+        ("SIM0001/USDT", held * 2),  # không giữ -> bỏ qua
+        (SYMBOL, held),
+        (SYMBOL, held * 1.05),
+        (SYMBOL, held * move),
+        (SYMBOL, held * move),  # đã bán -> đã bỏ đăng ký
+    ]
+    bot.watch_and_sell(bot.ReplayFeed(ticks))
+
+    assert [(o["side"], o["symbol"]) for o in sim.orders] == [("sell", SYMBOL)]
+    assert sim.orders[0]["amount"] == pytest.approx(10.0)
+    assert bot.get_entry_store().get(SYMBOL_DASH) is None
+
+
+def test_quiet_prices_do_not_sell(sim, held):
+    bot.watch_and_sell(bot.ReplayFeed([(SYMBOL, held * x) for x in (0.95, 1.0, 1.05, 1.09)]))
+    assert sim.orders == []
+    assert bot.get_entry_store().get(SYMBOL_DASH) is not None
+
+
+def test_replay_from_jsonl(sim, held, tmp_path):
+    path = tmp_path / "ticks.jsonl"
+    path.write_text(
+        "\n".join(json.dumps({"symbol": SYMBOL, "last": held * x}) for x in (1.0, 1.2)) + "\n",
+        encoding="utf-8",
+    )
+    bot.watch_and_sell(bot.ReplayFeed(path))
+    assert [o["side"] for o in sim.orders] == ["sell"]
+
+
+def test_armed_positions_are_not_watched(sim, held):
+    bot.get_entry_store().set_algo_id(SYMBOL_DASH, "algo-1")
+    bot.watch_and_sell(bot.ReplayFeed([(SYMBOL, held * 1.5)]))
+    assert sim.orders == []
+
+
+def test_failed_sell_backs_off(sim, held, monkeypatch):
+    calls = []
+    monkeypatch.setattr(bot, "_sell_position", lambda *args: calls.append(args) or False)
+    bot.watch_and_sell(bot.ReplayFeed([(SYMBOL, held * 1.2)] * 200))
+    assert len(calls) == 1
+    assert bot.get_entry_store().get(SYMBOL_DASH) is not None